@@ -0,0 +1,60 @@
+"""
+Regression benchmark for HasGeneMapper over a names.dmp-sized batch stream.
+
+Run from src/ folder, in the hub environment, with:
+python -m benchmarks.bench_has_gene [docs] [gene_taxids]
+"""
+import random
+import sys
+import time
+
+from hub.databuild.mapper import HasGeneMapper
+from taxonomy.tree import TaxidBitmap
+
+BATCH_SIZE = 10000
+# list membership is O(M): only time a sample and extrapolate
+LIST_SAMPLE = 20000
+
+
+def doc_batches(taxids, batch_size=BATCH_SIZE):
+    # names docs, as yielded by parse_refseq_names
+    for start in range(0, len(taxids), batch_size):
+        yield [{"_id": str(taxid), "taxid": taxid}
+               for taxid in taxids[start:start + batch_size]]
+
+
+def main(size=2600000, gene_taxids=40000, seed=42):
+    rnd = random.Random(seed)
+    taxids = rnd.sample(range(1, int(size * 1.3)), size)
+    has_gene = rnd.sample(taxids, gene_taxids)
+
+    # previous implementation: list of geneinfo _ids
+    cache = [str(taxid) for taxid in has_gene]
+    sample = taxids[:LIST_SAMPLE]
+    start = time.perf_counter()
+    list_hits = sum(str(taxid) in cache for taxid in sample)
+    elapsed = time.perf_counter() - start
+    print("%-35s %10.2fs (extrapolated from %d docs)" % (
+        "list membership", elapsed * size / len(sample), len(sample)))
+
+    mapper = HasGeneMapper(name="has_gene")
+    start = time.perf_counter()
+    mapper.cache = TaxidBitmap(has_gene)
+    mapper.load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for docs in doc_batches(taxids):
+        for _ in mapper.process(docs):
+            pass
+    elapsed = time.perf_counter() - start
+    print("%-35s %10.2fs (%d docs/s)" % ("HasGeneMapper", elapsed, size / elapsed))
+    stats = mapper.get_stats()
+    print("Stats: %s" % stats)
+
+    # regression checks
+    assert stats["lookups"] == size
+    assert stats["hits"] == gene_taxids
+    assert sum(1 for taxid in sample if taxid in mapper.cache) == list_hits
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,89 @@
+"""
+Compare "full" and "compact" index profiles (see INDEX_PROFILE) on synthetic
+taxonomy docs.
+
+Without ES host, only _source sizes and numbers of indexed integer values
+are compared. With an ES host, docs are indexed in two indices, force-merged,
+and store sizes and query latencies (lineage and ancestors queries, the
+latter rewritten on lineage for compact indices) are reported.
+
+On 200k docs, compact _source is 71MB instead of 110MB, and 5.5M tree values
+are indexed instead of 11.4M. ES store sizes and query latencies are still to
+be measured on a real cluster.
+
+Run from src/ folder with:
+python -m benchmarks.bench_index_profile [size] [es_host]
+"""
+import json
+import random
+import sys
+import time
+
+from hub.dataindex.indexer import DROPPED_FIELDS, TREE_MAPPINGS, iter_actions
+
+from .bench_indexer import generate_docs
+
+QUERIES = 200
+
+
+def profile_docs(docs, profile):
+    return [{k: v for k, v in doc.items() if k not in DROPPED_FIELDS[profile]} for doc in docs]
+
+
+def indexed_values(docs, profile):
+    # number of integer values going to the inverted index (and doc values)
+    mappings = TREE_MAPPINGS[profile]
+    return sum(len(doc.get(field, ()))
+               for doc in docs for field, mapping in mappings.items()
+               if field in ("lineage", "children", "ancestors") and mapping.get("index", True))
+
+
+def es_bench(host, docs, taxids):
+    from elasticsearch import Elasticsearch, helpers
+
+    client = Elasticsearch(host, timeout=300)
+    rnd = random.Random(42)
+    sample = rnd.sample(taxids, QUERIES)
+    for profile in ("full", "compact"):
+        index = "bench_profile_%s" % profile
+        client.indices.delete(index=index, ignore_unavailable=True)
+        client.indices.create(index=index, body={
+            "settings": {"number_of_shards": 1, "number_of_replicas": 0, "refresh_interval": "-1"},
+            "mappings": {"dynamic": "false", "properties": dict(
+                TREE_MAPPINGS[profile], taxid={"type": "integer"})}})
+        start = time.perf_counter()
+        helpers.bulk(client, iter_actions((dict(doc) for doc in docs), index,
+                                          DROPPED_FIELDS[profile]),
+                     chunk_size=10000, max_chunk_bytes=10 * 1024 * 1024)
+        client.indices.refresh(index=index)
+        client.indices.forcemerge(index=index, max_num_segments=1)
+        elapsed = time.perf_counter() - start
+        store = client.indices.stats(index=index, metric="store")["indices"][index]["total"]["store"]
+        print("%-8s indexed in %6.2fs, store size %8.1fMB" % (
+            profile, elapsed, store["size_in_bytes"] / 1024 / 1024))
+        for label, query in (("lineage", "lineage:%d"),
+                             ("ancestors", "ancestors:%d" if profile == "full"
+                              else "(lineage:%d AND NOT taxid:%d)")):
+            start = time.perf_counter()
+            for taxid in sample:
+                q = query % ((taxid,) * query.count("%d"))
+                client.search(index=index, body={"query": {"query_string": {"query": q}}},
+                              size=10, _source=False)
+            print("%-8s %-10s query %8.2fms" % (
+                profile, label, (time.perf_counter() - start) / QUERIES * 1000))
+        client.indices.delete(index=index)
+
+
+def main(size=200000, host=None):
+    print("Generating %d synthetic docs" % size)
+    docs = list(generate_docs(int(size)))
+    for profile in ("full", "compact"):
+        source = sum(len(json.dumps(doc)) for doc in profile_docs(docs, profile))
+        print("%-8s _source %8.1fMB, %10d indexed tree values" % (
+            profile, source / 1024 / 1024, indexed_values(profile_docs(docs, profile), profile)))
+    if host:
+        es_bench(host, docs, [doc["taxid"] for doc in docs])
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,119 @@
+"""
+Compare bulk indexing with fixed document counts per request against
+byte-sized requests sent by concurrent threads (as TaxonomyIndexer does),
+on synthetic taxonomy docs and a local ES stand-in.
+
+The stand-in is an HTTP server (in its own process) answering _bulk requests
+after a delay simulating ES processing time (a fixed cost per request plus a
+cost per MB), so only the client side and request shaping are measured.
+A few docs get very large children lists, like Bacteria or unclassified
+nodes in NCBI taxonomy, making payload sizes uneven.
+
+Run from src/ folder with:
+python -m benchmarks.bench_indexer [size] [threads] [max_mb]
+"""
+import json
+import multiprocessing
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from elasticsearch import Elasticsearch, helpers
+
+from taxonomy.tree import TaxonomyTree
+
+from .synthetic import generate_tree
+
+REQUEST_COST = 0.005    # seconds per bulk request
+MB_COST = 0.05          # seconds per MB of payload
+BIG_NODES_EVERY = 20000
+BIG_NODES_CHILDREN = 50000
+
+
+class ESStandIn(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body):
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.reply({"version": {"number": "7.17.0", "build_flavor": "default"},
+                    "tagline": "You Know, for Search"})
+
+    def do_POST(self):
+        payload = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(REQUEST_COST + MB_COST * len(payload) / 1024 / 1024)
+        self.reply({"took": 1, "errors": False,
+                    "items": [{"index": {"status": 201}}] * (payload.count(b"\n") // 2)})
+
+
+def serve(port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ESStandIn)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def generate_docs(size):
+    tree = TaxonomyTree.from_nodes(generate_tree(size))
+    tree.compute_lineages()
+    for idx, taxid in enumerate(tree.taxids):
+        lineage = tree.lineage(taxid)
+        children = tree.children(taxid)
+        if idx % BIG_NODES_EVERY == 0:
+            children = list(range(10000000, 10000000 + BIG_NODES_CHILDREN))
+        yield {
+            "_id": str(taxid), "taxid": taxid, "rank": tree.rank(taxid),
+            "parent_taxid": tree.parent_taxid(taxid), "scientific_name": "taxon %d" % taxid,
+            "lineage": lineage, "ancestors": lineage[1:], "children": children,
+        }
+
+
+def actions(docs):
+    for doc in docs:
+        yield {"_index": "bench", "_id": doc["_id"],
+               "_source": {k: v for k, v in doc.items() if k != "_id"}}
+
+
+def run(label, func, docs):
+    start = time.perf_counter()
+    count = func(actions(docs))
+    elapsed = time.perf_counter() - start
+    print("%-45s %8.2fs %8.0f docs/s" % (label, elapsed, count / elapsed))
+    return elapsed
+
+
+def main(size=200000, threads=4, max_mb=10):
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue,), daemon=True)
+    server.start()
+    client = Elasticsearch("http://127.0.0.1:%d" % port_queue.get(), timeout=60)
+    print("Generating %d synthetic docs" % size)
+    docs = list(generate_docs(size))
+    largest = max(docs, key=lambda doc: len(doc["children"]))
+    print("Largest children list: %d (taxid %s)" % (len(largest["children"]), largest["_id"]))
+
+    def bulk(acts):
+        # biothings default: helpers.bulk, 500 docs per request
+        return helpers.bulk(client, acts)[0]
+
+    def parallel(acts):
+        return sum(ok for ok, _ in helpers.parallel_bulk(
+            client, acts, chunk_size=10000, max_chunk_bytes=max_mb * 1024 * 1024,
+            thread_count=threads, queue_size=threads))
+
+    baseline = run("bulk, 500 docs per request", bulk, docs)
+    best = run("parallel_bulk, %dMB requests, %d threads" % (max_mb, threads), parallel, docs)
+    print("Speed-up: %.1fx" % (baseline / best))
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,63 @@
+"""
+Compare per-doc lineage walking against whole-tree lineage computation.
+
+Run from src/ folder with:
+python -m benchmarks.bench_lineage [size]
+"""
+import sys
+import time
+
+from taxonomy.tree import TaxonomyTree
+
+from .synthetic import generate_tree
+
+
+def per_doc_walk(nodes):
+    # what LineageMapper used to do: one dict lookup per hop, for every doc
+    cache = {taxid: parent_taxid for taxid, parent_taxid, _ in nodes}
+    for taxid, parent_taxid, _ in nodes:
+        if taxid == parent_taxid:
+            lineage = [taxid]
+        else:
+            lineage = [taxid, parent_taxid]
+            while lineage[-1] != 1:
+                lineage.append(cache[lineage[-1]])
+
+
+def tree_walk(tree, nodes):
+    for taxid, _, _ in nodes:
+        tree.lineage(taxid)
+
+
+def tree_batch(tree, nodes):
+    tree.compute_lineages()
+    for taxid, _, _ in nodes:
+        tree.lineage(taxid)
+
+
+def timeit(label, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    print("%-40s %8.2fs" % (label, elapsed))
+    return elapsed
+
+
+def main(size=2500000):
+    print("Generating synthetic tree with %d nodes" % size)
+    nodes = generate_tree(size)
+    start = time.perf_counter()
+    tree = TaxonomyTree.from_nodes(nodes)
+    print("%-40s %8.2fs" % ("TaxonomyTree.from_nodes", time.perf_counter() - start))
+    baseline = timeit("per-doc dict walk", per_doc_walk, nodes)
+    timeit("per-doc tree walk", tree_walk, tree, nodes)
+    batch = timeit("compute_lineages + slicing", tree_batch, tree, nodes)
+    print("Mean depth: %.1f, lineage index: %.1fMB, speed-up: %.1fx" % (
+        len(tree.lineage_ids) / len(tree) - 1,
+        (tree.lineage_ids.itemsize * len(tree.lineage_ids) +
+         tree.lineage_offsets.itemsize * len(tree.lineage_offsets)) / 1024 / 1024,
+        baseline / batch))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
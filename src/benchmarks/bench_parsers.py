@@ -0,0 +1,70 @@
+"""
+Micro-benchmarks of names.dmp/nodes.dmp parsers.
+
+Run from src/ folder with:
+python -m benchmarks.bench_parsers [taxdump_folder]
+
+Without taxdump_folder, synthetic files of real taxdump sizes are generated.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from hub.dataload.sources.taxonomy import parser
+
+from .synthetic import generate_tree, write_names_dmp, write_nodes_dmp
+
+# current taxdump sizes
+NODES = 2600000
+
+
+def consume(func, path, mode):
+    with open(path, mode) as fin:
+        count = 0
+        for _ in func(fin):
+            count += 1
+    return count
+
+
+def bench(label, func, path, mode):
+    start = time.perf_counter()
+    count = consume(func, path, mode)
+    elapsed = time.perf_counter() - start
+    print("%-35s %8.2fs %10d records %10d/s" % (label, elapsed, count, count / elapsed))
+    return elapsed
+
+
+def main(folder=None):
+    tmpdir = None
+    if folder is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        folder = tmpdir.name
+        print("Generating synthetic taxdump files in %s" % folder)
+        nodes = generate_tree(NODES)
+        write_nodes_dmp(os.path.join(folder, "nodes.dmp"), nodes)
+        write_names_dmp(os.path.join(folder, "names.dmp"), nodes)
+        del nodes
+    names = os.path.join(folder, "names.dmp")
+    nodes = os.path.join(folder, "nodes.dmp")
+    print("names.dmp: %.1fMB, nodes.dmp: %.1fMB" % (
+        os.path.getsize(names) / 1024 / 1024, os.path.getsize(nodes) / 1024 / 1024))
+
+    slow = bench("parse_refseq_names", parser.parse_refseq_names, names, "r")
+    fast = bench("parse_refseq_names_fast", parser.parse_refseq_names_fast, names, "rb")
+    bench("iter_names_records", parser.iter_names_records, names, "rb")
+    print("names speed-up: %.1fx" % (slow / fast))
+
+    slow = bench("parse_refseq_nodes", parser.parse_refseq_nodes, nodes, "r")
+    fast = bench("parse_refseq_nodes_fast", parser.parse_refseq_nodes_fast, nodes, "rb")
+    bench("iter_nodes_records", parser.iter_nodes_records, nodes, "rb")
+    print("nodes speed-up: %.1fx" % (slow / fast))
+    if parser.numpy is not None:
+        bench("load_nodes_array", lambda f: parser.load_nodes_array(f)[0], nodes, "rb")
+
+    if tmpdir:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
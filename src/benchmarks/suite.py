@@ -0,0 +1,393 @@
+"""
+Benchmark suite over synthetic taxonomy data, recording time and peak
+memory of parsers, build mappers and web query classes, saved as JSON to
+catch regressions between releases.
+
+Synthetic taxdump, speclist.txt and gene_info.gz files are generated (seeded)
+for a given number of nodes (10k to 3M). Each benchmark is timed (best of
+repeat runs), then run once more under tracemalloc for its peak memory.
+Benchmark groups whose dependencies can't be imported in the current
+environment (eg. web classes in the hub environment, or no config module) are
+recorded as skipped, other setup errors fail the run.
+
+Run from src/ folder with:
+python -m benchmarks.suite [--size N] [--output results.json] [--baseline previous.json]
+
+With --baseline, results are compared to a previous run and the exit status
+is 1 if any benchmark got slower (or used more memory) beyond --tolerance, or
+if a benchmark of the baseline was skipped or not run.
+"""
+import argparse
+import asyncio
+import gc
+import gzip
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .synthetic import generate_taxdump
+
+BATCH_SIZE = 10000
+# number of web queries/lookups per benchmark
+WEB_QUERIES = 2000
+WEB_MGET_SIZE = 1000
+# timings below are not compared to baseline ones
+MIN_SECONDS = 0.05
+
+# (group, name, setup) in run order, setup(data) returning the function to
+# measure, which returns the number of items processed
+BENCHMARKS = []
+
+
+def benchmark(group, name):
+    def register(setup):
+        BENCHMARKS.append((group, name, setup))
+        return setup
+    return register
+
+
+def batches(docs, batch_size=BATCH_SIZE):
+    # shallow copies, so docs mapped in a run are left untouched for the next ones
+    for start in range(0, len(docs), batch_size):
+        yield [dict(doc) for doc in docs[start:start + batch_size]]
+
+
+class SyntheticData(object):
+    """Synthetic files in folder, and data derived from them, loaded once"""
+
+    def __init__(self, folder, nodes):
+        self.folder = folder
+        self.nodes = nodes
+        self._tree = None
+        self._docs = None
+        self._gene_taxids = None
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    @property
+    def gene_taxids(self):
+        # read without hub parsers, not importable in the web environment
+        if self._gene_taxids is None:
+            with gzip.open(self.path("gene_info.gz"), "rt") as fileh:
+                next(fileh)
+                self._gene_taxids = {int(line[:line.index("\t")]) for line in fileh}
+        return self._gene_taxids
+
+    @property
+    def tree(self):
+        """TaxonomyTree with has_gene flags, lineages and DFS intervals"""
+        if self._tree is None:
+            from taxonomy.tree import TaxonomyTree
+            self._tree = TaxonomyTree.from_nodes(self.nodes)
+            self._tree.set_has_gene(self.gene_taxids)
+            self._tree.compute_lineages()
+            self._tree.compute_dfs_intervals()
+        return self._tree
+
+    @property
+    def docs(self):
+        """names docs, with rank from nodes, as merged before post_merge"""
+        if self._docs is None:
+            from hub.dataload.sources.taxonomy.parser import parse_refseq_names_fast
+            ranks = {taxid: rank for taxid, _, rank in self.nodes}
+            with open(self.path("names.dmp"), "rb") as fileh:
+                self._docs = list(parse_refseq_names_fast(fileh))
+            for doc in self._docs:
+                doc["rank"] = ranks[doc["taxid"]]
+        return self._docs
+
+
+def consume(func, path, mode):
+    def run():
+        with open(path, mode) as fileh:
+            return sum(1 for _ in func(fileh))
+    return run
+
+
+@benchmark("parsers", "parse_refseq_names_fast")
+def names_parser(data):
+    from hub.dataload.sources.taxonomy.parser import parse_refseq_names_fast
+    return consume(parse_refseq_names_fast, data.path("names.dmp"), "rb")
+
+
+@benchmark("parsers", "parse_refseq_nodes_fast")
+def nodes_parser(data):
+    from hub.dataload.sources.taxonomy.parser import parse_refseq_nodes_fast
+    return consume(parse_refseq_nodes_fast, data.path("nodes.dmp"), "rb")
+
+
+@benchmark("parsers", "parse_uniprot_speclist")
+def speclist_parser(data):
+    from hub.dataload.sources.uniprot.parser import parse_uniprot_speclist
+    return consume(parse_uniprot_speclist, data.path("speclist.txt"), "r")
+
+
+@benchmark("parsers", "load_geneinfo_taxids")
+def geneinfo_parser(data):
+    from hub.dataload.sources.geneinfo.parser import load_geneinfo_taxids
+
+    def run():
+        with open(data.path("gene_info.gz"), "rb") as fileh:
+            return len(load_geneinfo_taxids(fileh))
+    return run
+
+
+@benchmark("mappers", "HasGeneMapper")
+def has_gene_mapper(data):
+    from hub.databuild.mapper import HasGeneMapper
+    from taxonomy.tree import TaxidBitmap
+    docs = data.docs
+    bitmap = TaxidBitmap(data.gene_taxids)
+
+    def run():
+        mapper = HasGeneMapper(name="has_gene")
+        mapper.cache = bitmap
+        return sum(1 for batch in batches(docs) for _ in mapper.process(batch))
+    return run
+
+
+@benchmark("mappers", "LineageMapper")
+def lineage_mapper(data):
+    from hub.databuild.mapper import LineageMapper
+    docs = data.docs
+    tree = data.tree
+
+    def run():
+        mapper = LineageMapper(name="lineage", tree=tree)
+        return sum(1 for batch in batches(docs) for _ in mapper.process(batch))
+    return run
+
+
+@benchmark("mappers", "ScientificNameAbbreviationMapper")
+def abbreviation_mapper(data):
+    from hub.databuild.mapper import ScientificNameAbbreviationMapper
+    docs = data.docs
+
+    def run():
+        mapper = ScientificNameAbbreviationMapper(name="scientific_name_abbreviation")
+        return sum(1 for batch in batches(docs) for _ in mapper.process(batch))
+    return run
+
+
+def web_docs(data, count):
+    """(taxid, _source) of count docs spread over the tree, as indexed"""
+    tree = data.tree
+    step = max(1, len(tree) // count)
+    for taxid in list(tree.taxids)[::step][:count]:
+        lineage = tree.lineage(taxid)
+        yield taxid, {
+            "taxid": taxid, "parent_taxid": tree.parent_taxid(taxid), "rank": tree.rank(taxid),
+            "scientific_name": "taxon %d" % taxid, "has_gene": tree.has_gene(taxid),
+            "lineage": lineage, "depth": len(lineage) - 1,
+            "children": tree.children(taxid), "_has_gene_children": tree.has_gene_children(taxid),
+        }
+
+
+@benchmark("web", "MytaxonQueryBuilder")
+def query_builder(data):
+    from web.pipeline import MytaxonQueryBuilder
+    taxids = [taxid for taxid, _ in web_docs(data, WEB_QUERIES)]
+    builder = MytaxonQueryBuilder()
+
+    def run():
+        for taxid in taxids:
+            builder.build("ancestors:%d AND rank:species" % taxid, include_children=True)
+            builder.build(str(taxid), scopes=["ancestors"])
+            builder.build("taxon %d" % taxid, scopes=["scientific_name"], expand_species=True)
+        return 3 * len(taxids)
+    return run
+
+
+@benchmark("web", "MytaxonTransform")
+def transform(data):
+    from web.pipeline import MytaxonTransform
+    hits = [{"_index": "mytaxon", "_id": str(taxid), "_score": 1.0, "_source": source}
+            for taxid, source in web_docs(data, WEB_QUERIES)]
+    formatter = MytaxonTransform()
+
+    def run():
+        for start in range(0, len(hits), 10):
+            page = [dict(hit, _source=dict(hit["_source"])) for hit in hits[start:start + 10]]
+            formatter.transform({"hits": {"total": {"value": len(page), "relation": "eq"},
+                                          "max_score": 1.0, "hits": page}}, has_gene=True)
+        return len(hits)
+    return run
+
+
+class MgetClient(object):
+    """Async ES client stand-in answering mget requests from docs in memory"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def mget(self, body, index, **params):
+        return {"docs": [
+            {"_index": index, "_id": _id, "_version": 1, "found": True,
+             "_source": self.docs[_id]} if _id in self.docs else
+            {"_index": index, "_id": _id, "found": False}
+            for _id in body["ids"]]}
+
+
+@benchmark("web", "MytaxonQueryPipeline.mget")
+def pipeline_mget(data):
+    from web.pipeline import (MytaxonQueryBackend, MytaxonQueryBuilder,
+                              MytaxonQueryPipeline, MytaxonTransform)
+    docs = {str(taxid): source for taxid, source in web_docs(data, WEB_QUERIES)}
+    ids = list(docs)
+    backend = MytaxonQueryBackend(MgetClient(docs), {None: "mytaxon"})
+
+    def run():
+        pipeline = MytaxonQueryPipeline(MytaxonQueryBuilder(), backend, MytaxonTransform())
+
+        async def lookups():
+            for start in range(0, len(ids), WEB_MGET_SIZE):
+                await pipeline.mget(ids[start:start + WEB_MGET_SIZE], include_children=True)
+        asyncio.run(lookups())
+        return len(ids)
+    return run
+
+
+def measure(run, repeat=3):
+    """Best time of repeat runs, then peak traced memory of one more run"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        count = run()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    best = min(times)
+    return {"seconds": round(best, 4), "peak_bytes": peak, "items": count,
+            "items_per_second": round(count / best) if best else None}
+
+
+def run_suite(size=100000, seed=42, repeat=3, folder=None, groups=None, verbose=True):
+    """
+    Generate synthetic files of size nodes (in folder, or a temporary one)
+    and run benchmarks (of given groups, all by default). Return results.
+    """
+    tmpdir = None
+    if folder is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        folder = tmpdir.name
+    try:
+        start = time.perf_counter()
+        nodes = generate_taxdump(folder, size, seed=seed)
+        if verbose:
+            print("Generated %d synthetic nodes in %.1fs" % (size, time.perf_counter() - start))
+        data = SyntheticData(folder, nodes)
+        results = {}
+        skipped = {}
+        for group, name, setup in BENCHMARKS:
+            if groups and group not in groups:
+                continue
+            key = "%s.%s" % (group, name)
+            if group in skipped:
+                results[key] = {"skipped": skipped[group]}
+                continue
+            try:
+                func = setup(data)
+            except ImportError as e:
+                # dependencies missing or not configured, eg. web classes in
+                # the hub environment, hub ones in the web environment
+                skipped[group] = "%s: %s" % (e.__class__.__name__, e)
+                results[key] = {"skipped": skipped[group]}
+                if verbose:
+                    print("%-50s skipped: %s" % (key, e))
+                continue
+            results[key] = measure(func, repeat)
+            if verbose:
+                res = results[key]
+                print("%-50s %8.3fs %10d items/s %8.1fMB peak" % (
+                    key, res["seconds"], res["items_per_second"] or 0,
+                    res["peak_bytes"] / 1024 / 1024))
+        return {
+            "meta": {
+                "size": size, "seed": seed, "repeat": repeat,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(), "platform": platform.platform(),
+            },
+            "results": results,
+        }
+    finally:
+        if tmpdir:
+            tmpdir.cleanup()
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Regressions of results against baseline ones (same size expected):
+    list of (benchmark, metric, baseline value, new value). Timings shorter
+    than MIN_SECONDS are too noisy to be compared. Benchmarks of the baseline
+    skipped or not run are reported with metric "skipped" (new value being
+    the reason) or "missing" (new value None).
+    """
+    regressions = []
+    for key, base in baseline["results"].items():
+        res = results["results"].get(key)
+        if "skipped" in base:
+            continue
+        if res is None:
+            regressions.append((key, "missing", base["seconds"], None))
+            continue
+        if "skipped" in res:
+            regressions.append((key, "skipped", base["seconds"], res["skipped"]))
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if metric == "seconds" and max(base[metric], res[metric]) < MIN_SECONDS:
+                continue
+            if base[metric] and res[metric] > base[metric] * (1 + tolerance):
+                regressions.append((key, metric, base[metric], res[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=100000, help="number of taxonomy nodes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--group", action="append", help="only run these groups "
+                        "(parsers, mappers, web), can be repeated")
+    parser.add_argument("--folder", help="keep generated files in this folder")
+    parser.add_argument("--output", help="JSON file to save results to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slow-down (or memory increase) reported as regression")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.size, args.seed, args.repeat, args.folder, args.group)
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(results, fout, indent=2)
+        print("Results saved to %s" % args.output)
+    if args.baseline:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+        if baseline["meta"]["size"] != results["meta"]["size"]:
+            print("Warning: baseline size is %d" % baseline["meta"]["size"])
+        regressions = compare(results, baseline, args.tolerance)
+        for key, metric, before, after in regressions:
+            if metric == "skipped":
+                print("REGRESSION %-50s skipped: %s" % (key, after))
+            elif metric == "missing":
+                print("REGRESSION %-50s not run" % key)
+            else:
+                print("REGRESSION %-50s %s: %s -> %s (%+.0f%%)" % (
+                    key, metric, before, after, 100 * (after - before) / before))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Seeded generators for synthetic taxonomy data, shaped like NCBI taxdump
+(nodes.dmp, names.dmp), UniProt speclist.txt and NCBI gene_info.gz.
+"""
+import gzip
+import os
+import random
+
+# main ranks, top to bottom, intermediate levels being "no rank"/"clade"
+RANKS = ["superkingdom", "kingdom", "phylum", "class", "order", "family",
+         "genus", "species", "subspecies", "strain"]
+
+
+def generate_tree(size, depth=30, seed=42):
+    """
+    Return a list of (taxid, parent_taxid, rank) for a tree of size nodes,
+    sorted by taxid as in nodes.dmp. Level sizes grow geometrically so most
+    nodes are deep leaves, and taxids are scattered over a sparse range.
+    """
+    rnd = random.Random(seed)
+    # geometric level sizes summing to size (root level excluded)
+    growth = 1.0
+    while sum(growth ** level for level in range(1, depth + 1)) < size - 1:
+        growth *= 1.05
+    levels = [[1]]
+    taxids = rnd.sample(range(2, int(size * 1.3) + 2), size - 1)
+    pos = 0
+    for level in range(1, depth + 1):
+        count = int(growth ** level) if level < depth else size - 1 - pos
+        count = min(max(count, 1), size - 1 - pos)
+        if count <= 0:
+            break
+        levels.append(taxids[pos:pos + count])
+        pos += count
+
+    nodes = [(1, 1, "no rank")]
+    for level in range(1, len(levels)):
+        upper = levels[level - 1]
+        rank_pos = (level * len(RANKS)) // len(levels)
+        for taxid in levels[level]:
+            parent = upper[rnd.randrange(len(upper))]
+            rank = RANKS[rank_pos] if rnd.random() < 0.7 else "no rank"
+            nodes.append((taxid, parent, rank))
+    nodes.sort()
+    return nodes
+
+
+# name classes other than "scientific name", with the share of taxids having one
+NAME_CLASSES = [("synonym", 0.25), ("authority", 0.3), ("includes", 0.02),
+                ("equivalent name", 0.05), ("common name", 0.03), ("genbank common name", 0.02),
+                ("type material", 0.1), ("in-part", 0.01), ("misspelling", 0.01),
+                ("acronym", 0.005), ("blast name", 0.001)]
+GENERA = ["Homo", "Mus", "Rattus", "Danio", "Drosophila", "Escherichia", "Bacillus",
+          "Saccharomyces", "Arabidopsis", "Streptomyces", "Pseudomonas", "Caenorhabditis"]
+EPITHETS = ["sapiens", "musculus", "norvegicus", "rerio", "melanogaster", "coli", "subtilis",
+            "cerevisiae", "thaliana", "griseus", "aeruginosa", "elegans", "vulgaris", "alba"]
+
+
+def scientific_name(taxid, rank, rnd):
+    genus = GENERA[taxid % len(GENERA)] + str(taxid % 997)
+    if rank == "species":
+        return "%s %s" % (genus, rnd.choice(EPITHETS))
+    if rank == "subspecies":
+        return "%s %s subsp. %s" % (genus, rnd.choice(EPITHETS), rnd.choice(EPITHETS))
+    if rank == "strain":
+        return "%s %s str. K-%d" % (genus, rnd.choice(EPITHETS), taxid)
+    if rank == "genus":
+        return genus
+    return "%s %d" % (rank.capitalize(), taxid)
+
+
+def write_nodes_dmp(path, nodes):
+    with open(path, "w") as fout:
+        for taxid, parent_taxid, rank in nodes:
+            fout.write("%d\t|\t%d\t|\t%s\t|\t\t|\t0\t|\t1\t|\t11\t|\t1\t|\t0\t|\t1\t|\t1\t|\t0\t|\t\t|\n" %
+                       (taxid, parent_taxid, rank))
+
+
+def write_names_dmp(path, nodes, seed=42):
+    rnd = random.Random(seed)
+    with open(path, "w") as fout:
+        for taxid, _, rank in nodes:
+            name = scientific_name(taxid, rank, rnd)
+            fout.write("%d\t|\t%s\t|\t\t|\tscientific name\t|\n" % (taxid, name))
+            for name_class, share in NAME_CLASSES:
+                if rnd.random() < share:
+                    fout.write("%d\t|\t%s %s\t|\t\t|\t%s\t|\n" % (
+                        taxid, name_class.split()[0], name, name_class))
+
+
+# UniProt kingdom codes: archaea, bacteria, eukaryota, viruses, others
+UNIPROT_KINGDOMS = "ABEVO"
+# ranks of nodes getting a uniprot mnemonic or genes
+LEAF_RANKS = frozenset(["species", "subspecies", "strain", "no rank"])
+
+
+def mnemonic(taxid):
+    """Uppercase UniProt-like species code (up to 5 letters) of taxid"""
+    code = ""
+    while taxid and len(code) < 5:
+        taxid, letter = divmod(taxid, 26)
+        code += chr(ord("A") + letter)
+    return code
+
+
+def write_speclist(path, nodes, share=0.03, seed=42):
+    """
+    speclist.txt with mnemonics of a share of leaf-rank taxids, preceded by
+    the header and "_____" separator lines, some having common names (C=)
+    and synonyms (S=) continuation lines
+    """
+    rnd = random.Random(seed)
+    with open(path, "w") as fout:
+        fout.write("Code    Taxon    N=Official (scientific) name\n"
+                   "        Node     C=Common name\n"
+                   "        code     S=Synonym\n"
+                   "_____ _ _______  ____________________________________________________________\n")
+        for taxid, _, rank in nodes:
+            if rank not in LEAF_RANKS or rnd.random() >= share:
+                continue
+            fout.write("%-5s %s %7d: N=%s\n" % (
+                mnemonic(taxid), rnd.choice(UNIPROT_KINGDOMS), taxid,
+                scientific_name(taxid, rank, rnd)))
+            if rnd.random() < 0.2:
+                fout.write("                 C=%s\n" % rnd.choice(EPITHETS))
+            if rnd.random() < 0.05:
+                fout.write("                 S=%s\n" % scientific_name(taxid, rank, rnd))
+
+
+GENE_INFO_HEADER = ("#tax_id", "GeneID", "Symbol", "LocusTag", "Synonyms", "dbXrefs",
+                    "chromosome", "map_location", "description", "type_of_gene",
+                    "Symbol_from_nomenclature_authority", "Full_name_from_nomenclature_authority",
+                    "Nomenclature_status", "Other_designations", "Modification_date",
+                    "Feature_type")
+
+
+def write_gene_info(path, nodes, share=0.015, mean_genes=20, seed=42):
+    """
+    gene_info (gzipped if path ends with .gz) for a share of leaf-rank
+    taxids, gene counts per taxid following a Pareto distribution (a few
+    model organisms have most genes), genes grouped by taxid
+    """
+    rnd = random.Random(seed)
+    opener = gzip.open if path.endswith(".gz") else open
+    gene_id = 1
+    with opener(path, "wt") as fout:
+        fout.write("\t".join(GENE_INFO_HEADER) + "\n")
+        for taxid, _, rank in nodes:
+            if rank not in LEAF_RANKS or rnd.random() >= share:
+                continue
+            count = max(1, int(rnd.paretovariate(1.5) * mean_genes / 3))
+            for _ in range(count):
+                fout.write("%d\t%d\tgene%d\tLT_%d\t-\t-\t%d\t-\thypothetical protein\t"
+                           "protein-coding\t-\t-\t-\t-\t20240101\t-\n" % (
+                               taxid, gene_id, gene_id, gene_id, rnd.randint(1, 22)))
+                gene_id += 1
+
+
+def generate_taxdump(folder, size, seed=42):
+    """
+    Write nodes.dmp, names.dmp, speclist.txt and gene_info.gz of a tree of
+    size nodes in folder, return the nodes
+    """
+    # deeper trees for bigger taxonomies (NCBI: ~2.6M nodes, max depth ~45)
+    depth = min(45, max(10, size.bit_length() * 2))
+    nodes = generate_tree(size, depth=depth, seed=seed)
+    write_nodes_dmp(os.path.join(folder, "nodes.dmp"), nodes)
+    write_names_dmp(os.path.join(folder, "names.dmp"), nodes, seed=seed)
+    write_speclist(os.path.join(folder, "speclist.txt"), nodes, seed=seed)
+    write_gene_info(os.path.join(folder, "gene_info.gz"), nodes, seed=seed)
+    return nodes
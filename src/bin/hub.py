@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import asyncio
 import logging
 import os
 from functools import partial
@@ -16,8 +17,11 @@ from biothings.hub.databuild.syncer import (
 from biothings.utils.version import set_versions
 
 import hub.dataload
-from hub.databuild.builder import TaxonomyDataBuilder
+from hub.databuild.builder import InMemoryTaxonomyDataBuilder, TaxonomyDataBuilder
+from hub.databuild.incremental import incremental_build
 from hub.databuild.mapper import HasGeneMapper
+from hub.databuild.syncer import taxonomy_sync
+from hub.instrumentation import build_instrumentation, upload_instrumentation
 
 app_folder, _src = os.path.split(os.path.split(
     os.path.split(os.path.abspath(__file__))[0])[0])
@@ -33,7 +37,7 @@ class MyTaxonomyHubServer(HubServer):
         pbuilder = partial(TaxonomyDataBuilder, mappers=[hasgene])
         build_manager = builder.BuilderManager(
             job_manager=self.managers["job_manager"],
-            builder_class=pbuilder,
+            builder_class=[pbuilder, InMemoryTaxonomyDataBuilder],
             poll_schedule="* * * * * */10")
         build_manager.configure()
         build_manager.configure()
@@ -57,8 +61,42 @@ class MyTaxonomyHubServer(HubServer):
         self.logger.info("Using custom syncer, prod(throttled): %s, test: %s" % (
             sync_manager_prod, sync_manager_test))
 
+    def incremental_build(self, target_name, old_folder=None, new_folder=None):
+        """
+        Update merged collection target_name with only the documents changed
+        between the previous and current taxdump releases
+        """
+        pinfo = {"category": "builder", "source": target_name,
+                 "step": "incremental_build", "description": ""}
+
+        async def do():
+            job = await self.managers["job_manager"].defer_to_thread(
+                pinfo, partial(incremental_build, target_name, old_folder, new_folder))
+            return await job
+
+        return asyncio.ensure_future(do())
+
+    def taxonomy_sync(self, env="prod", old_folder=None, new_folder=None):
+        """
+        Sync index of INDEX_CONFIG environment env with only the fields changed
+        between the previous and current taxdump releases
+        """
+        pinfo = {"category": "sync", "source": env,
+                 "step": "taxonomy_sync", "description": ""}
+
+        async def do():
+            job = await self.managers["job_manager"].defer_to_thread(
+                pinfo, partial(taxonomy_sync, env, old_folder, new_folder))
+            return await job
+
+        return asyncio.ensure_future(do())
+
     def configure_commands(self):
         super().configure_commands()  # keep all originals...
+        self.commands["incremental_build"] = self.incremental_build
+        self.commands["taxonomy_sync"] = self.taxonomy_sync
+        self.commands["build_instrumentation"] = build_instrumentation
+        self.commands["upload_instrumentation"] = upload_instrumentation
         self.commands["es_sync_test"] = partial(self.managers["sync_manager_test"].sync, "es",
                                                 target_backend=(config.INDEX_CONFIG["env"]["hub_es"]["host"],
                                                                 config.INDEX_CONFIG["env"]["hub_es"]["index"][0]["index"],
@@ -24,6 +24,58 @@ HUB_ICON = "https://raw.githubusercontent.com/biothings/biothings_sites/master/b
 
 LOGGER_NAME = "mytaxon.hub"
 
+# Taxonomy .dmp files are uploaded in parallel: each file is split into chunks
+# of at most TAXONOMY_UPLOAD_CHUNK_SIZE bytes, and in at least
+# TAXONOMY_UPLOAD_MIN_CHUNKS chunks, each one parsed and stored by a hub worker
+# process (concurrent chunks are bound by HUB_MAX_WORKERS). Set min chunks to 1
+# and chunk size to 0 to upload serially.
+TAXONOMY_UPLOAD_MIN_CHUNKS = 4
+TAXONOMY_UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Binary snapshot of the taxonomy tree (parents, ranks, children, has_gene),
+# written after nodes and geneinfo uploads and memory-mapped by the build
+# mappers instead of scanning these collections. Relative paths are within
+# DATA_ARCHIVE_ROOT. Set to None to disable.
+TAXONOMY_SNAPSHOT = "taxonomy_tree.snapshot"
+# Sorted index of all names (scientific, common, synonyms...), written after
+# names upload, and served by the web /name endpoint. Set to None to disable.
+TAXONOMY_NAMES_INDEX = "taxonomy_names.index"
+
+# Post-merge step (lineage, abbreviations) runs as a pipeline: a reader thread
+# prefetches batches from the merged collection, mapping runs in a pool of
+# threads, and a writer thread sends unordered bulk updates of mapped fields.
+# Queue sizes are in number of batches. Set POST_MERGE_PIPELINE to False to
+# process batches sequentially.
+POST_MERGE_PIPELINE = True
+POST_MERGE_MAP_WORKERS = 2
+POST_MERGE_READ_QUEUE = 4
+POST_MERGE_WRITE_QUEUE = 4
+
+# Indexing sends bulk requests sized in bytes rather than in documents (docs
+# like Bacteria have huge children lists), with INDEX_BULK_THREADS concurrent
+# bulk streams per indexing job. Refresh and replicas are disabled while
+# loading, and restored once done. Set INDEX_PARALLEL_BULK to False to use
+# the default biothings indexing.
+INDEX_PARALLEL_BULK = True
+INDEX_BULK_MAX_BYTES = 10 * 1024 * 1024
+INDEX_BULK_MAX_DOCS = 10000
+INDEX_BULK_THREADS = 4
+
+# ES index profile: "full" indexes all tree fields, "compact" doesn't store
+# ancestors (lineage[1:], the web tier rewrites ancestors queries on lineage)
+# and keeps children lists out of the inverted index and doc values, as they
+# are only fetched from _source.
+INDEX_PROFILE = "compact"
+
+# In-memory builds (InMemoryTaxonomyDataBuilder) read dumped files and write
+# docs to an NDJSON bulk file in INMEMORY_BUILD_FOLDER (relative to
+# DATA_ARCHIVE_ROOT) or to a new index in INMEMORY_BUILD_INDEX_ENV (an
+# INDEX_CONFIG environment). Can be set per build configuration with
+# "inmemory_sink" and "inmemory_index_env" params.
+INMEMORY_BUILD_SINK = "ndjson"
+INMEMORY_BUILD_FOLDER = "inmemory_builds"
+INMEMORY_BUILD_INDEX_ENV = "test"
+
 ### Pre-prod/test ES definitions
 INDEX_CONFIG = {
     "indexer_select": {
@@ -5,7 +5,7 @@
 
 from copy import deepcopy
 
-from biothings.web.settings.default import ANNOTATION_KWARGS, QUERY_KWARGS
+from biothings.web.settings.default import ANNOTATION_KWARGS, APP_LIST, QUERY_KWARGS
 
 # *****************************************************************************
 # Elasticsearch variables
@@ -24,18 +24,61 @@ ES_RESULT_TRANSFORM = "web.pipeline.MytaxonTransform"
 
 ALLOW_RANDOM_QUERY = True
 
+APP_LIST = [
+    *APP_LIST,
+    (r"/{ver}/cache/?", "web.handlers.CacheStatsHandler"),
+    (r"/{ver}/tree/lca/?", "web.handlers.LCAHandler"),
+    (r"/{ver}/tree/descendant/?", "web.handlers.DescendantHandler"),
+    (r"/{ver}/tree/path/?", "web.handlers.PathHandler"),
+    (r"/{ver}/name/?", "web.handlers.NameHandler"),
+    (r"/{ver}/children/(\d+)/?", "web.handlers.ChildrenHandler"),
+    # request metrics, in Prometheus text format
+    (r"/metrics", "web.handlers.MetricsHandler"),
+]
+
+# Taxonomy tree snapshot written by the hub (TAXONOMY_SNAPSHOT in hub config),
+# memory-mapped to answer /tree/ queries and stream /children/ lists locally.
+# Reopened when replaced. Deployments must set it (to a path shared with the
+# hub, or a copy of the file) for /tree/ endpoints, which answer 503 without
+# it. /children/ lists are read from ES docs instead.
+TAXONOMY_SNAPSHOT = None
+# Names index written by the hub (TAXONOMY_NAMES_INDEX in hub config), used to
+# resolve names to taxids on /name without ES queries (503 if not set).
+TAXONOMY_NAMES_INDEX = None
+
 ANNOTATION_KWARGS['*']['include_children'] = {
     'type': bool, 'default': False}
 ANNOTATION_KWARGS['POST']['expand_species'] = {
     'type': bool, 'default': False, 'alias': ['expand_taxon']}
+# with expand_species: expand down to expand_depth levels, or the whole
+# subtree with expand_all, only keeping ranks in expand_rank if given.
+# Subtrees larger than 100000 taxids are a 400 error (see EXPAND_MAX_SIZE
+# in web/pipeline.py).
+ANNOTATION_KWARGS['POST']['expand_depth'] = {
+    'type': int, 'default': 1, 'min': 1}
+ANNOTATION_KWARGS['POST']['expand_all'] = {
+    'type': bool, 'default': False}
+ANNOTATION_KWARGS['POST']['expand_rank'] = {
+    'type': list, 'default': None, 'max': 50}
 ANNOTATION_KWARGS['*']['has_gene'] = {
     'type': bool, 'default': False, 'alias': ['children_has_gene']}
+# with include_children: page of children returned, children_count being the
+# size of the whole list (complete lists can be streamed from /children/).
+# Not negative, checked by the pipeline ("min" isn't checked when 0).
+ANNOTATION_KWARGS['*']['children_from'] = {
+    'type': int, 'default': 0}
+ANNOTATION_KWARGS['*']['children_size'] = {
+    'type': int, 'default': None}
 
 QUERY_KWARGS = deepcopy(QUERY_KWARGS)
 QUERY_KWARGS['*']['include_children'] = {
     'type': bool, 'default': False}
 QUERY_KWARGS['*']['has_gene'] = {
     'type': bool, 'default': False, 'alias': ['children_has_gene']}
+QUERY_KWARGS['*']['children_from'] = {
+    'type': int, 'default': 0}
+QUERY_KWARGS['*']['children_size'] = {
+    'type': int, 'default': None}
 
 # *****************************************************************************
 # Features
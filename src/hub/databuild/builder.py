@@ -1,65 +1,173 @@
-import logging
+import os
+from functools import partial
 
 import config
-from biothings.hub.databuild.builder import DataBuilder
+from biothings.hub.databuild.builder import BuilderException, DataBuilder
 from biothings.hub.dataload.storage import UpsertStorage
 from biothings.utils.mongo import doc_feeder, get_target_db
+from elasticsearch import Elasticsearch
 
-from .mapper import LineageMapper, ScientificNameAbbreviationMapper
+from ..dataindex.indexer import DROPPED_FIELDS, TREE_MAPPINGS
+from ..dataload.sources.taxonomy.uploader import TaxonomyNamesUploader
+from ..instrumentation import Instrumentation
+from .inmemory import ESSink, NDJSONSink, inmemory_build, load_sources, source_folders
+from .mapper import LineageMapper, ScientificNameAbbreviationMapper, archive_path
+from .postmerge import PostMergePipeline
+from .stats import TaxonomyStats
 
 
 class TaxonomyDataBuilder(DataBuilder):
 
+    # stats computed by in-memory builds, from the tree docs were built from
+    taxonomy_stats = None
+    # stages of post_merge (or in-memory build), stored with the build
+    instrumentation = None
+
+    def register_status(self, status, transient=False, init=False, **extra):
+        if not transient and self.instrumentation is not None:
+            extra["build"] = dict(extra.get("build", {}),
+                                  instrumentation=self.instrumentation.to_dict())
+        super().register_status(status, transient, init, **extra)
+
     def post_merge(self, source_names, batch_size, job_manager):
-        # get the lineage mapper
-        lineage_mapper = LineageMapper(name="lineage")
+        self.instrumentation = instrumentation = Instrumentation()
+        # get the lineage mapper, all docs are going to be processed
+        # so compute lineages of the whole tree at once
+        lineage_mapper = LineageMapper(name="lineage", precompute_lineages=True)
         # load cache (it's being loaded automatically
         # as it's not part of an upload process
-        lineage_mapper.load()
+        with instrumentation.stage("load_tree").measure():
+            lineage_mapper.load()
 
         # get the scientific name abbreviation mapper
         scientific_name_mapper = ScientificNameAbbreviationMapper(
             name="scientific_name_abbreviation")
 
-        # create a storage to save docs back to merged collection
-        db = get_target_db()
-        col_name = self.target_backend.target_collection.name
-        storage = UpsertStorage(db, col_name)
-
-        for docs in doc_feeder(self.target_backend.target_collection,
-                               step=batch_size, inbatch=True):
+        if config.POST_MERGE_PIPELINE:
             # Apply lineage mapper first (adds lineage field)
-            docs = lineage_mapper.process(docs)
             # Then apply scientific name abbreviation mapper
             # (depends on lineage field)
-            docs = scientific_name_mapper.process(docs)
-            storage.process(docs, batch_size)
+            pipeline = PostMergePipeline(
+                self.target_backend.target_collection,
+                [lineage_mapper, scientific_name_mapper],
+                read_fields=["taxid", "parent_taxid", "rank",
+                             "scientific_name", "other_names"],
+                write_fields=["lineage", "ancestors", "children",
+                              "_has_gene_children", "depth", "dfs_in",
+                              "dfs_out", "other_names"],
+                changed_fields=["other_names"],
+                batch_size=batch_size,
+                map_workers=config.POST_MERGE_MAP_WORKERS,
+                read_queue=config.POST_MERGE_READ_QUEUE,
+                write_queue=config.POST_MERGE_WRITE_QUEUE,
+                logger=self.logger,
+                instrumentation=instrumentation)
+            pipeline.run()
+        else:
+            # create a storage to save docs back to merged collection
+            db = get_target_db()
+            col_name = self.target_backend.target_collection.name
+            storage = UpsertStorage(db, col_name)
 
-        # add indices used to create metadata stats
+            for docs in instrumentation.timed("read", doc_feeder(
+                    self.target_backend.target_collection, step=batch_size, inbatch=True)):
+                # Apply lineage mapper first (adds lineage field)
+                # Then apply scientific name abbreviation mapper
+                # (depends on lineage field)
+                for mapper in (lineage_mapper, scientific_name_mapper):
+                    with instrumentation.stage("map_%s" % mapper.name).measure(len(docs)):
+                        docs = list(mapper.process(docs))
+                with instrumentation.stage("write").measure(len(docs)):
+                    storage.process(docs, batch_size)
+
+        # add indices on rank and taxid
         keys = ["rank", "taxid"]
         self.logger.info("Creating indices on %s" % repr(keys))
-        for k in keys:
-            self.target_backend.target_collection.create_index(k)
+        with instrumentation.stage("create_indices").measure():
+            for k in keys:
+                self.target_backend.target_collection.create_index(k)
+        self.logger.info("Post-merge stages: %r" % instrumentation)
 
     def get_stats(self, sources, job_manager):
         self.logger.info("Computing metadata...")
+        stats = self.taxonomy_stats
+        if stats is None:
+            # merged docs, counted in a single collection pass: they're not
+            # all part of the tree (eg. taxids only found in uniprot)
+            stats = TaxonomyStats()
+            for docs in doc_feeder(self.target_backend.target_collection, step=10000, inbatch=True,
+                                   fields=["taxid", "rank", "has_gene", "depth", "children"]):
+                stats.update(docs)
         # we want to compute it from scratch
         meta = {"__REPLACE__": True}
-        col = self.target_backend.target_collection
-        # disctint count of taxid
-        cur = col.aggregate([{"$group": {"_id": "distinct_taxid", "count": {"$addToSet": "$taxid"}}},
-                             {"$project": {"count": {"$size": "$count"}}}])
-        res = list(cur)
-        assert len(res) == 1
-        distinct_taxid = res[0]["count"]
-        meta["unique taxonomy ids"] = distinct_taxid
-        # count per rank
-        cur = col.aggregate(
-            pipeline=[{"$group": {"_id": "$rank", "count": {"$sum": 1}}}])
-        res = list(cur)
-        meta["distribution of taxonomy ids by rank"] = {}
-        for rank_info in res:
-            meta["distribution of taxonomy ids by rank"].update(
-                {rank_info["_id"]: rank_info["count"]})
+        meta.update(stats.to_meta())
         self.logger.info("Metadata: %s" % meta)
         return meta
+
+
+class InMemoryTaxonomyDataBuilder(TaxonomyDataBuilder):
+    """
+    Build merged docs in memory from dumped files, without Mongo staging
+    (see inmemory module), straight to a bulk NDJSON file or an ES index.
+    The sink is chosen per build configuration with "inmemory_sink" param
+    ("ndjson" or "es", INMEMORY_BUILD_SINK in config by default).
+    The target collection stays empty: metadata stats are stored with the
+    build document, for metadata steps run separately.
+    """
+
+    async def merge_sources(self, source_names, steps=("merge", "post"), batch_size=100000,
+                            ids=None, job_manager=None):
+        self.merge_stats = {}
+        self.stats = {}
+        self.mapping = {}
+        if "merge" not in steps:
+            # docs are mapped while being built, there's no separate post-merge
+            self.logger.info("Skip in-memory build")
+            return self.merge_stats
+        self.register_status("building", transient=True, init=True, job={"step": "inmemory-build"})
+        pinfo = self.get_pinfo()
+        pinfo["step"] = "inmemory-build"
+        job = await job_manager.defer_to_thread(pinfo, partial(self.inmemory_merge, source_names))
+        count = await job
+        self.merge_stats[TaxonomyNamesUploader.name] = count
+        self.register_status("success", job={"step": "inmemory-build"},
+                             build={"taxonomy_stats": self.taxonomy_stats.to_meta()})
+        return self.merge_stats
+
+    def get_stats(self, sources, job_manager):
+        if self.taxonomy_stats is None:
+            # metadata step run on its own, or again later
+            build = self.source_backend.build.find_one({"_id": self.target_backend.target_name}) or {}
+            if build.get("taxonomy_stats"):
+                self.logger.info("Metadata stored by the in-memory build")
+                meta = {"__REPLACE__": True}
+                meta.update(build["taxonomy_stats"])
+                return meta
+            # built before stats were stored, from current dumped files
+            tree, _ = load_sources(source_folders())
+            self.taxonomy_stats = TaxonomyStats.from_tree(tree)
+        return super().get_stats(sources, job_manager)
+
+    def get_sink(self, source_names):
+        sink = self.build_config.get("inmemory_sink", config.INMEMORY_BUILD_SINK)
+        dropped_fields = DROPPED_FIELDS[config.INDEX_PROFILE]
+        if sink == "ndjson":
+            path = os.path.join(archive_path("INMEMORY_BUILD_FOLDER"), "%s.ndjson" % self.target_name)
+            return NDJSONSink(path, self.target_name, dropped_fields)
+        elif sink == "es":
+            env = self.build_config.get("inmemory_index_env", config.INMEMORY_BUILD_INDEX_ENV)
+            env_config = config.INDEX_CONFIG["env"][env]
+            client = Elasticsearch(env_config["host"], **env_config.get("indexer", {}).get("args", {}))
+            properties = dict(self.get_mapping(source_names), **TREE_MAPPINGS[config.INDEX_PROFILE])
+            return ESSink(client, self.target_name, properties,
+                          shards=self.build_config.get("num_shards", 1),
+                          replicas=self.build_config.get("num_replicas", 0),
+                          dropped_fields=dropped_fields)
+        raise BuilderException("Unknown in-memory build sink '%s'" % sink)
+
+    def inmemory_merge(self, source_names):
+        sink = self.get_sink(source_names)
+        self.logger.info("Building '%s' in memory to %s" % (self.target_name, sink.__class__.__name__))
+        self.instrumentation = Instrumentation()
+        count, self.taxonomy_stats = inmemory_build(sink, instrumentation=self.instrumentation)
+        return count
@@ -0,0 +1,277 @@
+"""
+Incremental taxonomy builds, from the differences between two taxdump releases.
+
+Instead of merging all sources again and recomputing lineage/children for the
+whole tree, nodes.dmp and names.dmp from the new release are compared to the
+previous one (also using merged.dmp and delnodes.dmp), and only documents
+which actually change are rebuilt and upserted in an existing merged
+collection:
+
+- added or re-parented nodes, and their whole subtree (lineage changes)
+- old and new parents of added, removed or re-parented nodes (children change)
+- nodes whose has_gene flag changes, and their parents (_has_gene_children)
+- nodes whose rank or names change
+
+DFS intervals (dfs_in/dfs_out) are spaced (see taxonomy.intervals), and read
+back from the collection: nodes which didn't move keep theirs, added and
+re-parented subtrees are placed in free ranges of their new parent's
+interval. Other documents only get dfs_in/dfs_out updated when the subtree
+of one of their ancestors has to be renumbered, its parent being full.
+"""
+import logging
+import os
+from array import array
+
+import biothings.utils.mongo as mongo
+from biothings.utils.hub_db import get_src_dump
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from taxonomy.intervals import read_intervals, update_intervals
+from taxonomy.tree import TaxonomyTree
+
+from ..dataload.sources.taxonomy.dumper import TaxonomyDumper
+from ..dataload.sources.taxonomy.parser import (iter_dmp_chunks, iter_nodes_records,
+                                                parse_refseq_names_fast)
+from ..dataload.sources.uniprot.uploader import UniprotSpeciesUploader
+from .mapper import LineageMapper, ScientificNameAbbreviationMapper, load_has_gene_taxids
+
+logger = logging.getLogger(__name__)
+
+DIGEST_MASK = (1 << 64) - 1
+
+
+def load_tree(data_folder):
+    with open(os.path.join(data_folder, "nodes.dmp"), "rb") as nodes_file:
+        return TaxonomyTree.from_nodes(iter_nodes_records(nodes_file))
+
+
+def names_digests(data_folder):
+    """
+    Return an array indexed by taxid, of digests of all names.dmp lines for
+    each taxid (0 when taxid has no names). Digests are only comparable within
+    the same process.
+    """
+    digests = array('Q')
+    with open(os.path.join(data_folder, "names.dmp"), "rb") as names_file:
+        for lines in iter_dmp_chunks(names_file):
+            for line in lines:
+                taxid = int(line[:line.find("\t")])
+                if taxid >= len(digests):
+                    digests.frombytes(bytes(8 * (taxid + 1 - len(digests) + len(digests) // 2)))
+                digests[taxid] = ((digests[taxid] * 1000003) ^ hash(line)) & DIGEST_MASK
+    return digests
+
+
+def read_dmp_taxids(dmp_path):
+    """First column of a .dmp file (merged.dmp, delnodes.dmp) as a set of taxids"""
+    taxids = set()
+    if os.path.exists(dmp_path):
+        with open(dmp_path, "rb") as dmp_file:
+            for lines in iter_dmp_chunks(dmp_file):
+                taxids.update(int(line[:line.find("\t")]) for line in lines)
+    return taxids
+
+
+def find_previous_release(data_folder, root_folder=TaxonomyDumper.SRC_ROOT_FOLDER):
+    """
+    Return the taxonomy data folder dumped before data_folder, if any.
+    Data folders are named after release timestamps, so they sort by date.
+    """
+    current = os.path.basename(os.path.normpath(data_folder))
+    previous = [folder for folder in os.listdir(root_folder)
+                if folder < current and os.path.exists(os.path.join(root_folder, folder, "nodes.dmp"))]
+    return os.path.join(root_folder, max(previous)) if previous else None
+
+
+class TaxdumpDiff(object):
+    """
+    Differences between two taxdump releases, as sets of taxids.
+    """
+
+    def __init__(self, old_tree, new_tree, old_names=None, new_names=None, removed=()):
+        self.old_tree = old_tree
+        self.new_tree = new_tree
+        self.added = set()
+        self.removed = set()
+        self.reparented = set()
+        self.modified = set()
+
+        old_ranks = old_tree.rank_names
+        new_ranks = new_tree.rank_names
+        for idx, taxid in enumerate(new_tree.taxids):
+            if taxid not in old_tree:
+                self.added.add(taxid)
+                continue
+            old_idx = old_tree.index_of(taxid)
+            if old_tree.taxids[old_tree.parents[old_idx]] != new_tree.taxids[new_tree.parents[idx]]:
+                self.reparented.add(taxid)
+            elif old_ranks[old_tree.ranks[old_idx]] != new_ranks[new_tree.ranks[idx]]:
+                self.modified.add(taxid)
+            if old_names is not None and new_names is not None and \
+                    self._digest(old_names, taxid) != self._digest(new_names, taxid):
+                self.modified.add(taxid)
+        for taxid in old_tree.taxids:
+            if taxid not in new_tree:
+                self.removed.add(taxid)
+        # deleted or merged taxids (delnodes.dmp/merged.dmp), if still around
+        self.removed.update(taxid for taxid in removed
+                            if taxid in old_tree and taxid not in new_tree)
+
+    @staticmethod
+    def _digest(digests, taxid):
+        return digests[taxid] if taxid < len(digests) else 0
+
+    @classmethod
+    def from_folders(cls, old_folder, new_folder):
+        removed = read_dmp_taxids(os.path.join(new_folder, "delnodes.dmp"))
+        removed.update(read_dmp_taxids(os.path.join(new_folder, "merged.dmp")))
+        return cls(load_tree(old_folder), load_tree(new_folder),
+                   names_digests(old_folder), names_digests(new_folder), removed)
+
+    def affected_taxids(self, has_gene_changed=()):
+        """
+        Return the set of taxids (all part of the new tree) whose documents
+        must be rebuilt. has_gene_changed are taxids whose has_gene flag changed.
+        """
+        old_tree = self.old_tree
+        new_tree = self.new_tree
+        affected = set(self.added)
+        affected.update(self.modified)
+        for taxid in self.added | self.reparented:
+            # whole subtree gets a new lineage
+            affected.add(taxid)
+            affected.update(new_tree.descendants(taxid))
+            # new parent gets a new child
+            affected.add(new_tree.parent_taxid(taxid))
+        for taxid in self.removed | self.reparented:
+            # old parent loses a child
+            affected.add(old_tree.parent_taxid(taxid))
+        for taxid in has_gene_changed:
+            if taxid in new_tree:
+                affected.add(taxid)
+                affected.add(new_tree.parent_taxid(taxid))
+        return set(taxid for taxid in affected if taxid in new_tree)
+
+    def update_intervals(self):
+        """
+        Set the index intervals of the new tree from those of the old tree
+        (see TaxonomyTree.index_intervals()), placing added and re-parented
+        subtrees. Return the set of taxids whose interval changed.
+        """
+        old_tree = self.old_tree
+        new_tree = self.new_tree
+        old_in, old_out = old_tree.index_intervals()
+        size = len(new_tree.taxids)
+        index_in = array('i', [-1]) * size
+        index_out = array('i', [-1]) * size
+        for idx, taxid in enumerate(new_tree.taxids):
+            if taxid in old_tree:
+                old_idx = old_tree.index_of(taxid)
+                index_in[idx] = old_in[old_idx]
+                index_out[idx] = old_out[old_idx]
+        changed = update_intervals(new_tree, index_in, index_out, self.added | self.reparented)
+        new_tree.set_index_intervals(index_in, index_out)
+        return set(new_tree.taxids[idx] for idx in changed)
+
+    def __repr__(self):
+        return "<%s added=%d removed=%d reparented=%d modified=%d>" % (
+            self.__class__.__name__, len(self.added), len(self.removed),
+            len(self.reparented), len(self.modified))
+
+
+def build_docs(taxids, tree, names_folder, batch_size=10000):
+    """
+    Yield merged docs for given taxids, from names.dmp, the tree and uniprot
+    collection, with has_gene, lineage, children and abbreviations set.
+    """
+    docs = {}
+    with open(os.path.join(names_folder, "names.dmp"), "rb") as names_file:
+        for doc in parse_refseq_names_fast(names_file):
+            if doc["taxid"] in taxids:
+                docs[doc["taxid"]] = doc
+    for taxid in taxids:
+        doc = docs.setdefault(taxid, {"_id": str(taxid), "taxid": taxid})
+        doc["parent_taxid"] = tree.parent_taxid(taxid)
+        doc["rank"] = tree.rank(taxid)
+        doc["has_gene"] = tree.has_gene(taxid)
+
+    uniprot_col = mongo.get_src_db()[UniprotSpeciesUploader.name]
+    lineage_mapper = LineageMapper(name="lineage", tree=tree)
+    abbreviation_mapper = ScientificNameAbbreviationMapper(name="scientific_name_abbreviation")
+    taxids = list(docs)
+    for start in range(0, len(taxids), batch_size):
+        batch = [docs.pop(taxid) for taxid in taxids[start:start + batch_size]]
+        ids = [doc["_id"] for doc in batch]
+        uniprot = {d["_id"]: d["uniprot_name"]
+                   for d in uniprot_col.find({"_id": {"$in": ids}}, {"uniprot_name": 1})}
+        for doc in batch:
+            if doc["_id"] in uniprot:
+                doc["uniprot_name"] = uniprot[doc["_id"]]
+        yield from abbreviation_mapper.process(lineage_mapper.process(batch))
+
+
+def incremental_update(target_name, old_folder, new_folder, batch_size=10000):
+    """
+    Update merged collection target_name, built from taxdump release in
+    old_folder, to taxdump release in new_folder. Return the TaxdumpDiff.
+    """
+    target_col = mongo.get_target_db()[target_name]
+    logger.info("Computing differences between '%s' and '%s'" % (old_folder, new_folder))
+    diff = TaxdumpDiff.from_folders(old_folder, new_folder)
+    logger.info("Taxdump diff: %s" % diff)
+
+    tree = diff.new_tree
+    tree.compute_dfs_intervals()
+    has_gene = load_has_gene_taxids()
+    tree.set_has_gene(has_gene)
+    previous_has_gene = set(d["taxid"] for d in target_col.find({"has_gene": True}, {"taxid": 1}))
+    has_gene_changed = previous_has_gene.symmetric_difference(
+        taxid for taxid in has_gene if taxid in tree)
+
+    affected = diff.affected_taxids(has_gene_changed)
+    # intervals stored by the previous build, they depend on past updates
+    diff.old_tree.set_index_intervals(*read_intervals(diff.old_tree, target_col.find(
+        {"dfs_in": {"$exists": True}}, {"taxid": 1, "dfs_in": 1, "dfs_out": 1})))
+    renumbered = diff.update_intervals() - affected
+    logger.info("Rebuilding %d documents, deleting %d" % (len(affected), len(diff.removed)))
+    ops = []
+    for doc in build_docs(affected, tree, new_folder, batch_size):
+        ops.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+        if len(ops) >= batch_size:
+            target_col.bulk_write(ops, ordered=False)
+            ops = []
+    for taxid in renumbered:
+        dfs_in, dfs_out = tree.index_interval(taxid)
+        ops.append(UpdateOne({"_id": str(taxid)}, {"$set": {"dfs_in": dfs_in, "dfs_out": dfs_out}}))
+        if len(ops) >= batch_size:
+            target_col.bulk_write(ops, ordered=False)
+            ops = []
+    logger.info("Updated DFS intervals of %d other documents" % len(renumbered))
+    ops.extend(DeleteOne({"_id": str(taxid)}) for taxid in diff.removed)
+    if ops:
+        target_col.bulk_write(ops, ordered=False)
+    return diff
+
+
+def incremental_build(target_name, old_folder=None, new_folder=None, batch_size=10000):
+    """
+    Hub entry point: update target_name merged collection, by default from
+    the previous taxonomy release to the currently dumped one.
+    """
+    old_folder, new_folder = release_folders(old_folder, new_folder)
+    return incremental_update(target_name, old_folder, new_folder, batch_size)
+
+
+def release_folders(old_folder=None, new_folder=None):
+    """
+    (old_folder, new_folder) taxonomy data folders, by default the previous
+    release and the currently dumped one
+    """
+    if new_folder is None:
+        new_folder = get_src_dump().find_one({"_id": TaxonomyDumper.SRC_NAME})["download"]["data_folder"]
+    if old_folder is None:
+        old_folder = find_previous_release(new_folder)
+        if old_folder is None:
+            raise ValueError("No taxonomy release found before '%s', "
+                             "a full build is needed" % new_folder)
+    return old_folder, new_folder
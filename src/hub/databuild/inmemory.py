@@ -0,0 +1,208 @@
+"""
+In-memory taxonomy builds, without staging sources in MongoDB.
+
+Merged docs are built straight from dumped files: nodes.dmp is loaded as a
+compact TaxonomyTree (has_gene flags set from gene_info.gz), speclist.txt as
+a taxid -> uniprot name dict, then names.dmp is streamed, each names doc
+being joined by taxid with the tree and uniprot names, and mapped (lineage,
+children, abbreviations) the same way post_merge does. Finished docs are
+written to a sink:
+
+- NDJSONSink: NDJSON file, as ES bulk requests or one doc per line
+- ESSink: ES index, with byte-sized parallel bulk requests
+
+Taxids only found in speclist.txt (not part of NCBI taxonomy) are skipped.
+"""
+import logging
+import os
+import time
+
+import config
+from biothings.hub.dataindex.indexer_payload import DEFAULT_INDEX_SETTINGS
+from biothings.utils.hub_db import get_src_dump
+from elasticsearch import helpers
+
+from ..dataindex.indexer import iter_actions
+from ..dataload.sources.geneinfo.dumper import GeneInfoDumper
+from ..dataload.sources.geneinfo.parser import load_geneinfo_taxids, parse_geneinfo_taxid
+from ..dataload.sources.taxonomy.dumper import TaxonomyDumper
+from ..dataload.sources.taxonomy.parser import parse_refseq_names_fast
+from ..dataload.sources.uniprot.dumper import UniprotSpeciesDumper
+from ..dataload.sources.uniprot.parser import parse_uniprot_speclist
+from ..instrumentation import Instrumentation
+from .incremental import load_tree
+from .mapper import LineageMapper, ScientificNameAbbreviationMapper
+from .ndjson import WRITE_BLOCK_SIZE, dumps
+from .stats import TaxonomyStats
+
+logger = logging.getLogger(__name__)
+
+SOURCES = (TaxonomyDumper.SRC_NAME, UniprotSpeciesDumper.SRC_NAME, GeneInfoDumper.SRC_NAME)
+
+
+def source_folders():
+    """{source name: data folder} of current taxonomy, uniprot and geneinfo dumps"""
+    folders = {}
+    for name in SOURCES:
+        doc = get_src_dump().find_one({"_id": name})
+        if not doc or not doc.get("download", {}).get("data_folder"):
+            raise ValueError("Source '%s' hasn't been dumped yet" % name)
+        folders[name] = doc["download"]["data_folder"]
+    return folders
+
+
+def load_has_gene_taxids(data_folder):
+    """Set of taxids having genes, from gene_info.gz (or gene_info) in data_folder"""
+    gz_file = os.path.join(data_folder, "gene_info.gz")
+    if os.path.exists(gz_file):
+        with open(gz_file, "rb") as fileh:
+            return load_geneinfo_taxids(fileh)
+    # data folder dumped (and gunzipped) by a previous dumper version
+    with open(os.path.join(data_folder, "gene_info")) as fileh:
+        return set(int(doc["_id"]) for doc in parse_geneinfo_taxid(fileh))
+
+
+def load_uniprot_names(data_folder):
+    """{taxid: uniprot name} from speclist.txt in data_folder"""
+    with open(os.path.join(data_folder, "speclist.txt")) as fileh:
+        return {doc["taxid"]: doc["uniprot_name"] for doc in parse_uniprot_speclist(fileh)}
+
+
+def load_sources(folders):
+    """
+    (tree, uniprot names) from dumped files, tree having has_gene flags,
+    lineages and DFS intervals computed
+    """
+    tree = load_tree(folders[TaxonomyDumper.SRC_NAME])
+    tree.set_has_gene(load_has_gene_taxids(folders[GeneInfoDumper.SRC_NAME]))
+    tree.compute_lineages()
+    tree.compute_dfs_intervals()
+    uniprot = load_uniprot_names(folders[UniprotSpeciesDumper.SRC_NAME])
+    return tree, uniprot
+
+
+def iter_docs(tree, uniprot, names_folder, batch_size=10000, instrumentation=None):
+    """
+    Yield merged and mapped docs, streamed from names.dmp in names_folder.
+    Mappers are timed per batch in instrumentation, if given.
+    """
+    instrumentation = instrumentation or Instrumentation()
+    mappers = (LineageMapper(name="lineage", tree=tree),
+               ScientificNameAbbreviationMapper(name="scientific_name_abbreviation"))
+
+    def map_batch(docs):
+        for mapper in mappers:
+            with instrumentation.stage("map_%s" % mapper.name).measure(len(docs)):
+                docs = list(mapper.process(docs))
+        return docs
+
+    batch = []
+    with open(os.path.join(names_folder, "names.dmp"), "rb") as names_file:
+        for doc in parse_refseq_names_fast(names_file):
+            taxid = doc["taxid"]
+            if taxid not in tree:
+                continue
+            doc["parent_taxid"] = tree.parent_taxid(taxid)
+            doc["rank"] = tree.rank(taxid)
+            doc["has_gene"] = tree.has_gene(taxid)
+            if taxid in uniprot:
+                doc["uniprot_name"] = uniprot[taxid]
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield from map_batch(batch)
+                batch = []
+    if batch:
+        yield from map_batch(batch)
+
+
+class NDJSONSink(object):
+    """
+    Write docs to an NDJSON file at path: ES bulk requests (action line then
+    doc line) if index_name is given, one doc per line otherwise.
+    """
+
+    def __init__(self, path, index_name=None, dropped_fields=()):
+        self.path = path
+        self.index_name = index_name
+        self.dropped_fields = dropped_fields
+
+    def write(self, docs):
+        """Write all docs, return the number of docs written"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        count = 0
+        block = []
+        block_size = 0
+        with open(self.path, "wb") as fileh:
+            for doc in docs:
+                for field in self.dropped_fields:
+                    doc.pop(field, None)
+                if self.index_name:
+                    block.append(dumps({"index": {"_index": self.index_name, "_id": doc.pop("_id")}}))
+                    block_size += len(block[-1])
+                block.append(dumps(doc))
+                block_size += len(block[-1])
+                count += 1
+                if block_size >= WRITE_BLOCK_SIZE:
+                    fileh.write(b"".join(block))
+                    block = []
+                    block_size = 0
+            fileh.write(b"".join(block))
+        return count
+
+
+class ESSink(object):
+    """
+    Index docs in a new index_name index, mapped with properties, using
+    byte-sized parallel bulk requests (see INDEX_BULK_* in config).
+    Refresh and replicas are only enabled once all docs are indexed.
+    """
+
+    def __init__(self, client, index_name, properties, shards=1, replicas=0, dropped_fields=()):
+        self.client = client
+        self.index_name = index_name
+        self.properties = properties
+        self.shards = shards
+        self.replicas = replicas
+        self.dropped_fields = dropped_fields
+
+    def write(self, docs):
+        """Create the index and index all docs, return the number of docs indexed"""
+        settings = dict(DEFAULT_INDEX_SETTINGS, number_of_shards=self.shards,
+                        number_of_replicas=0, refresh_interval="-1")
+        self.client.indices.create(index=self.index_name, body={
+            "settings": {"index": settings},
+            "mappings": {"dynamic": "false", "properties": self.properties},
+        })
+        count = 0
+        for ok, _ in helpers.parallel_bulk(
+                self.client, iter_actions(docs, self.index_name, self.dropped_fields),
+                chunk_size=config.INDEX_BULK_MAX_DOCS, max_chunk_bytes=config.INDEX_BULK_MAX_BYTES,
+                thread_count=config.INDEX_BULK_THREADS, queue_size=config.INDEX_BULK_THREADS):
+            count += ok
+        self.client.indices.put_settings(index=self.index_name, body={"index": {
+            "refresh_interval": None, "number_of_replicas": self.replicas}})
+        self.client.indices.refresh(index=self.index_name)
+        return count
+
+
+def inmemory_build(sink, folders=None, batch_size=10000, instrumentation=None):
+    """
+    Build all merged docs from dumped files (current dumps by default) into
+    sink. Return (number of docs, TaxonomyStats). Stages are recorded in
+    instrumentation if given: load_sources, map_<mapper name>, and build
+    (the whole streaming of docs to the sink, mapping included).
+    """
+    instrumentation = instrumentation or Instrumentation()
+    folders = folders or source_folders()
+    t0 = time.time()
+    with instrumentation.stage("load_sources").measure():
+        tree, uniprot = load_sources(folders)
+    logger.info("Sources loaded in %.1fs: %d nodes (%.1fMB), %d uniprot names" %
+                (time.time() - t0, len(tree), tree.nbytes / 1024 / 1024, len(uniprot)))
+    with instrumentation.stage("build").measure() as batch:
+        batch["docs"] = count = sink.write(iter_docs(
+            tree, uniprot, folders[TaxonomyDumper.SRC_NAME], batch_size, instrumentation))
+    with instrumentation.stage("stats").measure():
+        stats = TaxonomyStats.from_tree(tree)
+    logger.info("In-memory build done in %.1fs: %d docs, %r" % (time.time() - t0, count, instrumentation))
+    return count, stats
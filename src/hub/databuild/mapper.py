@@ -1,88 +1,251 @@
 import logging
-from collections import defaultdict
+import os
+import threading
+import time
 
 import biothings
 import biothings.hub.databuild.mapper as mapper
 import biothings.utils.mongo as mongo
 import config
+from biothings.utils.hub_db import get_src_dump
+
+from taxonomy.names import NAME_FIELDS, NamesIndex, abbreviate_scientific_name
+from taxonomy.tree import TaxidBitmap, TaxonomyTree
 
 # just to get the collection name
 from ..dataload.sources.geneinfo.uploader import GeneInfoUploader
-from ..dataload.sources.taxonomy.uploader import TaxonomyNodesUploader
+from ..dataload.sources.taxonomy.uploader import TaxonomyNamesUploader, TaxonomyNodesUploader
 
 biothings.config_for_app(config)
 
 
+def load_has_gene_taxids():
+    """
+    Return a TaxidBitmap of all taxids having genes (geneinfo _ids are taxids)
+    """
+    col = mongo.get_src_db()[GeneInfoUploader.name]
+    return TaxidBitmap(int(d["_id"]) for d in col.find({}, {"_id": 1}, batch_size=10000))
+
+
+def load_tree():
+    """
+    Build the TaxonomyTree from nodes collection, in one bulk scan, and flag
+    nodes having genes
+    """
+    col = mongo.get_src_db()[TaxonomyNodesUploader.name]
+    cur = col.find({}, {"_id": 0, "taxid": 1, "parent_taxid": 1, "rank": 1},
+                   batch_size=10000)
+    tree = TaxonomyTree.from_nodes(
+        (d["taxid"], d["parent_taxid"], d.get("rank")) for d in cur)
+    tree.set_has_gene(load_has_gene_taxids())
+    return tree
+
+
+def archive_path(setting):
+    """Path set in config (relative to DATA_ARCHIVE_ROOT), None if disabled"""
+    path = getattr(config, setting, None)
+    if path and not os.path.isabs(path):
+        path = os.path.join(config.DATA_ARCHIVE_ROOT, path)
+    return path
+
+
+def tree_snapshot_path():
+    """Path of the taxonomy tree snapshot, None if disabled"""
+    return archive_path("TAXONOMY_SNAPSHOT")
+
+
+def upload_versions(*uploaders):
+    """
+    {collection name: start time of its last upload} for uploaders, from
+    src_dump (None if never uploaded). Unlike documents counts, it changes
+    with every upload, and is set before post-upload steps run.
+    """
+    versions = {}
+    for klass in uploaders:
+        doc = get_src_dump().find_one({"_id": klass.main_source or klass.name}) or {}
+        started_at = doc.get("upload", {}).get("jobs", {}).get(klass.name, {}).get("started_at")
+        versions[klass.name] = started_at and str(started_at)
+    return versions
+
+
+def tree_snapshot_metadata():
+    """Upload versions of the collections a snapshot is built from"""
+    return upload_versions(TaxonomyNodesUploader, GeneInfoUploader)
+
+
+def write_tree_snapshot():
+    """
+    Build the tree from source collections, with DFS intervals, and save it
+    as a snapshot (see TAXONOMY_SNAPSHOT in config). Return its path.
+    """
+    path = tree_snapshot_path()
+    if not path:
+        return None
+    logger = logging.getLogger(__name__)
+    t0 = time.time()
+    tree = load_tree()
+    tree.compute_dfs_intervals()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tree.save_snapshot(path, tree_snapshot_metadata())
+    logger.info("Taxonomy tree snapshot '%s' written in %.1fs: %d nodes, %.1fMB" %
+                (path, time.time() - t0, len(tree), os.path.getsize(path) / 1024 / 1024))
+    return path
+
+
+def open_tree_snapshot():
+    """
+    Open the tree snapshot, None if there's none or if it's outdated
+    (source collections uploaded again since it was written)
+    """
+    path = tree_snapshot_path()
+    if not path or not os.path.exists(path):
+        return None
+    logger = logging.getLogger(__name__)
+    try:
+        tree = TaxonomyTree.open_snapshot(path)
+    except ValueError as e:
+        logger.warning("Ignoring taxonomy tree snapshot: %s" % e)
+        return None
+    if tree.metadata != tree_snapshot_metadata():
+        logger.warning("Ignoring outdated taxonomy tree snapshot '%s'" % path)
+        return None
+    return tree
+
+
+def write_names_index():
+    """
+    Build the names index from names collection and save it (see
+    TAXONOMY_NAMES_INDEX in config). Return its path.
+    """
+    path = archive_path("TAXONOMY_NAMES_INDEX")
+    if not path:
+        return None
+    logger = logging.getLogger(__name__)
+    t0 = time.time()
+    # ranks of scientific names to abbreviate
+    tree = open_tree_snapshot() or load_tree()
+    col = mongo.get_src_db()[TaxonomyNamesUploader.name]
+    projection = dict({"_id": 0, "taxid": 1}, **{field: 1 for field in NAME_FIELDS})
+    docs = col.find({}, projection, batch_size=10000)
+    index = NamesIndex.from_docs(
+        dict(doc, rank=tree.rank(doc["taxid"])) if doc["taxid"] in tree else doc for doc in docs)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    index.save(path, upload_versions(TaxonomyNamesUploader, TaxonomyNodesUploader))
+    logger.info("Taxonomy names index '%s' written in %.1fs: %d names, %.1fMB" %
+                (path, time.time() - t0, len(index), os.path.getsize(path) / 1024 / 1024))
+    return path
+
+
+def doc_taxid(doc):
+    """Taxid of a doc as an int, taken from "taxid" or from "_id" if missing"""
+    taxid = doc.get("taxid")
+    if taxid is None:
+        taxid = doc["_id"]
+    return int(taxid)
+
+
 class HasGeneMapper(mapper.BaseMapper):
+    """
+    Mapper flagging docs whose taxid has genes in NCBI gene_info.
+
+    Membership is checked against a bitmap keyed on integer taxids, and
+    load time, memory and hit rate are reported by get_stats().
+    """
 
     def __init__(self, *args, **kwargs):
         super(HasGeneMapper, self).__init__(*args, **kwargs)
         self.cache = None
+        self.logger = logging.getLogger(__name__)
+        self.load_time = None
+        self.lookups = 0
+        self.hits = 0
 
     def load(self):
         if self.cache is None:
-            # this is a whole dict containing all taxonomu _ids
-            col = mongo.get_src_db()[GeneInfoUploader.name]
-            self.cache = [d["_id"] for d in col.find({}, {"_id": 1})]
+            t0 = time.time()
+            tree = open_tree_snapshot()
+            if tree is not None:
+                self.cache = tree.has_gene_taxids()
+            else:
+                self.cache = load_has_gene_taxids()
+            self.load_time = time.time() - t0
+            self.logger.info("has_gene cache loaded in %.2fs: %d taxids, %.1fKB" %
+                             (self.load_time, len(self.cache), self.cache.nbytes / 1024))
+
+    def get_stats(self):
+        return {
+            "load_time": self.load_time,
+            "taxids": len(self.cache) if self.cache is not None else 0,
+            "memory": self.cache.nbytes if self.cache is not None else 0,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+        }
 
     def process(self, docs):
+        cache = self.cache
+        lookups = hits = 0
         for doc in docs:
-            if doc["_id"] in self.cache:
+            lookups += 1
+            if doc_taxid(doc) in cache:
+                hits += 1
                 doc["has_gene"] = True
             else:
                 doc["has_gene"] = False
             yield doc
+        self.lookups += lookups
+        self.hits += hits
+        self.logger.debug("has_gene: %d/%d docs in batch, overall hit rate %.2f%%" %
+                          (hits, lookups, 100 * self.get_stats()["hit_rate"]))
 
 
 class LineageMapper(mapper.BaseMapper):
+    """
+    Mapper adding lineage, depth, children and ancestors to docs, from the
+    taxonomy tree. When the tree has DFS intervals computed, dfs_in/dfs_out
+    (spaced, see TaxonomyTree.index_intervals()) are also added, so a whole
+    subtree can be queried with a single range.
+
+    With precompute_lineages=True, lineages and DFS intervals of the whole
+    tree are computed in one pass when loading, and each doc's lineage is then
+    sliced from it (faster when all docs are going to be processed, as in
+    post_merge).
+    An already built TaxonomyTree can be given instead of loading it from
+    the snapshot or the nodes collection.
+    """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, precompute_lineages=False, tree=None, **kwargs):
         super(LineageMapper, self).__init__(*args, **kwargs)
-        self.cache = None
-        self.parent_to_children = None
+        self.precompute_lineages = precompute_lineages
+        self.tree = tree
         self.logger = logging.getLogger(__name__)
-        self.has_gene_set = None
 
     def load(self):
-        if self.cache is None:
-            # Build self.cache: taxid -> parent_taxid
-            col = mongo.get_src_db()[TaxonomyNodesUploader.name]
-            self.cache = {}
-            for d in col.find({}, {"parent_taxid": 1, "taxid": 1}):
-                self.cache[d["taxid"]] = d["parent_taxid"]
-
-            self.parent_to_children = defaultdict(list)
-            for taxid, parent_taxid in self.cache.items():
-                if taxid != parent_taxid:  # exclude root which points to itself
-                    self.parent_to_children[parent_taxid].append(taxid)
-
-        # Also build self.has_gene_set
-        if self.has_gene_set is None:
-            geneinfo_col = mongo.get_src_db()[GeneInfoUploader.name]
-            self.has_gene_set = set(doc["_id"]
-                                    for doc in geneinfo_col.find({}, {"_id": 1}))
+        if self.tree is None:
+            # memory-mapped snapshot written at upload time if up-to-date,
+            # otherwise built from nodes and geneinfo collections
+            self.tree = open_tree_snapshot() or load_tree()
+            if self.precompute_lineages:
+                self.tree.compute_lineages()
+                if self.tree.dfs_in is None:
+                    self.tree.compute_dfs_intervals()
+            self.logger.info("Taxonomy tree loaded: %d nodes, %.1fMB" %
+                             (len(self.tree), self.tree.nbytes / 1024 / 1024))
 
     def get_lineage(self, doc):
-        if doc["taxid"] == doc["parent_taxid"]:
-            # We reached the top of the taxonomy tree
-            doc["lineage"] = [doc["taxid"]]
-        else:
-            # initiate lineage with current doc
-            lineage = [doc["taxid"], doc["parent_taxid"]]
-            while lineage[-1] != 1:
-                parent = self.cache[lineage[-1]]
-                lineage.append(parent)
-            doc["lineage"] = lineage
+        # lineage (from the node itself up to the root of the taxonomy tree)
+        doc["lineage"] = self.tree.lineage(doc["taxid"])
+        doc["depth"] = len(doc["lineage"]) - 1
+        # subtree bounds
+        if self.tree.dfs_in is not None:
+            doc["dfs_in"], doc["dfs_out"] = self.tree.index_interval(doc["taxid"])
 
         # children
-        children = self.parent_to_children.get(doc["taxid"], [])
+        children = self.tree.children(doc["taxid"])
         if children:
             doc["children"] = children
-
             # Build _has_gene_children as a filtered subset
-            doc["_has_gene_children"] = [
-                child for child in children if str(child) in self.has_gene_set
-            ]
+            doc["_has_gene_children"] = self.tree.has_gene_children(doc["taxid"])
         else:
             doc["children"] = []
             doc["_has_gene_children"] = []
@@ -108,145 +271,73 @@ class ScientificNameAbbreviationMapper(mapper.BaseMapper):
     - species: Genus species -> G. species
     - subspecies: Genus species ssp./subsp. -> G. species ssp./subsp.
     - strain: Genus species str. -> G. species str.
+
+    Docs are processed per batch, and only counters plus a sample of
+    abbreviated docs are logged.
     """
 
+    target_ranks = frozenset(['species', 'subspecies', 'strain'])
+    # one abbreviated doc out of log_sample is logged
+    log_sample = 10000
+
     def __init__(self, *args, **kwargs):
         super(ScientificNameAbbreviationMapper, self).__init__(*args, **kwargs)
         self.logger = logging.getLogger(__name__)
-
-    def _is_target_rank(self, rank):
-        """Check if rank is one we want to abbreviate"""
-        target_ranks = {'species', 'subspecies', 'strain'}
-        return rank in target_ranks if rank else False
-
-    def _abbreviate_scientific_name(self, name, rank):
-        """
-        Abbreviate scientific name based on taxonomic rank.
-
-        Args:
-            name: Scientific name to abbreviate
-            rank: Taxonomic rank (species, subspecies, strain)
-
-        Returns:
-            List of abbreviated names
-        """
-        if not name or not isinstance(name, str):
-            return []
-
-        # Clean and split the name
-        name = name.strip()
-        parts = name.split()
-
-        # Need at least genus and species for abbreviation
-        if len(parts) < 2:
-            return []
-
-        # Abbreviate first part (genus) to first letter + dot
-        genus = parts[0]
-        if len(genus) == 0:
-            return []
-
-        abbreviated_genus = genus[0].upper() + '.'
-        abbreviated_names = []
-
-        if rank == 'species':
-            # For species: skip if "sp." exists in the scientific name
-            if 'sp.' in name:
-                return []
-            # For species: G. species
-            if len(parts) >= 2:
-                abbreviated = abbreviated_genus + ' ' + ' '.join(parts[1:])
-                abbreviated_names.append(abbreviated)
-
-        elif rank == 'subspecies':
-            # For subspecies: G. species ssp. {rest} and G. species subsp.
-            if len(parts) >= 3:
-                species_part = parts[1]
-                rest_parts = parts[2:]
-
-                # Remove existing ssp. or subsp. if present
-                rest_parts_clean = []
-                for part in rest_parts:
-                    if part not in ['ssp.', 'subsp.']:
-                        rest_parts_clean.append(part)
-
-                # Create both ssp. and subsp. variants
-                rest_joined = ' '.join(rest_parts_clean)
-                ssp_abbrev = (f"{abbreviated_genus} {species_part} "
-                              f"ssp. {rest_joined}")
-                subsp_abbrev = (f"{abbreviated_genus} {species_part} "
-                                f"subsp. {rest_joined}")
-
-                abbreviated_names.extend([ssp_abbrev, subsp_abbrev])
-
-        elif rank == 'strain':
-            # For strain: if has 'str. ' do G. species abbreviation, keep rest
-            if len(parts) >= 3:
-                species_part = parts[1]
-                rest_parts = parts[2:]
-
-                # If str. is already present, keep everything after it
-                if 'str.' in rest_parts:
-                    str_index = rest_parts.index('str.')
-                    # Keep str. and everything after it
-                    rest_parts_to_keep = rest_parts[str_index:]
-                else:
-                    # Add str. prefix to the rest
-                    rest_parts_to_keep = ['str.'] + rest_parts
-
-                rest_joined = ' '.join(rest_parts_to_keep)
-                str_abbrev = (f"{abbreviated_genus} {species_part} "
-                              f"{rest_joined}")
-                abbreviated_names.append(str_abbrev)
-
-        return abbreviated_names
-
-    def process(self, docs):
-        processed_count = 0
-        abbreviation_count = 0
-
+        self.lock = threading.Lock()
+        self.processed_count = 0
+        self.abbreviation_count = 0
+        self.names_count = 0
+
+    def get_stats(self):
+        return {
+            "processed": self.processed_count,
+            "abbreviated": self.abbreviation_count,
+            "names_added": self.names_count,
+        }
+
+    def process_batch(self, docs):
+        """Add abbreviations to docs (a list), in place"""
+        target_ranks = self.target_ranks
+        abbreviate = abbreviate_scientific_name
+        abbreviated_docs = names_added = 0
         for doc in docs:
-            processed_count += 1
-            rank = doc.get("rank", "")
-
-            if self._is_target_rank(rank):
-                # Get existing other_names or empty list if doesn't exist
-                original_names = doc.get("other_names", [])
-                all_abbreviated_names = []
-
-                # Always try to abbreviate the scientific_name
-                scientific_name = doc.get("scientific_name", "")
-                if scientific_name:
-                    abbreviated_list = self._abbreviate_scientific_name(
-                        scientific_name, rank)
-
-                    for abbreviated in abbreviated_list:
-                        # Only add if it's different from scientific_name
-                        # and not already present in original_names
-                        if (abbreviated != scientific_name and
-                                abbreviated not in original_names and
-                                abbreviated not in all_abbreviated_names):
-                            all_abbreviated_names.append(abbreviated)
-
-                # Add abbreviated names to other_names if any were created
-                if all_abbreviated_names:
-                    # Only update other_names if we have new abbreviations
-                    if original_names:
-                        # Preserve existing other_names and add abbreviations
-                        doc["other_names"] = (original_names +
-                                              all_abbreviated_names)
-                    else:
-                        # Create new other_names with just the abbreviations
-                        doc["other_names"] = all_abbreviated_names
-
-                    taxid = doc.get('taxid')
-                    abbreviation_count += 1
-                    self.logger.info(f"Added abbreviations for taxid "
-                                     f"{taxid} (rank: {rank}): "
-                                     f"{all_abbreviated_names}")
+            rank = doc.get("rank")
+            if rank not in target_ranks:
+                continue
+            scientific_name = doc.get("scientific_name")
+            if not scientific_name or not isinstance(scientific_name, str):
+                continue
+            abbreviated_list = abbreviate(scientific_name, rank)
+            if not abbreviated_list:
+                continue
+            # Only add if it's different from scientific_name
+            # and not already present in other_names
+            original_names = doc.get("other_names") or []
+            seen = set(original_names)
+            seen.add(scientific_name)
+            new_names = []
+            for abbreviated in abbreviated_list:
+                if abbreviated not in seen:
+                    seen.add(abbreviated)
+                    new_names.append(abbreviated)
+            if new_names:
+                # Preserve existing other_names and add abbreviations
+                doc["other_names"] = original_names + new_names
+                abbreviated_docs += 1
+                names_added += len(new_names)
+                if (self.abbreviation_count + abbreviated_docs) % self.log_sample == 1:
+                    self.logger.info("Added abbreviations for taxid %s (rank: %s): %s" %
+                                     (doc.get("taxid"), rank, new_names))
+        with self.lock:
+            self.processed_count += len(docs)
+            self.abbreviation_count += abbreviated_docs
+            self.names_count += names_added
+        self.logger.debug("ScientificNameAbbreviationMapper: %d/%d docs abbreviated in batch, "
+                          "%d docs processed overall" %
+                          (abbreviated_docs, len(docs), self.processed_count))
+        return docs
 
-            yield doc
-
-        self.logger.info(f"ScientificNameAbbreviationMapper processed "
-                         f"{processed_count} docs, added abbreviations to "
-                         f"{abbreviation_count} docs")
+    def process(self, docs):
+        if not isinstance(docs, list):
+            docs = list(docs)
+        yield from self.process_batch(docs)
@@ -0,0 +1,21 @@
+"""
+NDJSON output of taxonomy docs, shared by in-memory builds and the
+taxonomy_parser script: one JSON doc per line, encoded with orjson if
+available, files being written in blocks of WRITE_BLOCK_SIZE bytes.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# output is written in blocks of about this size (bytes)
+WRITE_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def dumps(entry):
+    """json line (bytes) of entry, with orjson if available"""
+    if orjson is not None:
+        return orjson.dumps(entry) + b'\n'
+    return (json.dumps(entry) + '\n').encode('utf-8')
@@ -0,0 +1,120 @@
+"""
+Pipelined post-merge: reading docs from the merged collection, mapping them
+(lineage, abbreviations, ...) and writing them back run concurrently:
+
+    reader thread --(read queue)--> mapping pool --(write queue)--> writer thread
+
+The writer only $set fields that mappers produce, with unordered bulk_write.
+Stages (read, each mapper, write) are recorded in an Instrumentation.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from biothings.utils.mongo import doc_feeder
+from pymongo import UpdateOne
+
+from ..instrumentation import Instrumentation
+
+# end of stream marker in queues
+_DONE = object()
+
+
+class PostMergePipeline(object):
+    """
+    Run mappers over all docs of collection and write back changed fields.
+
+    mappers: list of mappers (with process(docs) methods), applied in order
+    read_fields: fields fetched from collection (projection)
+    write_fields: fields written back ($set) when present in mapped docs
+    changed_fields: subset of write_fields only written if mappers changed
+                    their length (eg. other_names, which mappers extend)
+    instrumentation: Instrumentation recording read, map_<mapper name> and
+                     write stages (a new one by default)
+    """
+
+    def __init__(self, collection, mappers, read_fields, write_fields, changed_fields=(),
+                 batch_size=10000, map_workers=2, read_queue=4, write_queue=4, logger=None,
+                 instrumentation=None):
+        self.collection = collection
+        self.mappers = mappers
+        self.read_fields = read_fields
+        self.write_fields = write_fields
+        self.changed_fields = changed_fields
+        self.batch_size = batch_size
+        self.map_workers = map_workers
+        self.read_queue = queue.Queue(maxsize=read_queue)
+        self.write_queue = queue.Queue(maxsize=write_queue)
+        self.logger = logger or logging.getLogger(__name__)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.error = None
+
+    def read(self):
+        try:
+            for docs in self.instrumentation.timed("read", doc_feeder(
+                    self.collection, step=self.batch_size, inbatch=True, fields=self.read_fields)):
+                self.read_queue.put(docs)
+                if self.error:
+                    break
+        except Exception as e:
+            self.error = self.error or e
+        finally:
+            self.read_queue.put(_DONE)
+
+    def map(self, docs):
+        lengths = [{field: len(doc.get(field) or ()) for field in self.changed_fields} for doc in docs]
+        for mapper in self.mappers:
+            # each mapper consumes the whole batch, so it's timed separately
+            with self.instrumentation.stage("map_%s" % mapper.name).measure(len(docs)):
+                docs = list(mapper.process(docs))
+        ops = []
+        for doc, doc_lengths in zip(docs, lengths):
+            fields = {field: doc[field] for field in self.write_fields
+                      if field in doc and (field not in doc_lengths or
+                                           len(doc[field] or ()) != doc_lengths[field])}
+            if fields:
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        return ops
+
+    def write(self):
+        try:
+            while True:
+                future = self.write_queue.get()
+                if future is _DONE:
+                    break
+                ops = future.result()
+                if ops and not self.error:
+                    with self.instrumentation.stage("write").measure(len(ops)):
+                        self.collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            self.error = self.error or e
+            # keep consuming so producers never block on a full queue
+            while self.write_queue.get() is not _DONE:
+                pass
+
+    def run(self):
+        """Process the whole collection, return stage timings (seconds)"""
+        start = time.time()
+        reader = threading.Thread(target=self.read, name="postmerge-reader", daemon=True)
+        writer = threading.Thread(target=self.write, name="postmerge-writer", daemon=True)
+        reader.start()
+        writer.start()
+        with ThreadPoolExecutor(max_workers=self.map_workers) as pool:
+            while True:
+                docs = self.read_queue.get()
+                if docs is _DONE:
+                    break
+                # futures are queued in order, the bounded queue throttles reads
+                self.write_queue.put(pool.submit(self.map, docs))
+            self.write_queue.put(_DONE)
+            writer.join()
+        reader.join()
+        if self.error:
+            raise self.error
+        timings = {name: stage.wall for name, stage in self.instrumentation.stages.items()}
+        timings["total"] = time.time() - start
+        self.logger.info("Post-merge pipeline done in %.1fs: %r" % (
+            timings["total"], self.instrumentation))
+        return timings
@@ -0,0 +1,110 @@
+"""
+Metadata stats of a taxonomy build, computed in a single streaming pass.
+
+Stats count merged docs, in one pass over the target collection: they
+include taxids not part of the tree (eg. only found in uniprot). In-memory
+builds only produce docs for tree nodes, their stats are computed from the
+TaxonomyTree instead, with no collection scan at all:
+
+- unique taxonomy ids, and their distribution by rank
+- taxonomy ids with genes, and their distribution by rank
+- max and mean depth
+- children fan-out of nodes having children: max and percentiles
+"""
+from collections import Counter
+from operator import sub
+
+from taxonomy.tree import TaxidBitmap
+
+FANOUT_PERCENTILES = (50, 90, 99)
+
+
+class TaxonomyStats(object):
+    """
+    Stats accumulated with update(docs), or computed with from_tree(),
+    as build metadata with to_meta()
+    """
+
+    def __init__(self):
+        self.taxids = TaxidBitmap()
+        # set instead of taxids when computed from a tree
+        self.taxid_count = None
+        self.ranks = Counter()
+        self.has_gene_ranks = Counter()
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_count = 0
+        # number of children -> number of nodes
+        self.fanout = Counter()
+
+    def update(self, docs):
+        """Accumulate stats of merged docs"""
+        taxids = self.taxids
+        ranks = self.ranks
+        has_gene_ranks = self.has_gene_ranks
+        fanout = self.fanout
+        for doc in docs:
+            if doc.get("taxid") is not None:
+                taxids.add(doc["taxid"])
+            rank = doc.get("rank")
+            ranks[rank] += 1
+            if doc.get("has_gene"):
+                has_gene_ranks[rank] += 1
+            depth = doc.get("depth")
+            if depth is not None:
+                self.max_depth = max(self.max_depth, depth)
+                self.depth_total += depth
+                self.depth_count += 1
+            fanout[len(doc.get("children") or ())] += 1
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Stats of a TaxonomyTree (has_gene flags set), as if built from its docs"""
+        stats = cls()
+        stats.taxid_count = len(tree)
+        rank_names = tree.rank_names
+        for code, count in Counter(tree.ranks).items():
+            stats.ranks[rank_names[code]] += count
+        ranks = tree.ranks
+        bits = tree.has_gene_bits
+        for byte_idx, byte in enumerate(bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        stats.has_gene_ranks[rank_names[ranks[(byte_idx << 3) | bit]]] += 1
+        depths = tree.depths if tree.depths is not None else tree.compute_depths()
+        if len(depths):
+            stats.max_depth = max(depths)
+            stats.depth_total = sum(depths)
+            stats.depth_count = len(depths)
+        offsets = tree.child_offsets
+        stats.fanout.update(map(sub, offsets[1:], offsets[:-1]))
+        return stats
+
+    def fanout_percentiles(self):
+        """{"max": ..., "p50": ...} children fan-out of nodes having children"""
+        counts = sorted((size, nodes) for size, nodes in self.fanout.items() if size)
+        total = sum(nodes for _, nodes in counts)
+        if not total:
+            return {}
+        res = {"nodes with children": total, "max": counts[-1][0]}
+        for percentile in FANOUT_PERCENTILES:
+            rank = percentile * total / 100
+            seen = 0
+            for size, nodes in counts:
+                seen += nodes
+                if seen >= rank:
+                    res["p%d" % percentile] = size
+                    break
+        return res
+
+    def to_meta(self):
+        return {
+            "unique taxonomy ids": len(self.taxids) if self.taxid_count is None else self.taxid_count,
+            "distribution of taxonomy ids by rank": dict(self.ranks),
+            "taxonomy ids with genes": sum(self.has_gene_ranks.values()),
+            "distribution of taxonomy ids with genes by rank": dict(self.has_gene_ranks),
+            "max depth": self.max_depth,
+            "mean depth": round(self.depth_total / self.depth_count, 2) if self.depth_count else None,
+            "children fan-out": self.fanout_percentiles(),
+        }
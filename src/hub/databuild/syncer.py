@@ -0,0 +1,254 @@
+"""
+Taxonomy-aware sync of an ES index between two taxdump releases.
+
+Instead of diffing merged documents as JSON and shipping whole-document
+patches, changes are computed from the two compact trees (see
+incremental.TaxdumpDiff), and only fields which actually changed are sent,
+as partial-document bulk updates:
+
+- added nodes, and nodes whose names or rank changed: whole doc (index)
+- other affected nodes (lineage, children, has_gene...): changed tree fields
+- nodes of subtrees renumbered to make room for added or re-parented ones
+  (see taxonomy.intervals): dfs_in/dfs_out only, reported apart from real
+  doc changes
+- removed nodes: delete
+
+Fields currently in the index are recomputed from the old release tree
+rather than read back (children order only depends on the tree), except
+DFS intervals which depend on past syncs and are read from the index.
+
+Taxids are split in MAX_SYNC_WORKERS ranges, each one synced by its own
+worker thread.
+"""
+import bisect
+import json
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from elasticsearch import Elasticsearch, helpers
+
+from taxonomy.intervals import read_intervals
+
+from ..dataindex.indexer import DROPPED_FIELDS
+from .incremental import TaxdumpDiff, build_docs, release_folders
+from .mapper import load_has_gene_taxids
+
+logger = logging.getLogger(__name__)
+
+
+def tree_fields(tree, taxid):
+    """Doc fields derived from the tree, as set by HasGeneMapper and LineageMapper"""
+    lineage = tree.lineage(taxid)
+    fields = {
+        "parent_taxid": tree.parent_taxid(taxid),
+        "rank": tree.rank(taxid),
+        "has_gene": tree.has_gene(taxid),
+        "lineage": lineage,
+        "depth": len(lineage) - 1,
+        "children": tree.children(taxid),
+        "_has_gene_children": tree.has_gene_children(taxid),
+    }
+    if len(lineage) > 1:
+        fields["ancestors"] = lineage[1:]
+    if tree.dfs_in is not None:
+        fields["dfs_in"], fields["dfs_out"] = tree.index_interval(taxid)
+    return fields
+
+
+def changed_fields(diff, taxid, dropped_fields=()):
+    """Tree fields of taxid which differ between old and new trees"""
+    old = tree_fields(diff.old_tree, taxid)
+    new = tree_fields(diff.new_tree, taxid)
+    return {field: value for field, value in new.items()
+            if old.get(field) != value and field not in dropped_fields}
+
+
+def taxid_ranges(taxids, count):
+    """Split sorted taxids in count [start, end) ranges of about the same size"""
+    if not taxids:
+        return []
+    step = -(-len(taxids) // count)
+    bounds = [taxids[pos] for pos in range(0, len(taxids), step)] + [taxids[-1] + 1]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class TaxonomySyncer(object):
+    """
+    Sync index (on ES client) from old to new taxdump release, as described
+    in the module docstring. run() returns the sync report.
+    """
+
+    def __init__(self, client, index, diff, new_folder, has_gene_changed=(),
+                 batch_size=5000, workers=None, dropped_fields=None):
+        self.client = client
+        self.index = index
+        self.diff = diff
+        self.new_folder = new_folder
+        self.has_gene_changed = set(has_gene_changed)
+        self.batch_size = batch_size
+        self.workers = workers or config.MAX_SYNC_WORKERS
+        if dropped_fields is None:
+            dropped_fields = DROPPED_FIELDS[config.INDEX_PROFILE]
+        self.dropped_fields = dropped_fields
+        self.affected = set()
+        self.renumbered = set()
+        self.full_docs = {}
+        self.new_taxids = []
+
+    def prepare(self):
+        diff = self.diff
+        for tree in (diff.old_tree, diff.new_tree):
+            if tree.dfs_in is None:
+                tree.compute_dfs_intervals()
+        self.affected = diff.affected_taxids(self.has_gene_changed)
+        self.renumbered = diff.update_intervals() - self.affected
+        # names aren't part of the tree, these docs are sent whole
+        full = (diff.added | diff.modified) & self.affected
+        if full:
+            self.full_docs = {doc["taxid"]: doc for doc in build_docs(full, diff.new_tree, self.new_folder)}
+        self.new_taxids = sorted(diff.new_tree.taxids)
+
+    def actions(self, start, end):
+        """
+        Yield (action, taxid, body) for taxids in [start, end), action being
+        "intervals" for dfs_in/dfs_out only updates
+        """
+        diff = self.diff
+        new_tree = diff.new_tree
+        new_taxids = self.new_taxids
+        for taxid in new_taxids[bisect.bisect_left(new_taxids, start):
+                                bisect.bisect_left(new_taxids, end)]:
+            if taxid in self.full_docs:
+                doc = dict(self.full_docs[taxid])
+                for field in ("_id",) + tuple(self.dropped_fields):
+                    doc.pop(field, None)
+                yield "index", taxid, doc
+            elif taxid in self.affected:
+                fields = changed_fields(diff, taxid, self.dropped_fields)
+                if fields:
+                    yield "update", taxid, {"doc": fields}
+            elif taxid in self.renumbered:
+                dfs_in, dfs_out = new_tree.index_interval(taxid)
+                yield "intervals", taxid, {"doc": {"dfs_in": dfs_in, "dfs_out": dfs_out}}
+        for taxid in sorted(diff.removed):
+            if start <= taxid < end:
+                yield "delete", taxid, None
+
+    def send(self, batch):
+        """
+        Send a bulk request of (action, taxid, body), return (bytes, errors),
+        bytes being a {action: bytes} dict
+        """
+        lines = []
+        nbytes = Counter()
+        for action, taxid, body in batch:
+            op = "update" if action == "intervals" else action
+            start = len(lines)
+            lines.append(json.dumps({op: {"_index": self.index, "_id": str(taxid)}}))
+            if body is not None:
+                lines.append(json.dumps(body))
+            nbytes[action] += sum(len(line) + 1 for line in lines[start:])
+        payload = ("\n".join(lines) + "\n").encode()
+        res = self.client.bulk(body=payload)
+        errors = []
+        if res.get("errors"):
+            for item in res["items"]:
+                result = next(iter(item.values()))
+                # deleting an already missing doc is fine
+                if result.get("error") and result.get("status") != 404:
+                    errors.append(result)
+        return nbytes, errors
+
+    def sync_range(self, start, end):
+        stats = {"index": 0, "update": 0, "delete": 0, "intervals": 0, "bytes": Counter(), "errors": []}
+        batch = []
+        for action in self.actions(start, end):
+            batch.append(action)
+            stats[action[0]] += 1
+            if len(batch) >= self.batch_size:
+                nbytes, errors = self.send(batch)
+                stats["bytes"].update(nbytes)
+                stats["errors"].extend(errors)
+                batch = []
+        if batch:
+            nbytes, errors = self.send(batch)
+            stats["bytes"].update(nbytes)
+            stats["errors"].extend(errors)
+        return stats
+
+    def run(self):
+        """
+        Sync the index, return the report: "docs" (and "bytes") counts
+        indexed, updated and deleted docs, "intervals" (and
+        "intervals_bytes") the dfs_in/dfs_out only updates
+        """
+        t0 = time.time()
+        self.prepare()
+        all_taxids = sorted(set(self.new_taxids) | self.diff.removed)
+        ranges = taxid_ranges(all_taxids, self.workers)
+        report = {"index": 0, "update": 0, "delete": 0, "intervals": 0}
+        nbytes = Counter()
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for stats in pool.map(lambda bounds: self.sync_range(*bounds), ranges):
+                for key in report:
+                    report[key] += stats[key]
+                nbytes.update(stats["bytes"])
+                errors.extend(stats["errors"])
+        report["intervals_bytes"] = nbytes.pop("intervals", 0)
+        report["bytes"] = sum(nbytes.values())
+        report["errors"] = len(errors)
+        report["docs"] = report["index"] + report["update"] + report["delete"]
+        report["elapsed"] = time.time() - t0
+        report["docs_per_sec"] = report["docs"] / report["elapsed"] if report["elapsed"] else 0.0
+        logger.info("Taxonomy sync of '%s' done in %.1fs: %d indexed, %d updated, %d deleted, "
+                    "%.1fMB shipped, %.0f docs/s, %d errors; %d renumbered intervals, %.1fMB" % (
+                        self.index, report["elapsed"], report["index"], report["update"],
+                        report["delete"], report["bytes"] / 1024 / 1024,
+                        report["docs_per_sec"], report["errors"], report["intervals"],
+                        report["intervals_bytes"] / 1024 / 1024))
+        if errors:
+            raise ValueError("%d documents failed to sync, first error: %s" % (len(errors), errors[0]))
+        return report
+
+
+def indexed_has_gene(client, index):
+    """Set of taxids flagged with has_gene in index"""
+    hits = helpers.scan(client, index=index, query={"query": {"term": {"has_gene": True}}},
+                        _source=["taxid"], size=10000)
+    return set(int(hit["_id"]) for hit in hits)
+
+
+def indexed_intervals(client, index):
+    """Yield taxid, dfs_in and dfs_out of docs in index, as read_intervals() docs"""
+    hits = helpers.scan(client, index=index, query={"query": {"exists": {"field": "dfs_in"}}},
+                        _source=["dfs_in", "dfs_out"], size=10000)
+    for hit in hits:
+        yield dict(hit["_source"], taxid=int(hit["_id"]))
+
+
+def taxonomy_sync(env, old_folder=None, new_folder=None, batch_size=5000):
+    """
+    Hub entry point: sync the index of INDEX_CONFIG environment env from old
+    to new taxonomy release (by default the previous one to the current one).
+    """
+    old_folder, new_folder = release_folders(old_folder, new_folder)
+    env_config = config.INDEX_CONFIG["env"][env]
+    client = Elasticsearch(env_config["host"], **env_config.get("indexer", {}).get("args", {}))
+    index = env_config["index"][0]["index"]
+
+    logger.info("Computing differences between '%s' and '%s'" % (old_folder, new_folder))
+    diff = TaxdumpDiff.from_folders(old_folder, new_folder)
+    logger.info("Taxdump diff: %s" % diff)
+    has_gene = load_has_gene_taxids()
+    old_has_gene = indexed_has_gene(client, index)
+    diff.old_tree.set_has_gene(old_has_gene)
+    diff.new_tree.set_has_gene(has_gene)
+    diff.old_tree.set_index_intervals(*read_intervals(diff.old_tree, indexed_intervals(client, index)))
+    has_gene_changed = old_has_gene.symmetric_difference(
+        taxid for taxid in has_gene if taxid in diff.new_tree)
+    syncer = TaxonomySyncer(client, index, diff, new_folder, has_gene_changed, batch_size)
+    return syncer.run()
@@ -1,11 +1,165 @@
+import asyncio
+from datetime import datetime
+
 import biothings.hub.dataindex.indexer as indexer
+import config
+from biothings.hub.dataindex.indexer_schedule import Schedule
+from biothings.utils.common import iter_n
+from biothings.utils.mongo import DatabaseClient, doc_feeder, id_feeder
+from elasticsearch import AsyncElasticsearch, Elasticsearch, helpers
+from pymongo import MongoClient
+
+# mappings of tree fields, by index profile (see config.INDEX_PROFILE)
+TREE_MAPPINGS = {
+    "full": {
+        'lineage': {'type': 'integer'},
+        'children': {'type': 'integer'},
+        'ancestors': {'type': 'integer'},
+        'depth': {'type': 'integer'},
+        'dfs_in': {'type': 'integer'},
+        'dfs_out': {'type': 'integer'}
+    },
+    "compact": {
+        'lineage': {'type': 'integer'},
+        # only fetched from _source, never searched
+        'children': {'type': 'integer', 'index': False, 'doc_values': False},
+        '_has_gene_children': {'type': 'integer', 'index': False, 'doc_values': False},
+        'depth': {'type': 'integer'},
+        'dfs_in': {'type': 'integer'},
+        'dfs_out': {'type': 'integer'}
+    },
+}
+# doc fields not stored in ES, by index profile. ancestors is lineage[1:],
+# queries on it are rewritten on lineage by the web tier
+DROPPED_FIELDS = {
+    "full": (),
+    "compact": ("ancestors",),
+}
+
+
+def iter_actions(docs, index_name, dropped_fields=()):
+    """Bulk index actions for docs (with their _id), without dropped_fields"""
+    for doc in docs:
+        _id = doc.pop("_id")
+        for field in dropped_fields:
+            doc.pop(field, None)
+        yield {"_op_type": "index", "_index": index_name, "_id": _id, "_source": doc}
+
+
+def parallel_index(mg_client_args, mg_dbs_name, mg_col_name,
+                   es_client_args, es_idx_name, ids, bulk_args, dropped_fields=()):
+    """
+    Index documents ids from mongo collection, running in a hub process.
+    Bulk requests are sized by bytes (max_chunk_bytes) rather than by number
+    of documents, and sent by thread_count concurrent threads.
+    """
+    collection = MongoClient(**mg_client_args)[mg_dbs_name][mg_col_name]
+    client = Elasticsearch(**es_client_args)
+    docs = doc_feeder(collection, step=len(ids), inbatch=False, query={"_id": {"$in": ids}})
+    count = 0
+    # failed documents raise a BulkIndexError
+    for ok, _ in helpers.parallel_bulk(client, iter_actions(docs, es_idx_name, dropped_fields),
+                                         **bulk_args):
+        count += ok
+    return count
 
 
 class TaxonomyIndexer(indexer.Indexer):
     def __init__(self, build_doc, indexer_env, index_name):
         super().__init__(build_doc, indexer_env, index_name)
-        self.es_index_mappings['properties'].update({
-            'lineage': {'type': 'integer'},
-            'children': {'type': 'integer'},
-            'ancestors': {'type': 'integer'}
-        })
+        self.es_index_mappings['properties'].update(TREE_MAPPINGS[config.INDEX_PROFILE])
+        # not sent with parallel bulk, and excluded from _source on every
+        # path (merge, resume, biothings indexing), dynamic mapping being off
+        self.dropped_fields = DROPPED_FIELDS[config.INDEX_PROFILE]
+        if self.dropped_fields:
+            self.es_index_mappings['_source'] = {'excludes': list(self.dropped_fields)}
+        self.parallel_bulk = config.INDEX_PARALLEL_BULK
+        self.parallel_bulk_args = {
+            "chunk_size": config.INDEX_BULK_MAX_DOCS,
+            "max_chunk_bytes": config.INDEX_BULK_MAX_BYTES,
+            "thread_count": config.INDEX_BULK_THREADS,
+            "queue_size": config.INDEX_BULK_THREADS,
+        }
+        # index settings restored once loaded (see post_index): as set in the
+        # build config, None (ES defaults) otherwise
+        build_config = build_doc.get("build_config") or {}
+        extra_settings = build_config.get("extra_index_settings") or {}
+        self.index_replicas = extra_settings.get("number_of_replicas", build_config.get("num_replicas"))
+        self.refresh_interval = extra_settings.get("refresh_interval")
+        # set when pre_index created the index with loading settings
+        self.loading_settings = False
+
+    async def pre_index(self, *args, mode, **kwargs):
+        if self.parallel_bulk and mode in ("index", "purge", None):
+            # no refresh nor replication while loading a new index
+            self.es_index_settings["refresh_interval"] = "-1"
+            self.es_index_settings["number_of_replicas"] = 0
+            self.loading_settings = True
+        return await super().pre_index(*args, mode=mode, **kwargs)
+
+    async def do_index(self, job_manager, batch_size, ids, mode, **kwargs):
+        if not self.parallel_bulk or mode not in ("index", "purge", None):
+            # merge and resume need the existing docs, biothings handles it
+            return await super().do_index(job_manager, batch_size, ids, mode, **kwargs)
+
+        collection = DatabaseClient(**self.mongo_client_args)[self.mongo_database_name][self.mongo_collection_name]
+        if ids:
+            id_provider = iter_n(ids, batch_size)
+        else:
+            id_provider = id_feeder(collection, batch_size, logger=self.logger)
+        total = len(ids) if ids else collection.estimated_document_count()
+        schedule = Schedule(total, batch_size)
+        self.logger.info("Indexing '%s' with bulk requests of at most %.1fMB, %d threads per job" % (
+            self.mongo_collection_name, self.parallel_bulk_args["max_chunk_bytes"] / 1024 / 1024,
+            self.parallel_bulk_args["thread_count"]))
+
+        jobs = []
+        error = None
+
+        def batch_finished(future):
+            nonlocal error
+            try:
+                schedule.finished += future.result()
+            except Exception as exc:
+                self.logger.warning(exc)
+                error = exc
+
+        for _, batch_ids in zip(schedule, id_provider):
+            await asyncio.sleep(0.0)
+            if error:
+                # fail fast, cancelling pending jobs
+                for job in jobs:
+                    if not job.done():
+                        job.cancel()
+                raise error
+            self.logger.info(schedule)
+            pinfo = self.pinfo.get_pinfo(schedule.suffix(self.mongo_collection_name))
+            job = await job_manager.defer_to_process(
+                pinfo, parallel_index,
+                self.mongo_client_args, self.mongo_database_name, self.mongo_collection_name,
+                self.es_client_args, self.es_index_name, batch_ids, self.parallel_bulk_args,
+                self.dropped_fields)
+            job.add_done_callback(batch_finished)
+            jobs.append(job)
+
+        await asyncio.gather(*jobs)
+        schedule.completed()
+        self.logger.notify(schedule)
+        return {"count": total, "created_at": datetime.now().astimezone()}
+
+    async def post_index(self, *args, **kwargs):
+        if not self.loading_settings:
+            # existing index (merge, resume), or created by another run
+            return await super().post_index(*args, **kwargs)
+        client = AsyncElasticsearch(**self.es_client_args)
+        try:
+            settings = {
+                # None resets to ES default
+                "refresh_interval": self.refresh_interval,
+                "number_of_replicas": self.index_replicas,
+            }
+            await client.indices.put_settings(body={"index": settings}, index=self.es_index_name)
+            await client.indices.refresh(index=self.es_index_name)
+            self.logger.info(("Restored", self.es_index_name, settings))
+        finally:
+            await client.close()
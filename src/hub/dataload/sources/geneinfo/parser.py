@@ -1,3 +1,11 @@
+import re
+import zlib
+
+# size of compressed chunks read from gene_info.gz
+CHUNK_SIZE = 4 * 1024 * 1024
+# taxid column of gene_info lines (header line starts with "#")
+TAXID_PATTERN = re.compile(rb"^(\d+)\t", re.MULTILINE)
+
 
 def parse_geneinfo_taxid(fileh):
 
@@ -8,3 +16,49 @@ def parse_geneinfo_taxid(fileh):
         taxid = line.split("\t")[0]
         yield {"_id" : taxid}
 
+
+def iter_gz_chunks(gz_file, chunk_size=CHUNK_SIZE):
+    '''
+    Decompress gzip binary file-like object chunk by chunk, yield chunks of
+    complete lines (bytes), nothing is written to disk.
+    '''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    leftover = b""
+    while True:
+        data = gz_file.read(chunk_size)
+        if not data:
+            break
+        chunk = leftover + decompressor.decompress(data)
+        while decompressor.eof and decompressor.unused_data:
+            # concatenated gzip members
+            unused = decompressor.unused_data
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunk += decompressor.decompress(unused)
+        last_eol = chunk.rfind(b"\n")
+        leftover = chunk[last_eol + 1:]
+        if last_eol != -1:
+            yield chunk[:last_eol + 1]
+    leftover += decompressor.flush()
+    if leftover:
+        yield leftover
+
+
+def load_geneinfo_taxids(gz_file, chunk_size=CHUNK_SIZE):
+    '''
+    Set of unique taxids (int) found in gene_info.gz binary file-like object.
+    Taxids are extracted per decompressed chunk with a regex, instead of
+    splitting every line.
+    '''
+    taxids = set()
+    for chunk in iter_gz_chunks(gz_file, chunk_size):
+        taxids.update(TAXID_PATTERN.findall(chunk))
+    return {int(taxid) for taxid in taxids}
+
+
+def parse_geneinfo_taxid_gz(gz_file, chunk_size=CHUNK_SIZE):
+    '''
+    Same docs as parse_geneinfo_taxid(), from gene_info.gz binary file-like
+    object, without duplicates and sorted by taxid
+    '''
+    for taxid in sorted(load_geneinfo_taxids(gz_file, chunk_size)):
+        yield {"_id": str(taxid)}
@@ -3,20 +3,35 @@ import os
 import biothings.hub.dataload.uploader as uploader
 from biothings.hub.databuild.builder import set_pending_to_build
 import biothings.hub.dataload.storage as storage
-from .parser import parse_geneinfo_taxid
+from hub.instrumentation import InstrumentedUploader
+from .parser import parse_geneinfo_taxid, parse_geneinfo_taxid_gz
 
-class GeneInfoUploader(uploader.BaseSourceUploader):
+class GeneInfoUploader(InstrumentedUploader, uploader.BaseSourceUploader):
 
     storage_class = storage.IgnoreDuplicatedStorage
 
     name = "geneinfo"
 
     def load_data(self,data_folder):
+        gz_file = os.path.join(data_folder,"gene_info.gz")
+        if os.path.exists(gz_file):
+            # taxids are deduplicated while streaming, only unique ones are stored
+            self.logger.info("Load data from file '%s'" % gz_file)
+            with open(gz_file, "rb") as fileh:
+                yield from parse_geneinfo_taxid_gz(fileh)
+            return
+        # data folder dumped (and gunzipped) by a previous dumper version
         gene_file = os.path.join(data_folder,"gene_info")
         self.logger.info("Load data from file '%s'" % gene_file)
-        return parse_geneinfo_taxid(open(gene_file))
+        with open(gene_file) as fileh:
+            yield from parse_geneinfo_taxid(fileh)
 
     def post_update_data(self, steps, force, batch_size, job_manager):
+        # has_gene flags changed, refresh the tree snapshot (imported here,
+        # mapper module imports uploaders)
+        from hub.databuild.mapper import write_tree_snapshot
+        with self.stage("tree_snapshot").measure():
+            write_tree_snapshot()
         # trigger a merge/build
         set_pending_to_build()
 
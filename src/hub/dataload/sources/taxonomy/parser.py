@@ -1,14 +1,31 @@
+import os
 from collections import defaultdict
 from itertools import groupby
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Collapse all the following fields into "other_names"
+OTHER_NAMES = frozenset(["acronym", "anamorph", "blast name", "equivalent name", "genbank acronym",
+                         "genbank anamorph", "genbank synonym", "includes", "misnomer", "misspelling",
+                         "synonym", "teleomorph"])
+# keep separate, stored as a string, or a list if more than one
+SINGLE_NAMES = {"common name": "common_name", "genbank common name": "genbank_common_name"}
+
+# size of binary chunks read from .dmp files by fast parsers
+CHUNK_SIZE = 4 * 1024 * 1024
+# .dmp column separator, and line terminator once split on "\n"
+SEP = "\t|\t"
+EOL = "\t|"
+
 
 def parse_refseq_names(names_file):
     '''
     names_file is a file-like object yielding 'names.dmp' from taxdump.tar.gz
     '''
-    # Collapse all the following fields into "synonyms"
-    other_names = ["acronym", "anamorph", "blast name", "equivalent name", "genbank acronym", "genbank anamorph",
-                   "genbank synonym", "includes", "misnomer", "misspelling", "synonym", "teleomorph"]
+    other_names = OTHER_NAMES
     # keep separate: "common name", "genbank common name"
     names_gb = groupby(names_file, lambda x: x[:x.index('\t')])
     for taxid, entry in names_gb:
@@ -59,3 +76,195 @@ def parse_refseq_nodes(nodes_file):
         d['parent_taxid'] = int(split_line[2])
         d['rank'] = split_line[4]
         yield d
+
+
+def iter_dmp_chunks(dmp_file, chunk_size=CHUNK_SIZE):
+    '''
+    Read a .dmp binary file-like object in large chunks and yield lists of
+    complete lines (str, still ending with "\t|"). Decoding and line splitting
+    are done once per chunk instead of once per line. Blank lines are skipped.
+    '''
+    leftover = b""
+    while True:
+        chunk = dmp_file.read(chunk_size)
+        if not chunk:
+            break
+        chunk = leftover + chunk
+        last_eol = chunk.rfind(b"\n")
+        if last_eol == -1:
+            leftover = chunk
+            continue
+        leftover = chunk[last_eol + 1:]
+        yield _split_lines(chunk[:last_eol])
+    if leftover.strip():
+        yield _split_lines(leftover)
+
+
+def _split_lines(chunk):
+    return [line for line in chunk.decode("utf-8").replace("\r", "").split("\n") if line.strip()]
+
+
+class DmpSlice(object):
+    '''
+    Binary file-like object reading a .dmp file from byte offset start to end
+    (end excluded, until end of file if None), see split_dmp_file()
+    '''
+
+    def __init__(self, path, start=0, end=None):
+        self.fileh = open(path, "rb")
+        self.fileh.seek(start)
+        self.remaining = end - start if end is not None else None
+
+    def read(self, size=-1):
+        if self.remaining is not None and (size < 0 or size > self.remaining):
+            size = self.remaining
+        data = self.fileh.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        if not data:
+            self.fileh.close()
+        return data
+
+
+def _line_taxid(line):
+    return line[:line.find(b"\t")]
+
+
+def split_dmp_file(path, chunk_size, min_chunks=1, group_taxids=False):
+    '''
+    Split a .dmp file into (start, end) byte ranges of about chunk_size bytes
+    (smaller if needed to get at least min_chunks ranges, no limit if
+    chunk_size is 0), ending on line boundaries. With group_taxids, all lines of a same taxid are kept in the
+    same range, so taxid groups parsed from names.dmp are never split.
+    '''
+    size = os.path.getsize(path)
+    chunk_size = max(1, min(chunk_size or size, -(-size // max(min_chunks, 1))))
+    bounds = [0]
+    with open(path, "rb") as fileh:
+        while bounds[-1] + chunk_size < size:
+            fileh.seek(bounds[-1] + chunk_size)
+            fileh.readline()  # skip partial line
+            if group_taxids:
+                line = fileh.readline()
+                taxid = _line_taxid(line)
+                while line:
+                    boundary = fileh.tell()
+                    line = fileh.readline()
+                    if _line_taxid(line) != taxid:
+                        break
+                else:
+                    boundary = fileh.tell()
+            else:
+                boundary = fileh.tell()
+            if boundary >= size:
+                break
+            bounds.append(boundary)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _name_fields():
+    # precomputed "name class\t|" -> doc field lookup
+    fields = {"scientific name" + EOL: "scientific_name"}
+    fields.update({name_class + EOL: "other_names" for name_class in OTHER_NAMES})
+    fields.update({name_class + EOL: field for name_class, field in SINGLE_NAMES.items()})
+    return fields
+
+
+def iter_names_records(names_file, chunk_size=CHUNK_SIZE):
+    '''
+    Yield compact (taxid, field, name) records from 'names.dmp' binary
+    file-like object, field being the doc key the name belongs to
+    (eg. "other_names" for synonyms, see OTHER_NAMES).
+    '''
+    fields = _name_fields()
+    for lines in iter_dmp_chunks(names_file, chunk_size):
+        for line in lines:
+            taxid, name, _, name_class = line.split(SEP)
+            field = fields.get(name_class)
+            if field is None:
+                field = fields[name_class] = name_class[:-len(EOL)]
+            yield int(taxid), field, name.strip()
+
+
+def parse_refseq_names_fast(names_file, chunk_size=CHUNK_SIZE):
+    '''
+    Same docs as parse_refseq_names(), from a binary file-like object
+    yielding 'names.dmp'. Only one dict is created per taxid.
+    '''
+    fields = _name_fields()
+    single_fields = set(SINGLE_NAMES.values())
+    doc = None
+    current_taxid = None
+    for lines in iter_dmp_chunks(names_file, chunk_size):
+        for line in lines:
+            taxid, name, _, name_class = line.split(SEP)
+            if taxid != current_taxid:
+                if doc is not None:
+                    yield doc
+                current_taxid = taxid
+                doc = {"taxid": int(taxid), "_id": taxid}
+            field = fields.get(name_class)
+            if field is None:
+                field = fields[name_class] = name_class[:-len(EOL)]
+            if field == "scientific_name":
+                doc[field] = name.strip()
+            elif field in single_fields:
+                current = doc.get(field)
+                if current is None:
+                    doc[field] = name.strip()
+                elif type(current) == str:
+                    doc[field] = [current, name.strip()]
+                else:
+                    current.append(name.strip())
+            elif field in doc:
+                doc[field].append(name.strip())
+            else:
+                doc[field] = [name.strip()]
+    if doc is not None:
+        yield doc
+
+
+def iter_nodes_records(nodes_file, chunk_size=CHUNK_SIZE):
+    '''
+    Yield compact (taxid, parent_taxid, rank) records from 'nodes.dmp'
+    binary file-like object. Only the first 3 columns are split.
+    '''
+    for lines in iter_dmp_chunks(nodes_file, chunk_size):
+        for line in lines:
+            taxid, parent_taxid, rank, _ = line.split(SEP, 3)
+            yield int(taxid), int(parent_taxid), rank
+
+
+def parse_refseq_nodes_fast(nodes_file, chunk_size=CHUNK_SIZE):
+    '''
+    Same docs as parse_refseq_nodes(), from a binary file-like object
+    yielding 'nodes.dmp'
+    '''
+    for lines in iter_dmp_chunks(nodes_file, chunk_size):
+        for line in lines:
+            taxid, parent_taxid, rank, _ = line.split(SEP, 3)
+            yield {"_id": taxid, "taxid": int(taxid), "parent_taxid": int(parent_taxid), "rank": rank}
+
+
+def load_nodes_array(nodes_file, chunk_size=CHUNK_SIZE):
+    '''
+    Load 'nodes.dmp' binary file-like object into a NumPy structured array
+    with "taxid", "parent_taxid" and "rank" (code) columns. Return the array
+    and the list of rank names, indexed by rank code. Requires NumPy.
+    '''
+    if numpy is None:
+        raise ImportError("NumPy is required to load nodes.dmp as an array")
+    rank_names = []
+    rank_codes = {}
+
+    def records():
+        for taxid, parent_taxid, rank in iter_nodes_records(nodes_file, chunk_size):
+            code = rank_codes.get(rank)
+            if code is None:
+                code = rank_codes[rank] = len(rank_names)
+                rank_names.append(rank)
+            yield taxid, parent_taxid, code
+
+    dtype = numpy.dtype([("taxid", numpy.int32), ("parent_taxid", numpy.int32), ("rank", numpy.uint8)])
+    return numpy.fromiter(records(), dtype=dtype), rank_names
@@ -1,19 +1,53 @@
 import os
 
 import biothings.hub.dataload.uploader as uploader
+import config
 
-from .parser import parse_refseq_names, parse_refseq_nodes
+from hub.instrumentation import InstrumentedUploader
+from .parser import DmpSlice, parse_refseq_names_fast, parse_refseq_nodes_fast, split_dmp_file
 
 
-class TaxonomyNodesUploader(uploader.BaseSourceUploader):
+class TaxonomyDmpUploader(InstrumentedUploader, uploader.ParallelizedSourceUploader):
+    """
+    Upload a taxdump .dmp file in parallel: the file is split into byte ranges
+    (see TAXONOMY_UPLOAD_* in config), each one parsed and stored by a worker.
+    """
 
     main_source = "taxonomy"
+    # file to upload, within data folder
+    dmp_file = None
+    # keep all lines of a taxid in the same chunk
+    group_taxids = False
+
+    def jobs(self):
+        dmp_file = os.path.join(self.data_folder, self.dmp_file)
+        chunks = split_dmp_file(dmp_file, config.TAXONOMY_UPLOAD_CHUNK_SIZE,
+                                config.TAXONOMY_UPLOAD_MIN_CHUNKS, self.group_taxids)
+        self.logger.info("Load data from file '%s' in %d chunks" % (dmp_file, len(chunks)))
+        return [(dmp_file, start, end) for start, end in chunks]
+
+    async def update_data(self, batch_size, job_manager):
+        await super().update_data(batch_size, job_manager)
+        stats = self.stage("update_data").to_dict()
+        self.logger.info("Uploaded %d documents in %.1fs (%.0f docs/s)" %
+                         (stats["docs"], stats["wall"], stats["docs_per_s"] or 0))
+
+
+class TaxonomyNodesUploader(TaxonomyDmpUploader):
+
     name = "nodes"
+    dmp_file = "nodes.dmp"
+
+    def load_data(self, nodes_file, start=0, end=None):
+        # runs in a worker process, self must not be used
+        return parse_refseq_nodes_fast(DmpSlice(nodes_file, start, end))
 
-    def load_data(self, data_folder):
-        nodes_file = os.path.join(data_folder, "nodes.dmp")
-        self.logger.info("Load data from file '%s'" % nodes_file)
-        return parse_refseq_nodes(open(nodes_file))
+    def post_update_data(self, steps, force, batch_size, job_manager):
+        super().post_update_data(steps, force, batch_size, job_manager)
+        # imported here, mapper module imports uploaders
+        from hub.databuild.mapper import write_tree_snapshot
+        with self.stage("tree_snapshot").measure():
+            write_tree_snapshot()
 
     @classmethod
     def get_mapping(klass):
@@ -34,18 +68,25 @@ class TaxonomyNodesUploader(uploader.BaseSourceUploader):
         }
 
 
-class TaxonomyNamesUploader(uploader.BaseSourceUploader):
+class TaxonomyNamesUploader(TaxonomyDmpUploader):
 
-    main_source = "taxonomy"
     name = "names"
+    dmp_file = "names.dmp"
+    group_taxids = True
     __metadata__ = {
         "mapper": 'has_gene',
     }
 
-    def load_data(self, data_folder):
-        names_file = os.path.join(data_folder, "names.dmp")
-        self.logger.info("Load data from file '%s'" % names_file)
-        return parse_refseq_names(open(names_file))
+    def load_data(self, names_file, start=0, end=None):
+        # runs in a worker process, self must not be used
+        return parse_refseq_names_fast(DmpSlice(names_file, start, end))
+
+    def post_update_data(self, steps, force, batch_size, job_manager):
+        super().post_update_data(steps, force, batch_size, job_manager)
+        # imported here, mapper module imports uploaders
+        from hub.databuild.mapper import write_names_index
+        with self.stage("names_index").measure():
+            write_names_index()
 
     @classmethod
     def get_mapping(klass):
@@ -1,9 +1,10 @@
 import os
 
 import biothings.hub.dataload.uploader as uploader
+from hub.instrumentation import InstrumentedUploader
 from .parser import parse_uniprot_speclist
 
-class UniprotSpeciesUploader(uploader.BaseSourceUploader):
+class UniprotSpeciesUploader(InstrumentedUploader, uploader.BaseSourceUploader):
 
     name = "uniprot_species"
 
@@ -11,6 +11,9 @@ Much faster than the version in taxonomy.py
 
 Does everything in memory instead of through mongodb (~2-3 hrs > ~30 sec)
 
+Run from src/ folder with:
+python -m hub.dataload.taxonomy_parser
+
 To import manually:
 cat tax.json | parallel -j8 --pipe mongoimport -d taxonomy -c taxonomy
 mongo taxonomy --eval "db.taxonomy.ensureIndex({'taxid': true})"
@@ -19,12 +22,22 @@ mongo taxonomy --eval "db.taxonomy.ensureIndex({'parent_taxid': true})"
 
 """
 
-import json
 import os
+import sys
 import tarfile
 from collections import defaultdict
 from itertools import groupby
 
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from taxonomy.tree import TaxonomyTree
+
+from ..databuild.ndjson import WRITE_BLOCK_SIZE, dumps
+
 # *** Download these files *****
 '''
 wget -N ftp://ftp.ncbi.nih.gov/pub/taxonomy/taxdump.tar.gz
@@ -76,93 +89,83 @@ def main():
     ranks = ['superkingdom', 'kingdom', 'subkingdom', 'superphylum', 'phylum', 'subphylum', 'superclass', 'class', 'subclass', 'infraclass', 'superorder',
              'order', 'suborder', 'infraorder', 'parvorder', 'superfamily', 'family', 'subfamily', 'tribe', 'subtribe', 'genus', 'subgenus', 'species group',
              'species subgroup', 'species', 'subspecies', 'varietas', 'forma', 'no rank']
+    rank_numbers = {rank: number for number, rank in enumerate(ranks) if rank != 'no rank'}
 
-    # Parse NCBI Files
     in_file = os.path.join(FLAT_FILE_PATH, 'taxdump.tar.gz')
-    t = tarfile.open(in_file, mode='r:gz')
-    names_file = t.extractfile('names.dmp')
-    names = parse_refseq_names(names_file)
-    nodes_file = t.extractfile('nodes.dmp')
-    nodes = parse_refseq_nodes(nodes_file)
-    t.close()
-
-    # Parse uniprot file
-    in_file = os.path.join(FLAT_FILE_PATH, 'speclist.txt')
-    with open(in_file) as uniprot_speclist:
-        uniprot = parse_uniprot_speclist(uniprot_speclist)
-
-    # combines list of dictionaries into dictionary of dictionaries where key on outer dict is 'taxid'
-    entries = combine_by_taxid(names, nodes, uniprot)
-
-    # Some tax_ids in uniprot but not in ncbi nodes file, so make sure there's a parent_taxid for each entry
-    entries = dict([(key, value) for (key, value)
-                   in entries.items() if 'parent_taxid' in value.keys()])
-
-    # Set rank#
-    for taxid in entries.keys():
-        entries[taxid]['rank#'] = None if entries[taxid]['rank'] == 'no rank' else ranks.index(
-            entries[taxid]['rank'])
-
-    # Mark tax_ids that have a gene in ncbi
-    in_file = os.path.join(FLAT_FILE_PATH, 'gene_info_uniq')
-    with open(in_file) as f:
-        has_gene_tax_set = set([int(line) for line in f])
-    for taxid, entry in entries.items():
-        entry['has_gene'] = taxid in has_gene_tax_set
-
-    # Calculate lineage (from self back up to root node) for each entry
-    for entry in entries.values():
-        get_lineage(entry, entries)
-
-    # parents: For a strict tree, each node except the root has exactly one parent.
-    # The root node is where taxid == parent_taxid.
-    for ent in entries.values():
-        if ent['taxid'] != ent['parent_taxid']:
-            ent['parents'] = [ent['parent_taxid']]
-        else:
-            # root node: no parent
-            ent['parents'] = []
+    with tarfile.open(in_file, mode='r:gz') as t:
+        # Compact tree holding parents/children/has_gene for all nodes,
+        # only the tree is kept from NCBI nodes file
+        tree = TaxonomyTree.from_nodes(parse_refseq_nodes(t.extractfile('nodes.dmp')))
 
-    # children: Invert the parent relationship
-    parent_to_children = defaultdict(list)
-    for tid, ent in entries.items():
-        if ent['parent_taxid'] != tid:
-            parent_to_children[ent['parent_taxid']].append(tid)
+        # Mark tax_ids that have a gene in ncbi
+        in_file = os.path.join(FLAT_FILE_PATH, 'gene_info_uniq')
+        with open(in_file) as f:
+            tree.set_has_gene(int(line) for line in f)
+        # lineages aren't computed for all nodes at once (~300MB flat), each
+        # one is walked up from the tree while its entry is written
+        tree.compute_dfs_intervals()
 
-    for tid, ent in entries.items():
-        ent['children'] = parent_to_children.get(tid, [])
+        # Parse uniprot file (small, kept as a taxid -> name dict)
+        in_file = os.path.join(FLAT_FILE_PATH, 'speclist.txt')
+        with open(in_file) as uniprot_speclist:
+            uniprot = {d['taxid']: d['uniprot_name'] for d in parse_uniprot_speclist(uniprot_speclist)}
 
-    # ancestors: All nodes in lineage except the node itself
-    for ent in entries.values():
-        # lineage includes the node as the first element
-        ent['ancestors'] = ent['lineage'][1:]
+        # Stream NCBI names file, completing each entry from the tree and
+        # writing it out right away
+        names = parse_refseq_names(t.extractfile('names.dmp'))
+        entries = iter_entries(names, tree, uniprot, rank_numbers)
 
-    # descendants: all nodes that have this node in their lineage
-    # We'll initialize and then populate by iterating over every entry's lineage
-    for ent in entries.values():
-        ent['descendants'] = []
+        # Write everything out to a flatfile for loading into elastic search
+        # Each line is a json obj
+        count = write_entries(entries, os.path.join(FLAT_FILE_PATH, 'tax.json'))
 
-    for tid, ent in entries.items():
-        # ent['lineage'][0] = tid itself, so lineage[1:] are the ancestors
-        for ancestor_tid in ent['lineage'][1:]:
-            entries[ancestor_tid]['descendants'].append(tid)
-    ###########################################################
+        # Or just insert them to mongodb. hardcoded, sorry. todo Add command-line args
+        # mongo_import(entries)
 
-    # Write everything back out to a flatfile for loading into elastic search
-    # Each line is a json obj
-    write_entries(entries, os.path.join(FLAT_FILE_PATH, 'tax.json'))
+    print("Wrote %d entries, peak RSS: %.1f MB" % (count, peak_rss() / 1024 / 1024))
+    return count
 
-    # Or just insert them to mongodb. hardcoded, sorry. todo Add command-line args
-    # mongo_import(entries)
 
-    return entries
+def iter_entries(names, tree, uniprot, rank_numbers):
+    '''
+    Complete entries from names file with node, uniprot and tree derived fields
+    '''
+    for entry in names:
+        taxid = entry['taxid']
+        # Some tax_ids in uniprot but not in ncbi nodes file, so make sure there's a parent_taxid for each entry
+        if taxid not in tree:
+            continue
+        entry['parent_taxid'] = tree.parent_taxid(taxid)
+        entry['rank'] = tree.rank(taxid)
+        if taxid in uniprot:
+            entry['uniprot_name'] = uniprot[taxid]
+        entry['rank#'] = rank_numbers.get(entry['rank'])
+        entry['has_gene'] = tree.has_gene(taxid)
+        # Calculate lineage (from self back up to root node)
+        entry['lineage'] = tree.lineage(taxid)
+        entry['depth'] = len(entry['lineage']) - 1
+        # parents: For a strict tree, each node except the root has exactly one parent.
+        # The root node is where taxid == parent_taxid.
+        if entry['taxid'] != entry['parent_taxid']:
+            entry['parents'] = [entry['parent_taxid']]
+        else:
+            # root node: no parent
+            entry['parents'] = []
+        # children: Invert the parent relationship
+        entry['children'] = tree.children(taxid)
+        # ancestors: All nodes in lineage except the node itself
+        entry['ancestors'] = entry['lineage'][1:]
+        # descendants: all nodes with dfs_in in [dfs_in, dfs_out], instead of
+        # a list (N x average depth ids in total), see get_all_children()
+        entry['dfs_in'], entry['dfs_out'] = tree.index_interval(taxid)
+        yield entry
 
 
 def parse_refseq_names(names_file):
     '''
-    names_file is a file-like object yielding 'names.dmp' from taxdump.tar.gz
+    names_file is a file-like object yielding 'names.dmp' from taxdump.tar.gz,
+    yield one dict per taxid
     '''
-    names = []
     # Collapse all the following fields into "synonyms"
     other_names = ["acronym", "anamorph", "blast name", "equivalent name", "genbank acronym", "genbank anamorph",
                    "genbank synonym", "includes", "misnomer", "misspelling", "synonym", "teleomorph"]
@@ -199,30 +202,23 @@ def parse_refseq_names(names_file):
                     d['genbank_common_name'].append(value)
             else:
                 d[field].append(value)
-        names.append(dict(d))
-    return names
+        yield dict(d)
 
 
 def parse_refseq_nodes(nodes_file):
     '''
-    nodes_file is a file-like object yielding 'nodes.dmp' from taxdump.tar.gz
+    nodes_file is a file-like object yielding 'nodes.dmp' from taxdump.tar.gz,
+    yield (taxid, parent_taxid, rank) tuples
     '''
-    nodes = []
     for line in nodes_file:
-        d = dict()
-        split_line = line.decode('utf-8').split('\t')
-        d['taxid'] = int(split_line[0])
-        d['parent_taxid'] = int(split_line[2])
-        d['rank'] = split_line[4]
-        nodes.append(d)
-    return nodes
+        split_line = line.decode('utf-8').split('\t', 5)
+        yield int(split_line[0]), int(split_line[2]), split_line[4]
 
 
 def parse_uniprot_speclist(uniprot_speclist):
     '''
     uniprot_speclist is a file-like object yielding 'speclist.txt'
     '''
-    uniprot = []
     while True:
         line = next(uniprot_speclist)
         if line.startswith('_____'):
@@ -231,62 +227,61 @@ def parse_uniprot_speclist(uniprot_speclist):
         if line.count('N='):
             organism_name = line.split('N=')[-1].strip().lower()
             taxonomy_id = int(line.split()[2][:-1])
-            uniprot.append(
-                {'uniprot_name': organism_name, 'taxid': taxonomy_id})
-    return uniprot
-
-
-def combine_by_taxid(*args):
-    # Accepts multiple lists of dictionaries
-    # Combines into one dictionary of dictionary where the key is the 'taxid'
-    # of all input list of dictionaries
-    d = defaultdict(dict)
-    for l in args:
-        for elem in l:
-            d[elem['taxid']].update(elem)
-    entries = dict()
-    for entry in d.values():
-        entries[entry['taxid']] = entry
-    return entries
-
-
-def get_lineage(entry, entries):
-    if entry['taxid'] == entry['parent_taxid']:  # take care of node #1
-        entry['lineage'] = [entry['taxid']]
-        return entry
-    lineage = [entry['taxid'], entry['parent_taxid']]
-    while lineage[-1] != 1:
-        parent = entries[lineage[-1]]
-        if 'lineage' in parent:  # caught up with already calculated lineage
-            # extend list, don't recalculate
-            lineage.extend(parent['lineage'][1:])
-            entry['lineage'] = lineage
-            return entry
-        lineage.append(parent['parent_taxid'])
-    entry['lineage'] = lineage
-    return entry
-
-
-def get_all_children(taxid, entries, has_gene=True):
+            yield {'uniprot_name': organism_name, 'taxid': taxonomy_id}
+
+
+def get_all_children(taxid, tree, has_gene=True):
+    # tree must have dfs intervals computed, subtree is then a slice
+    descendants = tree.subtree(taxid)[1:]
     if has_gene:
-        return [taxid] + [value['taxid'] for (key, value) in entries.items() if taxid in value['lineage'] and value['has_gene'] == True]
+        return [taxid] + [child for child in descendants if tree.has_gene(child)]
     else:
-        return [taxid] + [value['taxid'] for (key, value) in entries.items() if taxid in value['lineage']]
+        return [taxid] + descendants
 
 
 def write_entries(entries, filepath):
-    f = open(filepath, 'w')
-    for entry in entries.values():
-        f.write(json.dumps(entry) + '\n')
-    f.close()
-
-
-def mongo_import(entries):
+    '''
+    Write entries (an iterable) as json lines, in blocks of about
+    WRITE_BLOCK_SIZE bytes. Return the number of entries written.
+    '''
+    count = 0
+    block = []
+    block_size = 0
+    with open(filepath, 'wb') as f:
+        for entry in entries:
+            line = dumps(entry)
+            block.append(line)
+            block_size += len(line)
+            count += 1
+            if block_size >= WRITE_BLOCK_SIZE:
+                f.write(b''.join(block))
+                block = []
+                block_size = 0
+        f.write(b''.join(block))
+    return count
+
+
+def peak_rss():
+    '''Peak resident set size of this process, in bytes (0 if unknown)'''
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def mongo_import(entries, batch_size=10000):
     from pymongo import MongoClient
     client = MongoClient()
     db = client.taxonomy.taxonomy
-    entries_list = [d for d in entries.values()]
-    db.insert(entries_list)
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == batch_size:
+            db.insert_many(batch)
+            batch = []
+    if batch:
+        db.insert_many(batch)
     db.create_index('lineage')
     db.create_index('taxid')
     db.create_index('parent_taxid')
@@ -0,0 +1,247 @@
+"""
+Per-stage instrumentation of hub jobs (uploads, post-merge, in-memory builds).
+
+Each stage (reading merged docs, one mapper, bulk writes...) records:
+
+- wall: elapsed seconds, summed over its batches
+- cpu: CPU seconds of the thread running each batch (whole hub process for
+  stages measured with process=True, eg. async upload steps; work done in
+  job manager worker processes isn't accounted)
+- docs, batches
+- latency: histogram of batch durations, counts per upper bound
+- rss_max_mb: RSS high-water mark of the hub process when the stage last ran
+
+Stages are stored with upload job status (src_dump) and with the build
+document (src_build), to compare jobs over time (see build_instrumentation).
+"""
+import bisect
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from biothings.utils.hub_db import get_src_build, get_src_dump
+
+# batch latency histogram upper bounds, in milliseconds
+LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 60000)
+LATENCY_LABELS = tuple("le_%dms" % bound for bound in LATENCY_BUCKETS) + ("inf",)
+# ru_maxrss is in KB on Linux, in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def rss_max_mb():
+    """RSS high-water mark of the current process, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT / 1024 / 1024
+
+
+class StageStats(object):
+    """Counters of one stage, thread-safe"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.docs = 0
+        self.batches = 0
+        self.latency = [0] * len(LATENCY_LABELS)
+        self.rss_max_mb = 0.0
+
+    def __getstate__(self):
+        # uploaders are pickled to run in worker processes
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add(self, wall, cpu, docs=0):
+        """Record a batch of docs processed in wall/cpu seconds"""
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, wall * 1000)
+        rss = rss_max_mb()
+        with self.lock:
+            self.wall += wall
+            self.cpu += cpu
+            self.docs += docs
+            self.batches += 1
+            self.latency[bucket] += 1
+            self.rss_max_mb = max(self.rss_max_mb, rss)
+
+    @contextmanager
+    def measure(self, docs=0, process=False):
+        """
+        Record the enclosed block as a batch of docs (can also be set on the
+        yielded dict, {"docs": ...}, when only known afterwards)
+        """
+        clock = time.process_time if process else time.thread_time
+        batch = {"docs": docs}
+        start = time.perf_counter()
+        cpu_start = clock()
+        try:
+            yield batch
+        finally:
+            self.add(time.perf_counter() - start, clock() - cpu_start, batch["docs"])
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "wall": round(self.wall, 3),
+                "cpu": round(self.cpu, 3),
+                "docs": self.docs,
+                "batches": self.batches,
+                "docs_per_s": round(self.docs / self.wall) if self.wall else None,
+                "latency": dict(zip(LATENCY_LABELS, self.latency)),
+                "rss_max_mb": round(self.rss_max_mb, 1),
+            }
+
+    def __repr__(self):
+        return "%.1fs/%.1fs cpu/%d batches/%d docs" % (self.wall, self.cpu, self.batches, self.docs)
+
+
+class Instrumentation(object):
+    """Stages of a job, by name, in the order they first ran"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """StageStats of stage name, created on first use"""
+        with self.lock:
+            if name not in self.stages:
+                if "." in name or name.startswith("$"):
+                    # stages are stored as MongoDB keys
+                    raise ValueError("Invalid stage name '%s'" % name)
+                self.stages[name] = StageStats()
+            return self.stages[name]
+
+    def timed(self, name, batches):
+        """
+        Iterate over batches (lists of docs), recording the time spent
+        producing each one (eg. reading it from a collection) in stage name
+        """
+        stage = self.stage(name)
+        iterator = iter(batches)
+        while True:
+            start = time.perf_counter()
+            cpu_start = time.thread_time()
+            try:
+                docs = next(iterator)
+            except StopIteration:
+                return
+            stage.add(time.perf_counter() - start, time.thread_time() - cpu_start, len(docs))
+            yield docs
+
+    def to_dict(self):
+        return {name: stage.to_dict() for name, stage in self.stages.items()}
+
+    def __repr__(self):
+        return ", ".join("%s %r" % item for item in self.stages.items())
+
+
+class InstrumentedUploader(object):
+    """
+    Uploader mixin recording the update_data step, and stages measured by
+    subclasses with self.stage(name), stored with the upload job status
+    ("instrumentation" in src_dump upload.jobs.<name>)
+    """
+
+    instrumentation = None
+
+    def stage(self, name):
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation()
+        return self.instrumentation.stage(name)
+
+    def register_status(self, status, subkey="upload", **extra):
+        if status == "uploading":
+            self.instrumentation = Instrumentation()
+        elif status == "success" and self.instrumentation is not None:
+            extra["instrumentation"] = self.instrumentation.to_dict()
+        super().register_status(status, subkey=subkey, **extra)
+
+    async def update_data(self, batch_size, job_manager, **kwargs):
+        # parsing and storage run in worker processes, only the hub process
+        # side (waiting, switching collections) is measured as cpu
+        job_manager = StoredDocsCounter(job_manager)
+        with self.stage("update_data").measure(process=True) as batch:
+            res = await super().update_data(batch_size, job_manager, **kwargs)
+            batch["docs"] = job_manager.docs
+        return res
+
+
+class StoredDocsCounter(object):
+    """
+    Job manager wrapper summing the number of docs stored by upload jobs
+    deferred to worker processes (as returned by storage.process())
+    """
+
+    def __init__(self, job_manager):
+        self.job_manager = job_manager
+        self.docs = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.job_manager, attr)
+
+    async def defer_to_process(self, pinfo=None, func=None, *args, **kwargs):
+        job = await self.job_manager.defer_to_process(pinfo, func, *args, **kwargs)
+        job.add_done_callback(self.stored)
+        return job
+
+    def stored(self, job):
+        # failed jobs are reported by the uploader itself
+        if not job.cancelled() and job.exception() is None and isinstance(job.result(), int):
+            self.docs += job.result()
+
+
+def summary(stages):
+    """Main counters of stored stages, for comparisons"""
+    return {name: {key: stage.get(key) for key in ("wall", "cpu", "docs", "docs_per_s", "rss_max_mb")}
+            for name, stage in stages.items()}
+
+
+def build_instrumentation(build_name=None, last=5):
+    """
+    Hub command: instrumentation of build_name (all stages), or a comparison
+    of the last builds having some: {stage: {build: main counters}}
+    """
+    src_build = get_src_build()
+    if build_name:
+        build = src_build.find_one({"_id": build_name}, {"instrumentation": 1})
+        if not build:
+            raise ValueError("No such build '%s'" % build_name)
+        return build.get("instrumentation", {})
+    builds = src_build.find({"instrumentation": {"$exists": True}},
+                            {"instrumentation": 1, "started_at": 1})
+    builds = sorted(builds, key=lambda build: (build.get("started_at") is not None,
+                                               build.get("started_at")))[-last:]
+    comparison = {}
+    for build in builds:
+        for name, counters in summary(build["instrumentation"]).items():
+            comparison.setdefault(name, {})[build["_id"]] = counters
+    return comparison
+
+
+def upload_instrumentation(source=None):
+    """
+    Hub command: instrumentation of the last upload of each sub-source of
+    source (all sources by default): {sub-source: {stage: main counters}}
+    """
+    query = {"_id": source} if source else {}
+    res = {}
+    for doc in get_src_dump().find(query, {"upload.jobs": 1}):
+        for name, job in doc.get("upload", {}).get("jobs", {}).items():
+            if job.get("instrumentation"):
+                res[name] = summary(job["instrumentation"])
+    return res
@@ -0,0 +1 @@
+"""Taxonomy tree and names index, shared by the hub (which builds them) and the web API."""
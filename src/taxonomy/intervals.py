@@ -0,0 +1,175 @@
+"""
+Spaced DFS intervals, stored in documents as dfs_in/dfs_out.
+
+TaxonomyTree numbers nodes densely in pre-order (see compute_dfs_intervals()),
+so adding or removing a single node shifts the interval of every node after
+it. Intervals stored in documents are spaced instead: a full build gives the
+node numbered n the slot n * SPACING, its interval running up to the end of
+the slot of its last descendant, so each node is followed by SPACING - 1 free
+values where nodes can be added later. The subtree of a node is still the
+nodes whose dfs_in is in [dfs_in, dfs_out] of that node.
+
+Between releases, update_intervals() keeps the intervals of nodes which
+didn't move, and places added or re-parented subtrees in a free range of
+their new parent's interval. Only when the parent has no room left is a
+subtree renumbered: the one of the lowest ancestor whose interval still gives
+each of its nodes 2 * MIN_SPACING values, so the number of updated documents
+stays proportional to the change rather than to the tree. Dense intervals
+(stored before they were spaced) leave no room, they're renumbered as a full
+build would by the first update.
+"""
+from array import array
+
+# values per node in full builds
+SPACING = 256
+# minimum values per node of placed or renumbered subtrees
+MIN_SPACING = 8
+# dfs_in/dfs_out are indexed as ES integers
+MAX_INTERVAL = 2 ** 31 - 1
+# parent of root nodes, its interval is [0, MAX_INTERVAL]
+VIRTUAL_ROOT = -1
+
+
+def spaced_intervals(tree, spacing=SPACING):
+    """(index_in, index_out) arrays of all nodes, numbered as by a full build"""
+    if tree.dfs_in is None:
+        tree.compute_dfs_intervals()
+    spacing = max(1, min(spacing, (MAX_INTERVAL + 1) // max(len(tree.taxids), 1)))
+    index_in = array('i', (number * spacing for number in tree.dfs_in))
+    index_out = array('i', (number * spacing + spacing - 1 for number in tree.dfs_out))
+    return index_in, index_out
+
+
+def read_intervals(tree, docs):
+    """
+    (index_in, index_out) arrays of tree nodes from docs with taxid, dfs_in
+    and dfs_out (as stored by a previous build), -1 for nodes without one
+    """
+    size = len(tree.taxids)
+    index_in = array('i', [-1]) * size
+    index_out = array('i', [-1]) * size
+    for doc in docs:
+        taxid = int(doc["taxid"])
+        if taxid in tree and "dfs_in" in doc:
+            idx = tree.index_of(taxid)
+            index_in[idx] = doc["dfs_in"]
+            index_out[idx] = doc["dfs_out"]
+    return index_in, index_out
+
+
+def update_intervals(tree, index_in, index_out, moved=(), spacing=SPACING):
+    """
+    Update index_in/index_out (arrays by node index of tree, -1 for nodes
+    without an interval) in place: subtrees of moved taxids (added or
+    re-parented) and of nodes without an interval get new ones, see module
+    docstring. Return the set of node indices whose interval changed.
+    """
+    return IntervalAllocator(tree, index_in, index_out, spacing).place(moved)
+
+
+class IntervalAllocator(object):
+    """
+    Places subtrees in free ranges of their parent's interval, see
+    update_intervals().
+    """
+
+    def __init__(self, tree, index_in, index_out, spacing=SPACING):
+        if tree.dfs_in is None:
+            tree.compute_dfs_intervals()
+        self.tree = tree
+        self.index_in = index_in
+        self.index_out = index_out
+        self.spacing = spacing
+        self.roots = tree.root_indices()
+        # nodes still waiting for an interval
+        self.pending = bytearray(len(tree.taxids))
+        self.changed = set()
+
+    def place(self, moved=()):
+        tree = self.tree
+        parents = tree.parents
+        index_in = self.index_in
+        pending = self.pending
+        moved = set(tree.index_of(taxid) for taxid in moved if taxid in tree)
+        # pre-order: parents are flagged before their children
+        for idx in tree.preorder:
+            parent = parents[idx]
+            if idx in moved or index_in[idx] < 0 or (parent != idx and pending[parent]):
+                pending[idx] = 1
+        for idx in tree.preorder:
+            # subtrees are placed whole, from their top node
+            if pending[idx]:
+                self.place_subtree(idx)
+        return self.changed
+
+    def parent(self, idx):
+        parent = self.tree.parents[idx]
+        return VIRTUAL_ROOT if parent == idx else parent
+
+    def size(self, idx):
+        """Number of nodes in the subtree of idx"""
+        return self.tree.dfs_out[idx] - self.tree.dfs_in[idx] + 1
+
+    def free_range(self, parent):
+        """Largest (low, high) range of parent's interval left by its placed children"""
+        if parent == VIRTUAL_ROOT:
+            low, high, children = 0, MAX_INTERVAL, self.roots
+        else:
+            # parent's own value is index_in[parent]
+            low, high = self.index_in[parent] + 1, self.index_out[parent]
+            children = self.tree._child_indices(parent)
+        used = sorted((self.index_in[child], self.index_out[child])
+                      for child in children if not self.pending[child])
+        best = (low, low - 1)
+        for child_in, child_out in used + [(high + 1, high + 1)]:
+            if child_in - low > best[1] - best[0] + 1:
+                best = (low, child_in - 1)
+            low = child_out + 1
+        return best
+
+    def place_subtree(self, idx):
+        parent = self.parent(idx)
+        size = self.size(idx)
+        low, high = self.free_range(parent)
+        free = high - low + 1
+        if free >= size * MIN_SPACING:
+            # half of the range at most, leaving room on both sides
+            length = max(size * MIN_SPACING, min(size * self.spacing, free // 2))
+            low += (free - length) // 2
+            self.assign(idx, low, low + length - 1)
+        else:
+            self.renumber(parent)
+
+    def renumber(self, idx):
+        """
+        Renumber the subtree of the lowest ancestor of idx (itself included)
+        whose interval has 2 * MIN_SPACING values per node, so each node is
+        left with room for a new child, or the whole tree
+        """
+        while idx != VIRTUAL_ROOT:
+            if self.index_out[idx] - self.index_in[idx] + 1 >= self.size(idx) * MIN_SPACING * 2:
+                self.assign(idx, self.index_in[idx], self.index_out[idx])
+                return
+            idx = self.parent(idx)
+        index_in, index_out = spaced_intervals(self.tree, self.spacing)
+        for node in range(len(index_in)):
+            self.set(node, index_in[node], index_out[node])
+            self.pending[node] = 0
+
+    def assign(self, idx, low, high):
+        """Spread the subtree of idx evenly over [low, high]"""
+        tree = self.tree
+        dfs_in = tree.dfs_in
+        dfs_out = tree.dfs_out
+        first = dfs_in[idx]
+        step = (high - low + 1) // self.size(idx)
+        for node in tree.preorder[first:dfs_out[idx] + 1]:
+            self.set(node, low + (dfs_in[node] - first) * step,
+                     high if node == idx else low + (dfs_out[node] - first + 1) * step - 1)
+            self.pending[node] = 0
+
+    def set(self, idx, low, high):
+        if self.index_in[idx] != low or self.index_out[idx] != high:
+            self.index_in[idx] = low
+            self.index_out[idx] = high
+            self.changed.add(idx)
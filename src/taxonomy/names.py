@@ -0,0 +1,277 @@
+"""
+Compact index of taxonomy names, to resolve names to taxids without
+full-text queries.
+
+Entries (name, taxid, field) are sorted by lowercased name and stored in flat
+arrays:
+
+- keys/key_offsets:   lowercased names (UTF-8) blob, key i is
+                      keys[key_offsets[i]:key_offsets[i + 1]]
+- names/name_offsets: original names, same layout
+- taxids:             taxid of entry i
+- fields:             field code of entry i, see field_names
+
+Case-insensitive lookups are a binary search on keys (UTF-8 bytes order is
+code point order), exact lookups also compare the original name, and prefix
+lookups scan the range of keys starting with the prefix.
+
+Abbreviated scientific names of species, subspecies and strains ("h. sapiens",
+see abbreviate_scientific_name) are added as "abbreviation" entries, so
+they're matched like any other name.
+
+The index is saved and memory-mapped like tree snapshots.
+"""
+from array import array
+
+from .snapshot import open_arrays, save_arrays
+
+NAMES_MAGIC = b"TAXNAME\0"
+NAMES_VERSION = 1
+# doc fields names are indexed from
+NAME_FIELDS = ("scientific_name", "common_name", "genbank_common_name", "other_names")
+ABBREVIATION = "abbreviation"
+
+
+def abbreviate_scientific_name(name, rank):
+    """
+    Abbreviate scientific name based on taxonomic rank.
+
+    Args:
+        name: Scientific name to abbreviate
+        rank: Taxonomic rank (species, subspecies, strain)
+
+    Returns:
+        Tuple of abbreviated names
+    """
+    if not name or not isinstance(name, str):
+        return ()
+
+    # Clean and split the name
+    name = name.strip()
+    parts = name.split()
+
+    # Need at least genus and species for abbreviation
+    if len(parts) < 2:
+        return ()
+
+    # Abbreviate first part (genus) to first letter + dot
+    genus = parts[0]
+    if len(genus) == 0:
+        return ()
+
+    abbreviated_genus = genus[0].upper() + '.'
+    abbreviated_names = []
+
+    if rank == 'species':
+        # For species: skip if "sp." exists in the scientific name
+        if 'sp.' in name:
+            return ()
+        # For species: G. species
+        if len(parts) >= 2:
+            abbreviated = abbreviated_genus + ' ' + ' '.join(parts[1:])
+            abbreviated_names.append(abbreviated)
+
+    elif rank == 'subspecies':
+        # For subspecies: G. species ssp. {rest} and G. species subsp.
+        if len(parts) >= 3:
+            species_part = parts[1]
+            rest_parts = parts[2:]
+
+            # Remove existing ssp. or subsp. if present
+            rest_parts_clean = []
+            for part in rest_parts:
+                if part not in ['ssp.', 'subsp.']:
+                    rest_parts_clean.append(part)
+
+            # Create both ssp. and subsp. variants
+            rest_joined = ' '.join(rest_parts_clean)
+            ssp_abbrev = (f"{abbreviated_genus} {species_part} "
+                          f"ssp. {rest_joined}")
+            subsp_abbrev = (f"{abbreviated_genus} {species_part} "
+                            f"subsp. {rest_joined}")
+
+            abbreviated_names.extend([ssp_abbrev, subsp_abbrev])
+
+    elif rank == 'strain':
+        # For strain: if has 'str. ' do G. species abbreviation, keep rest
+        if len(parts) >= 3:
+            species_part = parts[1]
+            rest_parts = parts[2:]
+
+            # If str. is already present, keep everything after it
+            if 'str.' in rest_parts:
+                str_index = rest_parts.index('str.')
+                # Keep str. and everything after it
+                rest_parts_to_keep = rest_parts[str_index:]
+            else:
+                # Add str. prefix to the rest
+                rest_parts_to_keep = ['str.'] + rest_parts
+
+            rest_joined = ' '.join(rest_parts_to_keep)
+            str_abbrev = (f"{abbreviated_genus} {species_part} "
+                          f"{rest_joined}")
+            abbreviated_names.append(str_abbrev)
+
+    return tuple(abbreviated_names)
+
+
+def iter_doc_names(doc):
+    """
+    Yield (name, field) of a names doc, as uploaded from names.dmp, and
+    abbreviations of its scientific name if doc has a rank (from nodes)
+    """
+    for field in NAME_FIELDS:
+        names = doc.get(field)
+        if not names:
+            continue
+        if isinstance(names, str):
+            names = [names]
+        for name in names:
+            yield name, field
+        if field == "scientific_name":
+            for abbreviated in abbreviate_scientific_name(names[0], doc.get("rank")):
+                yield abbreviated, ABBREVIATION
+
+
+class _Keys(object):
+    # sequence view of keys for bisect
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return bytes(self.blob[self.offsets[idx]:self.offsets[idx + 1]])
+
+
+class NamesIndex(object):
+    """
+    Sorted names index, see module docstring. Use NamesIndex.build() or
+    NamesIndex.open() to get one.
+    """
+
+    def __init__(self, keys, key_offsets, names, name_offsets, taxids, fields, field_names):
+        self.keys = keys
+        self.key_offsets = key_offsets
+        self.names = names
+        self.name_offsets = name_offsets
+        self.taxids = taxids
+        self.fields = fields
+        self.field_names = field_names
+        self._keys = _Keys(keys, key_offsets)
+        self.metadata = {}
+        self._mmap = None
+
+    @classmethod
+    def build(cls, records):
+        """
+        Build an index from an iterable of (name, taxid, field) records,
+        duplicated records are dropped
+        """
+        field_names = []
+        field_codes = {}
+        entries = set()
+        for name, taxid, field in records:
+            code = field_codes.get(field)
+            if code is None:
+                code = field_codes[field] = len(field_names)
+                field_names.append(field)
+            entries.add((name.lower().encode(), name, taxid, code))
+        keys = bytearray()
+        key_offsets = array('q', [0])
+        names = bytearray()
+        name_offsets = array('q', [0])
+        taxids = array('i')
+        fields = array('B')
+        for key, name, taxid, code in sorted(entries):
+            keys += key
+            key_offsets.append(len(keys))
+            names += name.encode()
+            name_offsets.append(len(names))
+            taxids.append(taxid)
+            fields.append(code)
+        return cls(keys, key_offsets, names, name_offsets, taxids, fields, field_names)
+
+    @classmethod
+    def from_docs(cls, docs):
+        """Build an index from names docs (see iter_doc_names())"""
+        return cls.build((name, doc["taxid"], field)
+                         for doc in docs for name, field in iter_doc_names(doc))
+
+    def save(self, path, metadata=None):
+        save_arrays(path, NAMES_MAGIC, NAMES_VERSION, {
+            "keys": self.keys, "key_offsets": self.key_offsets,
+            "names": self.names, "name_offsets": self.name_offsets,
+            "taxids": self.taxids, "fields": self.fields,
+        }, {"field_names": self.field_names, "metadata": metadata or {}})
+
+    @classmethod
+    def open(cls, path):
+        """Open an index saved with save(), memory-mapped"""
+        header, arrays, data = open_arrays(path, NAMES_MAGIC, NAMES_VERSION)
+        index = cls(arrays["keys"], arrays["key_offsets"], arrays["names"],
+                    arrays["name_offsets"], arrays["taxids"], arrays["fields"],
+                    header["field_names"])
+        index.metadata = header["metadata"]
+        index._mmap = data
+        return index
+
+    def __len__(self):
+        return len(self.taxids)
+
+    def entry(self, idx):
+        return {
+            "taxid": self.taxids[idx],
+            "name": bytes(self.names[self.name_offsets[idx]:self.name_offsets[idx + 1]]).decode(),
+            "field": self.field_names[self.fields[idx]],
+        }
+
+    def _range(self, key):
+        # [start, end) range of entries with key
+        start = _bisect_left(self._keys, key)
+        return start, _bisect_left(self._keys, key, start, upper=True)
+
+    def lookup(self, name, prefix=False, case_sensitive=False, limit=100):
+        """
+        List of entries (dicts with taxid, name and field) matching name:
+        case-insensitive by default, or exactly with case_sensitive, or
+        starting with name with prefix. At most limit entries are returned,
+        sorted by name.
+        """
+        key = name.strip().lower().encode()
+        if not key:
+            return []
+        if prefix:
+            start = _bisect_left(self._keys, key)
+            res = []
+            for idx in range(start, len(self._keys)):
+                if len(res) >= limit or not self._keys[idx].startswith(key):
+                    break
+                entry = self.entry(idx)
+                if not case_sensitive or entry["name"].startswith(name.strip()):
+                    res.append(entry)
+            return res
+        start, end = self._range(key)
+        res = []
+        for idx in range(start, end):
+            entry = self.entry(idx)
+            if not case_sensitive or entry["name"] == name.strip():
+                res.append(entry)
+                if len(res) >= limit:
+                    break
+        return res
+
+
+def _bisect_left(keys, key, low=0, upper=False):
+    # bisect on keys, first index with keys[idx] >= key (> key if upper)
+    high = len(keys)
+    while low < high:
+        mid = (low + high) // 2
+        mid_key = keys[mid]
+        if mid_key < key or (upper and mid_key == key):
+            low = mid + 1
+        else:
+            high = mid
+    return low
@@ -0,0 +1,81 @@
+"""
+Binary snapshot files of flat arrays, memory-mapped when opened: opening is
+immediate and processes opening the same file share its pages.
+
+Layout:
+
+- magic (8 bytes), format version (uint32), header length (uint32)
+- JSON header: byte order, caller's fields, and for each array its
+  typecode, length and offset in the file
+- array data, each array aligned on 8 bytes
+
+Only the standard library is used, so the web process can open snapshots
+written by the hub.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+
+def save_arrays(path, magic, version, arrays, header=None):
+    """
+    Write arrays ({name: array, bytes or memoryview}, None values skipped)
+    and header (JSON serializable dict) to path. The file is written aside
+    and renamed, so readers never see a partial snapshot.
+    """
+    header = dict(header or {}, byteorder=sys.byteorder, arrays={})
+    offset = 0
+    data = []
+    for name, arr in arrays.items():
+        if arr is None:
+            continue
+        if not isinstance(arr, array):
+            arr = memoryview(arr)
+        typecode = arr.typecode if isinstance(arr, array) else arr.format
+        nbytes = len(arr) * arr.itemsize
+        header["arrays"][name] = {"typecode": typecode, "length": len(arr), "offset": offset}
+        data.append(arr)
+        offset += nbytes + (-nbytes % 8)
+    header = json.dumps(header).encode()
+    # data starts aligned on 8 bytes after the header
+    header += b" " * (-(len(magic) + 8 + len(header)) % 8)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fileh:
+        fileh.write(magic + struct.pack("<II", version, len(header)))
+        fileh.write(header)
+        for arr in data:
+            arr = memoryview(arr).cast("B")
+            fileh.write(arr)
+            fileh.write(bytes(-len(arr) % 8))
+    os.replace(tmp_path, path)
+
+
+def open_arrays(path, magic, version):
+    """
+    Open a file written by save_arrays(), return (header, arrays, mmap):
+    arrays are read-only memoryviews on the memory-mapped file, which must
+    be kept referenced while they're used. Raise ValueError if path isn't a
+    snapshot with this magic and version.
+    """
+    with open(path, "rb") as fileh:
+        data = mmap.mmap(fileh.fileno(), 0, access=mmap.ACCESS_READ)
+    prefix_size = len(magic) + 8
+    if data[:len(magic)] != magic:
+        raise ValueError("%s is not a %s snapshot" % (path, magic.rstrip(b"\0").decode()))
+    file_version, header_size = struct.unpack("<II", data[len(magic):prefix_size])
+    if file_version != version:
+        raise ValueError("Unsupported snapshot version %s in %s" % (file_version, path))
+    header = json.loads(data[prefix_size:prefix_size + header_size])
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError("Snapshot %s was written with %s byte order" % (path, header["byteorder"]))
+    view = memoryview(data)
+    start = prefix_size + header_size
+    arrays = {}
+    for name, info in header["arrays"].items():
+        offset = start + info["offset"]
+        itemsize = array(info["typecode"]).itemsize
+        arrays[name] = view[offset:offset + info["length"] * itemsize].cast(info["typecode"])
+    return header, arrays, data
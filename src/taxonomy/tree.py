@@ -0,0 +1,522 @@
+"""
+Compact, array-backed representation of the NCBI taxonomy tree.
+
+Nodes are addressed by a dense index (0..N-1) instead of their taxid, so the
+whole tree fits in a handful of flat arrays:
+
+- taxids:        index -> taxid
+- parents:       index -> parent index (the root points to itself)
+- ranks:         index -> rank code, see rank_names
+- has_gene_bits: one bit per index
+- child_offsets/child_index: children in CSR form, children of node i are
+                 child_index[child_offsets[i]:child_offsets[i + 1]]
+- taxid_lookup:  taxid -> index (-1 when the taxid is not part of the tree)
+
+Lineages of all nodes can also be computed at once with compute_lineages(),
+they're then stored flat: lineage of node i is
+lineage_ids[lineage_offsets[i]:lineage_offsets[i + 1]].
+
+compute_dfs_intervals() numbers nodes in depth-first pre-order: the subtree
+of node i is then exactly the nodes numbered dfs_in[i] to dfs_out[i], so any
+subtree is a single range (eg. a range query on indexed dfs_in). Children
+(and roots) are ordered by taxid, so children lists and numbering only
+depend on the tree, not on the order nodes were read in (Mongo scan, dmp
+file...). Intervals stored in documents are spaced versions of these, so
+nodes can be added without renumbering the rest of the tree (see
+index_intervals() and intervals module).
+
+This takes a few tens of MB for the ~2.6M NCBI nodes, compared to several GB
+for the equivalent dicts of Python ints.
+
+A tree can be saved as a binary snapshot with save_snapshot(), and opened
+with open_snapshot(): arrays are then memory-mapped from the file instead of
+being loaded (see snapshot module).
+"""
+from array import array
+
+from .intervals import spaced_intervals
+from .snapshot import open_arrays, save_arrays
+
+SNAPSHOT_MAGIC = b"TAXTREE\0"
+SNAPSHOT_VERSION = 2
+# arrays saved in snapshots, when set
+SNAPSHOT_ARRAYS = ("taxids", "parents", "ranks", "taxid_lookup", "child_offsets",
+                   "child_index", "has_gene_bits", "depths", "lineage_offsets",
+                   "lineage_ids", "dfs_in", "dfs_out", "preorder")
+
+
+class TaxidBitmap(object):
+    """
+    Set of taxids stored as a bitmap indexed by taxid.
+    """
+
+    def __init__(self, taxids=(), size=0):
+        self.bits = bytearray((size >> 3) + 1)
+        self.count = 0
+        for taxid in taxids:
+            self.add(taxid)
+
+    def add(self, taxid):
+        taxid = int(taxid)
+        if taxid < 0:
+            raise ValueError("Invalid taxid %s" % taxid)
+        byte = taxid >> 3
+        if byte >= len(self.bits):
+            # grow geometrically, taxids are not necessarily sorted
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        mask = 1 << (taxid & 7)
+        if not self.bits[byte] & mask:
+            self.bits[byte] |= mask
+            self.count += 1
+
+    def __contains__(self, taxid):
+        byte = taxid >> 3
+        return 0 <= byte < len(self.bits) and bool(self.bits[byte] & (1 << (taxid & 7)))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for byte_idx, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (byte_idx << 3) | bit
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+
+class TaxonomyTree(object):
+    """
+    Taxonomy tree stored in flat arrays, see module docstring for the layout.
+    Use TaxonomyTree.from_nodes() to build one.
+    """
+
+    def __init__(self, taxids, parents, ranks, rank_names, taxid_lookup,
+                 child_offsets, child_index, has_gene_bits=None):
+        self.taxids = taxids
+        self.parents = parents
+        self.ranks = ranks
+        self.rank_names = rank_names
+        self.taxid_lookup = taxid_lookup
+        self.child_offsets = child_offsets
+        self.child_index = child_index
+        if has_gene_bits is None:
+            has_gene_bits = bytearray((len(taxids) >> 3) + 1)
+        self.has_gene_bits = has_gene_bits
+        # filled by compute_lineages()
+        self.depths = None
+        self.lineage_offsets = None
+        self.lineage_ids = None
+        # filled by compute_dfs_intervals()
+        self.dfs_in = None
+        self.dfs_out = None
+        self.preorder = None
+        # intervals stored in documents, see index_intervals()
+        self.index_in = None
+        self.index_out = None
+        # set by open_snapshot()
+        self.metadata = {}
+        self._mmap = None
+
+    @classmethod
+    def from_nodes(cls, nodes):
+        """
+        Build a tree from an iterable of (taxid, parent_taxid, rank) tuples,
+        as found in nodes.dmp, in any order. The root is the node pointing
+        to itself. Children are sorted by taxid.
+        """
+        taxids = array('i')
+        parent_taxids = array('i')
+        ranks = array('B')
+        rank_names = []
+        rank_codes = {}
+        for taxid, parent_taxid, rank in nodes:
+            taxids.append(taxid)
+            parent_taxids.append(parent_taxid)
+            code = rank_codes.get(rank)
+            if code is None:
+                code = rank_codes[rank] = len(rank_names)
+                if code > 255:
+                    raise ValueError("Too many distinct ranks (max 256)")
+                rank_names.append(rank)
+            ranks.append(code)
+
+        size = len(taxids)
+        taxid_lookup = array('i', [-1]) * ((max(taxids) + 1) if size else 0)
+        for idx, taxid in enumerate(taxids):
+            taxid_lookup[taxid] = idx
+
+        parents = array('i', bytes(4 * size))
+        for idx, parent_taxid in enumerate(parent_taxids):
+            parent = taxid_lookup[parent_taxid] if parent_taxid < len(taxid_lookup) else -1
+            if parent == -1:
+                raise ValueError("Parent taxid %s of %s not found" % (parent_taxid, taxids[idx]))
+            parents[idx] = parent
+        del parent_taxids
+
+        child_offsets, child_index = cls._build_children(parents, taxid_lookup)
+        return cls(taxids, parents, ranks, rank_names, taxid_lookup,
+                   child_offsets, child_index)
+
+    @staticmethod
+    def _build_children(parents, taxid_lookup):
+        # counting sort of nodes by parent index (CSR), nodes being visited
+        # in taxid order so each node's children are sorted by taxid
+        size = len(parents)
+        offsets = array('i', bytes(4 * (size + 1)))
+        for idx, parent in enumerate(parents):
+            if parent != idx:
+                offsets[parent + 1] += 1
+        for idx in range(size):
+            offsets[idx + 1] += offsets[idx]
+        child_index = array('i', bytes(4 * offsets[size]))
+        fill = array('i', offsets[:size])
+        for idx in taxid_lookup:
+            if idx == -1:
+                continue
+            parent = parents[idx]
+            if parent != idx:
+                child_index[fill[parent]] = idx
+                fill[parent] += 1
+        return offsets, child_index
+
+    def compute_dfs_intervals(self):
+        """
+        Number nodes in depth-first pre-order (roots and children by taxid), and
+        compute for each node the [dfs_in, dfs_out] range its subtree covers.
+        preorder[n] is then the index of the node numbered n.
+        """
+        size = len(self.taxids)
+        parents = self.parents
+        child_offsets = self.child_offsets
+        child_index = self.child_index
+        preorder = array('i')
+        stack = self.root_indices()
+        stack.reverse()
+        while stack:
+            idx = stack.pop()
+            preorder.append(idx)
+            stack.extend(reversed(child_index[child_offsets[idx]:child_offsets[idx + 1]]))
+        if len(preorder) != size:
+            raise ValueError("Taxonomy tree contains cycles, %d nodes can't be "
+                             "reached from a root" % (size - len(preorder)))
+
+        dfs_in = array('i', bytes(4 * size))
+        for number, idx in enumerate(preorder):
+            dfs_in[idx] = number
+        # subtree sizes, bottom-up
+        subtree_sizes = array('i', [1]) * size
+        for idx in reversed(preorder):
+            parent = parents[idx]
+            if parent != idx:
+                subtree_sizes[parent] += subtree_sizes[idx]
+        dfs_out = array('i', bytes(4 * size))
+        for idx in range(size):
+            dfs_out[idx] = dfs_in[idx] + subtree_sizes[idx] - 1
+
+        self.dfs_in = dfs_in
+        self.dfs_out = dfs_out
+        self.preorder = preorder
+
+    def save_snapshot(self, path, metadata=None):
+        """
+        Write the tree (and lineages/DFS intervals if computed) as a binary
+        snapshot, see module docstring. metadata must be JSON serializable.
+        """
+        save_arrays(path, SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                    {name: getattr(self, name) for name in SNAPSHOT_ARRAYS},
+                    {"rank_names": self.rank_names, "metadata": metadata or {}})
+
+    @classmethod
+    def open_snapshot(cls, path):
+        """
+        Open a snapshot written by save_snapshot(), arrays are read-only
+        views on the memory-mapped file, except has_gene_bits which is copied
+        so set_has_gene() can still be used. Raise ValueError if path isn't
+        a snapshot this version can read.
+        """
+        header, arrays, data = open_arrays(path, SNAPSHOT_MAGIC, SNAPSHOT_VERSION)
+        tree = cls(arrays["taxids"], arrays["parents"], arrays["ranks"], header["rank_names"],
+                   arrays["taxid_lookup"], arrays["child_offsets"], arrays["child_index"],
+                   bytearray(arrays["has_gene_bits"]))
+        for name in ("depths", "lineage_offsets", "lineage_ids", "dfs_in", "dfs_out", "preorder"):
+            setattr(tree, name, arrays.get(name))
+        tree.metadata = header["metadata"]
+        tree._mmap = data
+        return tree
+
+    def __len__(self):
+        return len(self.taxids)
+
+    def __contains__(self, taxid):
+        return 0 <= taxid < len(self.taxid_lookup) and self.taxid_lookup[taxid] != -1
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the tree arrays, in bytes"""
+        return sum(len(arr) * arr.itemsize for arr in (
+            self.taxids, self.parents, self.ranks, self.taxid_lookup,
+            self.child_offsets, self.child_index, self.depths,
+            self.lineage_offsets, self.lineage_ids, self.dfs_in, self.dfs_out,
+            self.preorder, self.index_in, self.index_out) if arr is not None) + len(self.has_gene_bits)
+
+    def root_indices(self):
+        """List of indices of root nodes (pointing to themselves), by taxid"""
+        parents = self.parents
+        taxids = self.taxids
+        return sorted((idx for idx in range(len(parents)) if parents[idx] == idx),
+                      key=taxids.__getitem__)
+
+    def bfs_order(self):
+        """Array of all node indices, breadth-first from the root(s)"""
+        child_offsets = self.child_offsets
+        child_index = self.child_index
+        order = array('i', self.root_indices())
+        pos = 0
+        # order grows while being iterated, until all levels are visited
+        while pos < len(order):
+            idx = order[pos]
+            order.extend(child_index[child_offsets[idx]:child_offsets[idx + 1]])
+            pos += 1
+        return order
+
+    def compute_lineages(self):
+        """
+        Compute depth and lineage of every node in one pass, top-down from the
+        root: a node's lineage is itself followed by its parent's lineage, which
+        is already computed when the node is visited. Once computed, lineage()
+        only slices the flat lineage_ids array.
+        """
+        size = len(self.taxids)
+        parents = self.parents
+        taxids = self.taxids
+        order = self.bfs_order()
+        if len(order) != size:
+            raise ValueError("Taxonomy tree contains cycles, %d nodes can't be "
+                             "reached from a root" % (size - len(order)))
+
+        depths = self.compute_depths(order)
+
+        offsets = array('q', bytes(8 * (size + 1)))
+        total = 0
+        for idx in range(size):
+            total += depths[idx] + 1
+            offsets[idx + 1] = total
+
+        lineage_ids = array('i', bytes(4 * total))
+        for idx in order:
+            start = offsets[idx]
+            lineage_ids[start] = taxids[idx]
+            parent = parents[idx]
+            if parent != idx:
+                parent_start = offsets[parent]
+                lineage_ids[start + 1:offsets[idx + 1]] = \
+                    lineage_ids[parent_start:offsets[parent + 1]]
+
+        self.depths = depths
+        self.lineage_offsets = offsets
+        self.lineage_ids = lineage_ids
+
+    def compute_depths(self, order=None):
+        """Compute depth of every node (without lineages), top-down from the root"""
+        parents = self.parents
+        depths = array('i', bytes(4 * len(parents)))
+        for idx in (order if order is not None else self.bfs_order()):
+            parent = parents[idx]
+            if parent != idx:
+                depths[idx] = depths[parent] + 1
+        self.depths = depths
+        return depths
+
+    def index_of(self, taxid):
+        """Dense index of taxid, raise KeyError if taxid isn't part of the tree"""
+        if 0 <= taxid < len(self.taxid_lookup):
+            idx = self.taxid_lookup[taxid]
+            if idx != -1:
+                return idx
+        raise KeyError(taxid)
+
+    def depth(self, taxid):
+        """Number of hops from taxid up to the root"""
+        idx = self.index_of(taxid)
+        if self.depths is not None:
+            return self.depths[idx]
+        return len(self.lineage(taxid)) - 1
+
+    def parent_taxid(self, taxid):
+        return self.taxids[self.parents[self.index_of(taxid)]]
+
+    def rank(self, taxid):
+        return self.rank_names[self.ranks[self.index_of(taxid)]]
+
+    def lineage(self, taxid):
+        """List of taxids from taxid itself up to the root"""
+        idx = self.index_of(taxid)
+        if self.lineage_ids is not None:
+            return self.lineage_ids[self.lineage_offsets[idx]:self.lineage_offsets[idx + 1]].tolist()
+        parents = self.parents
+        taxids = self.taxids
+        lineage = [taxids[idx]]
+        parent = parents[idx]
+        while parent != idx:
+            idx = parent
+            lineage.append(taxids[idx])
+            parent = parents[idx]
+        return lineage
+
+    def _child_indices(self, idx):
+        return self.child_index[self.child_offsets[idx]:self.child_offsets[idx + 1]]
+
+    def children(self, taxid):
+        """List of direct children taxids"""
+        taxids = self.taxids
+        return [taxids[child] for child in self._child_indices(self.index_of(taxid))]
+
+    def children_count(self, taxid):
+        """Number of direct children"""
+        idx = self.index_of(taxid)
+        return int(self.child_offsets[idx + 1] - self.child_offsets[idx])
+
+    def iter_children(self, taxid, has_gene=False):
+        """Iterate over direct children taxids (flagged as having genes only, with has_gene)"""
+        taxids = self.taxids
+        for child in self._child_indices(self.index_of(taxid)):
+            if not has_gene or self._has_gene(child):
+                yield taxids[child]
+
+    def descendants(self, taxid):
+        """List of all taxids below taxid (taxid itself excluded), depth-first"""
+        taxids = self.taxids
+        descendants = []
+        stack = [self.index_of(taxid)]
+        while stack:
+            idx = stack.pop()
+            children = self._child_indices(idx)
+            descendants.extend(taxids[child] for child in children)
+            stack.extend(children)
+        return descendants
+
+    def dfs_interval(self, taxid):
+        """(dfs_in, dfs_out) of taxid, see compute_dfs_intervals()"""
+        idx = self.index_of(taxid)
+        return self.dfs_in[idx], self.dfs_out[idx]
+
+    def index_intervals(self):
+        """
+        (index_in, index_out) arrays of the spaced intervals stored in
+        documents as dfs_in/dfs_out (see intervals module): as set with
+        set_index_intervals(), numbered as by a full build otherwise.
+        """
+        if self.index_in is None:
+            self.index_in, self.index_out = spaced_intervals(self)
+        return self.index_in, self.index_out
+
+    def set_index_intervals(self, index_in, index_out):
+        self.index_in = index_in
+        self.index_out = index_out
+
+    def index_interval(self, taxid):
+        """(dfs_in, dfs_out) of taxid stored in documents, see index_intervals()"""
+        idx = self.index_of(taxid)
+        index_in, index_out = self.index_intervals()
+        return index_in[idx], index_out[idx]
+
+    def is_ancestor(self, ancestor, taxid):
+        """True if ancestor is taxid or one of its ancestors, in O(1)"""
+        ancestor = self.index_of(ancestor)
+        idx = self.index_of(taxid)
+        return self.dfs_in[ancestor] <= self.dfs_in[idx] <= self.dfs_out[ancestor]
+
+    def subtree(self, taxid):
+        """List of taxids of the whole subtree of taxid (itself first), in pre-order"""
+        idx = self.index_of(taxid)
+        taxids = self.taxids
+        return [taxids[node] for node in self.preorder[self.dfs_in[idx]:self.dfs_out[idx] + 1]]
+
+    def _lca_index(self, indices):
+        # climb from any node until its interval covers all nodes'
+        if self.dfs_in is None:
+            self.compute_dfs_intervals()
+        dfs_in = self.dfs_in
+        dfs_out = self.dfs_out
+        parents = self.parents
+        low = min(dfs_in[idx] for idx in indices)
+        high = max(dfs_in[idx] for idx in indices)
+        idx = indices[0]
+        while not dfs_in[idx] <= low or not high <= dfs_out[idx]:
+            parent = parents[idx]
+            if parent == idx:
+                # separate trees
+                return None
+            idx = parent
+        return idx
+
+    def lca(self, taxids):
+        """
+        Lowest common ancestor of taxids (None if they're in separate trees),
+        in O(len(taxids) + depth) using DFS intervals
+        """
+        idx = self._lca_index([self.index_of(taxid) for taxid in taxids])
+        return None if idx is None else self.taxids[idx]
+
+    def path(self, source, target):
+        """
+        List of taxids from source up to the lowest common ancestor and down
+        to target (both included), None if they're in separate trees
+        """
+        source_idx = self.index_of(source)
+        target_idx = self.index_of(target)
+        lca = self._lca_index([source_idx, target_idx])
+        if lca is None:
+            return None
+        taxids = self.taxids
+        parents = self.parents
+        up = []
+        idx = source_idx
+        while idx != lca:
+            up.append(taxids[idx])
+            idx = parents[idx]
+        down = []
+        idx = target_idx
+        while idx != lca:
+            down.append(taxids[idx])
+            idx = parents[idx]
+        up.append(taxids[lca])
+        down.reverse()
+        return up + down
+
+    def set_has_gene(self, taxids):
+        """Flag given taxids as having genes, taxids not in the tree are ignored"""
+        bits = self.has_gene_bits
+        lookup = self.taxid_lookup
+        for taxid in taxids:
+            if 0 <= taxid < len(lookup):
+                idx = lookup[taxid]
+                if idx != -1:
+                    bits[idx >> 3] |= 1 << (idx & 7)
+
+    def _has_gene(self, idx):
+        return bool(self.has_gene_bits[idx >> 3] & (1 << (idx & 7)))
+
+    def has_gene(self, taxid):
+        return self._has_gene(self.index_of(taxid))
+
+    def has_gene_taxids(self):
+        """TaxidBitmap of all taxids flagged as having genes"""
+        taxids = self.taxids
+        bitmap = TaxidBitmap(size=len(self.taxid_lookup))
+        for byte_idx, byte in enumerate(self.has_gene_bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        bitmap.add(taxids[(byte_idx << 3) | bit])
+        return bitmap
+
+    def has_gene_children(self, taxid):
+        """List of direct children taxids flagged as having genes"""
+        taxids = self.taxids
+        return [taxids[child] for child in self._child_indices(self.index_of(taxid))
+                if self._has_gene(child)]
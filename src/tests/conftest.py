@@ -0,0 +1,33 @@
+"""
+Hub modules read their settings from a "config" module (config_hub.py and
+deployment settings), and biothings.hub reads the hub DB as soon as it's
+imported. Unit tests get a config loaded from config_hub.py, with a SQLite
+hub DB and data folders in a temporary directory, so they run without
+MongoDB. tests/config.py is the web tests' config: biothings web tests load
+it by path, it's never imported as the hub "config".
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_hub_config():
+    spec = importlib.util.spec_from_file_location("config", os.path.join(SRC_FOLDER, "config_hub.py"))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    folder = tempfile.mkdtemp(prefix="mytaxon_tests_")
+    config.DATA_ARCHIVE_ROOT = os.path.join(folder, "data")
+    config.LOG_FOLDER = os.path.join(folder, "logs")
+    config.HUB_DB_BACKEND = {"module": "biothings.utils.sqlite3",
+                             "sqlite_db_folder": os.path.join(folder, "hubdb")}
+    for path in (config.DATA_ARCHIVE_ROOT, config.LOG_FOLDER, config.HUB_DB_BACKEND["sqlite_db_folder"]):
+        os.makedirs(path)
+    return config
+
+
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+sys.modules["config"] = load_hub_config()
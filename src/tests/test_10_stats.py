@@ -0,0 +1,47 @@
+from hub.databuild.stats import TaxonomyStats
+from taxonomy.tree import TaxonomyTree
+
+NODES = [
+    (1, 1, "no rank"),
+    (2, 1, "superkingdom"),
+    (3, 2, "genus"),
+    (4, 2, "genus"),
+    (5, 3, "species"),
+    (10, 1, "superkingdom"),
+    (11, 10, "species"),
+]
+
+
+class TestTaxonomyStats:
+
+    def test_1001_from_tree(self):
+        tree = TaxonomyTree.from_nodes(NODES)
+        tree.set_has_gene([4, 5, 11])
+        meta = TaxonomyStats.from_tree(tree).to_meta()
+        assert meta["unique taxonomy ids"] == 7
+        assert meta["distribution of taxonomy ids by rank"] == {
+            "no rank": 1, "superkingdom": 2, "genus": 2, "species": 2}
+        assert meta["taxonomy ids with genes"] == 3
+        assert meta["distribution of taxonomy ids with genes by rank"] == {"genus": 1, "species": 2}
+        assert meta["max depth"] == 3
+        assert meta["mean depth"] == round(11 / 7, 2)
+        assert meta["children fan-out"] == {"nodes with children": 4, "max": 2,
+                                            "p50": 1, "p90": 2, "p99": 2}
+
+    def test_1002_from_docs(self):
+        tree = TaxonomyTree.from_nodes(NODES)
+        tree.set_has_gene([4, 5, 11])
+        docs = [{"taxid": taxid, "rank": rank, "has_gene": tree.has_gene(taxid),
+                 "depth": tree.depth(taxid), "children": tree.children(taxid)}
+                for taxid, _, rank in NODES]
+        stats = TaxonomyStats()
+        # streamed in batches, with a duplicated taxid
+        stats.update(docs[:4])
+        stats.update(docs[4:])
+        stats.update([{"taxid": 5}])
+        meta = stats.to_meta()
+        assert meta["unique taxonomy ids"] == 7
+        expected = TaxonomyStats.from_tree(tree).to_meta()
+        assert meta["taxonomy ids with genes"] == expected["taxonomy ids with genes"]
+        assert meta["max depth"] == expected["max depth"]
+        assert meta["children fan-out"] == expected["children fan-out"]
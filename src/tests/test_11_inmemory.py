@@ -0,0 +1,117 @@
+import gzip
+import json
+import logging
+from types import SimpleNamespace
+
+from hub.databuild import builder
+from hub.databuild.inmemory import NDJSONSink, inmemory_build, iter_docs, load_sources
+
+NODES = [
+    (1, 1, "no rank"),
+    (2, 1, "superkingdom"),
+    (3, 2, "genus"),
+    (4, 3, "species"),
+    (5, 3, "species"),
+]
+NAMES = [
+    (1, "root", "scientific name"),
+    (2, "Bacteria", "scientific name"),
+    (2, "eubacteria", "genbank common name"),
+    (3, "Escherichia", "scientific name"),
+    (4, "Escherichia coli", "scientific name"),
+    (4, "E. coli", "common name"),
+    (5, "Escherichia albertii", "scientific name"),
+]
+SPECLIST = """Code  Taxon    N=Official (scientific) name
+_____ _ _______  ____________________________________________________________
+ECOLI B       4: N=Escherichia coli
+HUMAN E    9606: N=Homo sapiens
+"""
+GENE_INFO = "#tax_id\tGeneID\tSymbol\n4\t944742\tthrL\n4\t945803\tthrA\n"
+
+
+def write_dumps(folder):
+    with open(folder / "nodes.dmp", "w") as fileh:
+        for taxid, parent_taxid, rank in NODES:
+            fileh.write("%d\t|\t%d\t|\t%s\t|\t\t|\n" % (taxid, parent_taxid, rank))
+    with open(folder / "names.dmp", "w") as fileh:
+        for taxid, name, name_class in NAMES:
+            fileh.write("%d\t|\t%s\t|\t\t|\t%s\t|\n" % (taxid, name, name_class))
+    with open(folder / "speclist.txt", "w") as fileh:
+        fileh.write(SPECLIST)
+    with gzip.open(folder / "gene_info.gz", "wt") as fileh:
+        fileh.write(GENE_INFO)
+    return {"taxonomy": str(folder), "uniprot_species": str(folder), "geneinfo": str(folder)}
+
+
+class TestInMemoryBuild:
+
+    def test_1101_load_sources(self, tmp_path):
+        tree, uniprot = load_sources(write_dumps(tmp_path))
+        assert len(tree) == 5
+        assert tree.has_gene(4) and not tree.has_gene(5)
+        # 9606 isn't part of the dumped taxonomy, still loaded here
+        assert uniprot == {4: "escherichia coli", 9606: "homo sapiens"}
+
+    def test_1102_docs(self, tmp_path):
+        folders = write_dumps(tmp_path)
+        tree, uniprot = load_sources(folders)
+        docs = {doc["taxid"]: doc for doc in iter_docs(tree, uniprot, str(tmp_path), batch_size=2)}
+        assert sorted(docs) == [1, 2, 3, 4, 5]
+        ecoli = docs[4]
+        assert ecoli["scientific_name"] == "Escherichia coli"
+        assert ecoli["uniprot_name"] == "escherichia coli"
+        assert ecoli["parent_taxid"] == 3
+        assert ecoli["rank"] == "species"
+        assert ecoli["has_gene"] is True
+        assert ecoli["lineage"] == [4, 3, 2, 1]
+        assert docs[3]["children"] == [4, 5]
+        assert "uniprot_name" not in docs[5]
+
+    def test_1103_ndjson(self, tmp_path):
+        folders = write_dumps(tmp_path)
+        path = tmp_path / "out" / "build.ndjson"
+        count, stats = inmemory_build(NDJSONSink(str(path), "mytaxon_test", ("ancestors",)), folders)
+        assert count == 5
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert len(lines) == 10
+        assert lines[0] == {"index": {"_index": "mytaxon_test", "_id": "1"}}
+        assert all("ancestors" not in doc and "_id" not in doc for doc in lines[1::2])
+        meta = stats.to_meta()
+        assert meta["unique taxonomy ids"] == 5
+        assert meta["taxonomy ids with genes"] == 1
+
+    def test_1104_metadata_step(self, tmp_path, monkeypatch):
+        folders = write_dumps(tmp_path)
+        _, stats = inmemory_build(NDJSONSink(str(tmp_path / "out" / "build.ndjson")), folders)
+        builds = {}
+
+        class Builds:
+            def find_one(self, query):
+                return builds.get(query["_id"])
+
+        # metadata step run on its own, the target collection being empty
+        data_builder = builder.InMemoryTaxonomyDataBuilder(
+            "mytaxon", SimpleNamespace(build=Builds()), SimpleNamespace(target_name="mytaxon_test"),
+            str(tmp_path))
+        data_builder.logger = logging.getLogger(__name__)
+        builds["mytaxon_test"] = {"taxonomy_stats": stats.to_meta()}
+        meta = data_builder.get_stats(["taxonomy"], None)
+        assert meta == dict(stats.to_meta(), __REPLACE__=True)
+        # built before stats were stored
+        del builds["mytaxon_test"]
+        monkeypatch.setattr(builder, "source_folders", lambda: folders)
+        assert data_builder.get_stats(["taxonomy"], None) == meta
+
+    def test_1105_merged_docs_stats(self, monkeypatch):
+        # mongo builds count merged docs, including taxids not in nodes.dmp
+        docs = [{"taxid": taxid, "rank": rank} for taxid, _, rank in NODES]
+        docs.append({"taxid": 9606, "rank": "species", "has_gene": True})
+        monkeypatch.setattr(builder, "doc_feeder", lambda col, **kwargs: iter([docs[:3], docs[3:]]))
+        data_builder = builder.TaxonomyDataBuilder(
+            "mytaxon", SimpleNamespace(), SimpleNamespace(target_collection=None), "/tmp")
+        data_builder.logger = logging.getLogger(__name__)
+        meta = data_builder.get_stats(["taxonomy"], None)
+        assert meta["unique taxonomy ids"] == 6
+        assert meta["distribution of taxonomy ids by rank"]["species"] == 3
+        assert meta["taxonomy ids with genes"] == 1
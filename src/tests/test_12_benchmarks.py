@@ -0,0 +1,66 @@
+import pytest
+
+from benchmarks import suite
+from benchmarks.suite import compare, run_suite
+from benchmarks.synthetic import generate_taxdump
+from hub.dataload.sources.geneinfo.parser import load_geneinfo_taxids
+from hub.dataload.sources.taxonomy.parser import parse_refseq_names_fast
+from hub.dataload.sources.uniprot.parser import parse_uniprot_speclist
+
+
+class TestBenchmarks:
+
+    def test_1201_synthetic_taxdump(self, tmp_path):
+        nodes = generate_taxdump(str(tmp_path), 5000, seed=1)
+        taxids = set(taxid for taxid, _, _ in nodes)
+        assert len(taxids) == 5000
+        with open(tmp_path / "names.dmp", "rb") as fileh:
+            docs = list(parse_refseq_names_fast(fileh))
+        assert set(doc["taxid"] for doc in docs) == taxids
+        assert all(doc["scientific_name"] for doc in docs)
+        with open(tmp_path / "speclist.txt") as fileh:
+            uniprot = list(parse_uniprot_speclist(fileh))
+        assert uniprot and set(doc["taxid"] for doc in uniprot) <= taxids
+        with open(tmp_path / "gene_info.gz", "rb") as fileh:
+            gene_taxids = load_geneinfo_taxids(fileh)
+        assert gene_taxids and gene_taxids <= taxids
+        # seeded
+        assert generate_taxdump(str(tmp_path), 5000, seed=1) == nodes
+
+    def test_1202_suite(self):
+        results = run_suite(size=2000, repeat=1, groups=["parsers", "mappers"], verbose=False)
+        assert results["meta"]["size"] == 2000
+        names = results["results"]["parsers.parse_refseq_names_fast"]
+        assert names["items"] == 2000
+        assert names["seconds"] > 0 and names["peak_bytes"] > 0
+        assert results["results"]["mappers.LineageMapper"]["items"] == 2000
+        assert not any(key.startswith("web.") for key in results["results"])
+        assert compare(results, results) == []
+        slower = {"results": dict(results["results"],
+                                  **{"parsers.parse_refseq_names_fast": dict(names, seconds=10.0)})}
+        assert compare(slower, results) == [
+            ("parsers.parse_refseq_names_fast", "seconds", names["seconds"], 10.0)]
+        # benchmarks of the baseline not measured anymore
+        lineage = results["results"]["mappers.LineageMapper"]
+        skipped = {"results": dict(results["results"],
+                                   **{"mappers.LineageMapper": {"skipped": "ImportError: tree"}})}
+        del skipped["results"]["parsers.parse_refseq_names_fast"]
+        assert sorted(compare(skipped, results)) == [
+            ("mappers.LineageMapper", "skipped", lineage["seconds"], "ImportError: tree"),
+            ("parsers.parse_refseq_names_fast", "missing", names["seconds"], None)]
+        assert compare(results, skipped) == []
+
+    def test_1203_setup_errors(self, monkeypatch):
+
+        def broken(data):
+            raise ValueError("broken benchmark")
+
+        def unavailable(data):
+            raise ImportError("No module named 'config'")
+
+        monkeypatch.setattr(suite, "BENCHMARKS", [("broken", "setup", unavailable)])
+        results = run_suite(size=100, repeat=1, verbose=False)
+        assert results["results"] == {"broken.setup": {"skipped": "ImportError: No module named 'config'"}}
+        monkeypatch.setattr(suite, "BENCHMARKS", [("broken", "setup", broken)])
+        with pytest.raises(ValueError):
+            run_suite(size=100, repeat=1, verbose=False)
@@ -0,0 +1,108 @@
+import asyncio
+import pickle
+import time
+
+import pytest
+
+from hub.databuild import postmerge
+from hub.instrumentation import InstrumentedUploader, Instrumentation, StageStats
+
+
+class UpperMapper:
+
+    def __init__(self, name):
+        self.name = name
+
+    def process(self, docs):
+        for doc in docs:
+            doc[self.name] = doc["name"].upper()
+            yield doc
+
+
+class JobManager:
+
+    async def defer_to_process(self, pinfo=None, func=None, *args):
+        job = asyncio.get_running_loop().create_future()
+        job.set_result(func(*args))
+        return job
+
+
+class Uploader:
+
+    async def update_data(self, batch_size, job_manager):
+        # as ParallelizedSourceUploader: one job per chunk, storage returns
+        # the number of docs stored
+        jobs = [await job_manager.defer_to_process({}, lambda count=count: count) for count in (10, 15)]
+        await asyncio.gather(*jobs)
+
+
+class Collection:
+
+    def __init__(self):
+        self.ops = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.ops.extend(ops)
+
+
+class TestInstrumentation:
+
+    def test_1301_stage(self):
+        stage = StageStats()
+        with stage.measure(10):
+            time.sleep(0.02)
+        with stage.measure() as batch:
+            batch["docs"] = 5
+        stats = stage.to_dict()
+        assert stats["batches"] == 2
+        assert stats["docs"] == 15
+        assert stats["wall"] >= 0.02
+        assert stats["rss_max_mb"] > 0
+        assert stats["latency"]["le_50ms"] == 1
+        assert stats["latency"]["le_1ms"] == 1
+        assert sum(stats["latency"].values()) == 2
+        # no dots in keys, stored in mongo documents
+        assert not any("." in key for key in stats["latency"])
+
+    def test_1302_timed(self):
+        instrumentation = Instrumentation()
+        batches = list(instrumentation.timed("read", iter([[1, 2], [3]])))
+        assert batches == [[1, 2], [3]]
+        assert instrumentation.stage("read").docs == 3
+        assert instrumentation.stage("read").batches == 2
+        # pickled with uploaders, sent to worker processes
+        copy = pickle.loads(pickle.dumps(instrumentation))
+        assert copy.to_dict() == instrumentation.to_dict()
+        copy.stage("read").add(1.0, 0.5, 1)
+        assert copy.stage("read").docs == 4
+        with pytest.raises(ValueError):
+            instrumentation.stage("map.lineage")
+
+    def test_1303_postmerge(self, monkeypatch):
+        docs = [{"_id": str(i), "name": "taxon %d" % i} for i in range(25)]
+
+        def doc_feeder(collection, step, inbatch, fields):
+            for start in range(0, len(docs), step):
+                yield [dict(doc) for doc in docs[start:start + step]]
+
+        monkeypatch.setattr(postmerge, "doc_feeder", doc_feeder)
+        collection = Collection()
+        pipeline = postmerge.PostMergePipeline(
+            collection, [UpperMapper("first"), UpperMapper("second")],
+            read_fields=["name"], write_fields=["first", "second"], batch_size=10)
+        timings = pipeline.run()
+        assert len(collection.ops) == 25
+        stages = pipeline.instrumentation.to_dict()
+        assert set(stages) == {"read", "map_first", "map_second", "write"}
+        # stored as MongoDB keys
+        assert not any("." in name for name in stages)
+        assert all(stage["docs"] == 25 for stage in stages.values())
+        assert stages["read"]["batches"] == 3
+        assert set(timings) == set(stages) | {"total"}
+
+    def test_1304_uploader(self):
+        uploader = type("TestUploader", (InstrumentedUploader, Uploader), {})()
+        asyncio.run(uploader.update_data(100, JobManager()))
+        stage = uploader.instrumentation.to_dict()["update_data"]
+        assert stage["docs"] == 25
+        assert stage["batches"] == 1
@@ -0,0 +1,44 @@
+import time
+
+from web.metrics import DEFAULT_LABELS, REQUEST_LABELS, Metrics, RequestTimer, METRICS, observe_es
+
+
+class TestMetrics:
+
+    def test_1401_render(self):
+        metrics = Metrics()
+        labels = ('query', 'true', 'false', 'false', 'false')
+        for value in (0.0005, 0.003, 0.003, 20):
+            metrics.observe('mytaxon_es_seconds', value, labels)
+        text = metrics.render()
+        assert '# TYPE mytaxon_es_seconds histogram' in text
+        prefix = ('mytaxon_es_seconds_bucket{endpoint="query",include_children="true",'
+                  'has_gene="false",expand_species="false",raw="false",')
+        # cumulative counts
+        assert prefix + 'le="0.001"} 1\n' in text
+        assert prefix + 'le="0.005"} 3\n' in text
+        assert prefix + 'le="10.0"} 3\n' in text
+        assert prefix + 'le="+Inf"} 4\n' in text
+        assert 'mytaxon_es_seconds_count{endpoint="query",' in text
+        metrics.clear()
+        assert 'mytaxon_es_seconds_bucket' not in metrics.render()
+
+    def test_1402_request_labels(self):
+        METRICS.clear()
+        with RequestTimer('annotation', {'include_children': True, 'raw': 0}):
+            # fetch calling search: accounted once, as annotation
+            with RequestTimer('query', {}):
+                start = time.perf_counter()
+                observe_es(start, {'took': 12})
+        observe_es(time.perf_counter())
+        assert REQUEST_LABELS.get() is None
+        labels = ('annotation', 'true', 'false', 'false', 'false')
+        requests = METRICS.histograms['mytaxon_request_seconds']
+        assert list(requests) == [labels]
+        assert requests[labels].count == 1
+        took = METRICS.histograms['mytaxon_es_took_seconds'][labels]
+        assert took.count == 1 and took.sum == 0.012
+        # outside of a request, and no took time (mget)
+        es = METRICS.histograms['mytaxon_es_seconds']
+        assert es[labels].count == 1 and es[DEFAULT_LABELS].count == 1
+        assert DEFAULT_LABELS not in METRICS.histograms['mytaxon_es_took_seconds']
@@ -0,0 +1,207 @@
+import asyncio
+
+import pytest
+from biothings.utils.common import dotdict
+from biothings.web.query.pipeline import AsyncESQueryPipeline, QueryPipelineException
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch.exceptions import ConnectionError, NotFoundError
+
+from web.pipeline import (MytaxonQueryBackend, MytaxonQueryBuilder, MytaxonQueryPipeline,
+                          MytaxonTransform)
+
+DOCS = {
+    "9606": {"taxid": 9606, "scientific_name": "homo sapiens", "rank": "species",
+             "children": [63221, 741158], "_has_gene_children": [63221]},
+    "10090": {"taxid": 10090, "scientific_name": "mus musculus", "rank": "species",
+              "children": [], "_has_gene_children": []},
+}
+
+
+def source_filter(source, excludes):
+    return {key: value for key, value in source.items() if key not in excludes}
+
+
+class Indices:
+
+    def __init__(self):
+        self.aliases = {"mytaxon": ["mytaxon_20211017"]}
+        self.error = None
+
+    async def get_alias(self, name):
+        if self.error is not None:
+            raise self.error
+        return {index: {"aliases": {name: {}}} for index in self.aliases[name]}
+
+
+class Client:
+    """ES client answering mget and msearch from DOCS, and subtree searches"""
+
+    def __init__(self):
+        self.mget_calls = []
+        self.gate = None
+        self.error = None
+        self.indices = Indices()
+
+    async def mget(self, body, index, _source_excludes="", _source_includes=None):
+        self.mget_calls.append(list(body["ids"]))
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        excludes = _source_excludes.split(",")
+        return {"docs": [
+            {"_index": index, "_id": _id, "_version": 1, "_seq_no": 0, "found": True,
+             "_source": source_filter(DOCS[_id], excludes)}
+            if _id in DOCS else {"_index": index, "_id": _id, "found": False}
+            for _id in body["ids"]]}
+
+    async def search(self, index, body):
+        # subtree queries on a chain of taxids 1 > 2 > ... > 10, dfs_in = taxid
+        bounds = body["query"]["bool"]["filter"][0]["range"]["dfs_in"]
+        after = body.get("search_after", [bounds["gte"] - 1])[0]
+        dfs_in = range(max(bounds["gte"], after + 1), bounds["lte"] + 1)[:body["size"]]
+        hits = [{"_index": index, "_id": str(taxid), "sort": [taxid]} for taxid in dfs_in]
+        return {"took": 1, "hits": {"hits": hits}}
+
+    async def msearch(self, body, index):
+        responses = []
+        for query in body[1::2]:
+            _id = query["query"]["multi_match"]["query"]
+            _source = query.get("_source", {})
+            excludes = _source.get("exclude") or _source.get("excludes") or []
+            hits = [{"_index": index, "_id": _id, "_version": 1, "_score": 3.2,
+                     "_source": source_filter(DOCS[_id], excludes)}] if _id in DOCS else []
+            responses.append({"took": 1, "timed_out": False,
+                              "hits": {"total": len(hits), "max_score": 3.2 if hits else None,
+                                       "hits": hits}})
+        return {"responses": responses}
+
+
+@pytest.fixture
+def pipeline():
+    return MytaxonQueryPipeline(MytaxonQueryBuilder(),
+                                MytaxonQueryBackend(Client(), {None: "mytaxon"}),
+                                MytaxonTransform())
+
+
+class TestMget:
+
+    @pytest.mark.parametrize("options", [{}, {"include_children": True},
+                                         {"include_children": True, "has_gene": True}])
+    def test_1501_same_as_msearch(self, pipeline, options):
+        ids = ["9606", "1", "10090", "9606"]
+
+        async def fetch():
+            old = await AsyncESQueryPipeline.fetch(pipeline, list(ids), **options)
+            new = await pipeline.fetch(list(ids), **options)
+            return old, new
+
+        old, new = asyncio.run(fetch())
+        assert new == old
+        assert new[0]["_version"] == 1 and "_score" not in new[0]
+        assert new[1] == {"query": "1", "notfound": True}
+        assert pipeline.backend.client.mget_calls == [["9606", "1", "10090"]]
+
+    def test_1502_coalescing(self, pipeline):
+        client = pipeline.backend.client
+
+        async def fetch():
+            client.gate = asyncio.Event()
+            first = asyncio.ensure_future(pipeline.mget(["9606", "10090"]))
+            second = asyncio.ensure_future(pipeline.mget(["10090"]))
+            await asyncio.sleep(0)
+            client.gate.set()
+            return await first, await second
+
+        first, second = asyncio.run(fetch())
+        assert [hit["_id"] for hit in first] == ["9606", "10090"]
+        assert second[0]["_id"] == "10090"
+        assert client.mget_calls == [["9606", "10090"]]
+        assert not pipeline.inflight
+
+    def test_1503_cancellation(self, pipeline):
+        client = pipeline.backend.client
+
+        async def fetch():
+            client.gate = asyncio.Event()
+            owner = asyncio.ensure_future(pipeline.mget(["9606"]))
+            waiting = asyncio.ensure_future(pipeline.mget(["9606"]))
+            await asyncio.sleep(0)
+            # eg. client of the request owning the chunk disconnected
+            owner.cancel()
+            await asyncio.sleep(0)
+            client.gate.set()
+            return owner, await waiting
+
+        owner, waiting = asyncio.run(fetch())
+        assert owner.cancelled()
+        assert waiting[0]["taxid"] == 9606
+        assert client.mget_calls == [["9606"]]
+
+    def test_1504_errors(self, pipeline):
+        pipeline.backend.client.error = ConnectionError("Connection refused")
+        with pytest.raises(QueryPipelineException) as exc:
+            asyncio.run(pipeline.fetch(["9606", "10090"]))
+        assert exc.value.code == 503
+        assert not pipeline.inflight
+
+
+class TestCacheVersion:
+
+    def check(self, pipeline):
+        pipeline.cache_checked = 0
+        asyncio.run(pipeline.check_cache_version({}))
+        return pipeline.cache.version
+
+    def test_1507_cache_version(self, pipeline):
+        indices = pipeline.backend.client.indices
+        assert self.check(pipeline) == "mytaxon_20211017"
+        pipeline.cache.set("9606", {"taxid": 9606})
+        # kept while ES can't be reached
+        indices.error = ConnectionError("Connection refused")
+        assert self.check(pipeline) == "mytaxon_20211017"
+        assert pipeline.cache.get("9606") == {"taxid": 9606}
+        # not an alias
+        indices.error = NotFoundError("index_not_found_exception", ApiResponseMeta(
+            404, "1.1", HttpHeaders(), 0.01, NodeConfig("http", "localhost", 9200)), {})
+        assert self.check(pipeline) == "mytaxon"
+        assert pipeline.cache.get("9606") is None
+
+
+class TestExpand:
+
+    def expand(self, pipeline, taxid):
+        hit = {"_id": str(taxid), "dfs_in": taxid, "dfs_out": 10, "depth": taxid - 1}
+        return asyncio.run(pipeline.expand_subtrees([hit], expand_all=True))
+
+    def test_1505_max_size(self, pipeline):
+        pipeline.EXPAND_PAGE_SIZE = 2
+        pipeline.EXPAND_MAX_SIZE = 5
+        assert sorted(self.expand(pipeline, 6)) == [6, 7, 8, 9, 10]
+        with pytest.raises(QueryPipelineException) as exc:
+            self.expand(pipeline, 5)
+        assert exc.value.code == 400
+        # exactly one page of at most the max size
+        pipeline.EXPAND_PAGE_SIZE = 10
+        assert sorted(self.expand(pipeline, 6)) == [6, 7, 8, 9, 10]
+        with pytest.raises(QueryPipelineException):
+            self.expand(pipeline, 1)
+
+
+class TestQueryBuilder:
+
+    def test_1506_ancestors_scope(self):
+        builder = MytaxonQueryBuilder()
+        ancestors = {"bool": {
+            "filter": [{"match": {"lineage": {"query": "9606", "lenient": True}}}],
+            "must_not": [{"match": {"taxid": {"query": "9606", "lenient": True}}}]}}
+        for scopes in ("ancestors", ["ancestors"]):
+            query = builder.default_match_query("9606", scopes, dotdict())
+            assert query.to_dict()["query"] == ancestors
+        query = builder.default_match_query("9606", ["scientific_name", "ancestors"], dotdict())
+        assert query.to_dict()["query"] == {"bool": {"minimum_should_match": 1, "should": [
+            ancestors,
+            {"multi_match": {"query": "9606", "fields": ["scientific_name"],
+                             "operator": "AND", "lenient": True}}]}}
+        query = builder.default_match_query("9606", ["taxid"], dotdict())
+        assert "multi_match" in query.to_dict()["query"]
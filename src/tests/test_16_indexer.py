@@ -0,0 +1,104 @@
+import asyncio
+
+import biothings.hub.dataindex.indexer
+import pytest
+
+import hub.dataindex.indexer
+from hub.dataindex.indexer import TaxonomyIndexer
+
+
+class Indices:
+
+    def __init__(self, indices):
+        self.indices = indices
+
+    async def exists(self, index):
+        return index in self.indices
+
+    async def delete(self, index, **kwargs):
+        self.indices.pop(index, None)
+
+    async def create(self, index, body):
+        self.indices[index] = dict(body["settings"]["index"])
+
+    async def put_settings(self, body, index):
+        self.indices[index].update(body["index"])
+
+    async def refresh(self, index):
+        pass
+
+
+class Client:
+    """ES client keeping index settings in a dict shared by its instances"""
+    indices = {}
+
+    def __init__(self, **kwargs):
+        self.indices = Indices(Client.indices)
+
+    async def info(self):
+        return {"version": {"number": "8.19.0"}}
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def es(monkeypatch):
+    Client.indices = {}
+    monkeypatch.setattr(biothings.hub.dataindex.indexer, "AsyncElasticsearch", Client)
+    monkeypatch.setattr(hub.dataindex.indexer, "AsyncElasticsearch", Client)
+    monkeypatch.setattr(hub.dataindex.indexer.config, "INDEX_PARALLEL_BULK", True)
+    return Client.indices
+
+
+def run(build_config, mode):
+    indexer = TaxonomyIndexer({"_id": "mytaxon_test", "build_config": build_config},
+                              {"args": {}}, "mytaxon_test")
+
+    async def index():
+        await indexer.pre_index(mode=mode)
+        loading = dict(Client.indices["mytaxon_test"])
+        await indexer.post_index(mode=mode)
+        return loading
+
+    return asyncio.run(index())
+
+
+class TestIndexSettings:
+
+    def test_1601_defaults(self, es):
+        loading = run({}, "index")
+        assert loading["refresh_interval"] == "-1"
+        assert loading["number_of_replicas"] == 0
+        # reset to ES defaults once loaded
+        assert es["mytaxon_test"]["refresh_interval"] is None
+        assert es["mytaxon_test"]["number_of_replicas"] is None
+
+    def test_1602_configured(self, es):
+        run({"num_replicas": 1}, "purge")
+        assert es["mytaxon_test"]["number_of_replicas"] == 1
+        run({"num_replicas": 1, "extra_index_settings": {"number_of_replicas": 2,
+                                                          "refresh_interval": "30s"}}, "purge")
+        assert es["mytaxon_test"]["number_of_replicas"] == 2
+        assert es["mytaxon_test"]["refresh_interval"] == "30s"
+
+    @pytest.mark.parametrize("mode", ["merge", "resume"])
+    def test_1603_existing_index(self, es, mode):
+        es["mytaxon_test"] = {"number_of_replicas": 1, "refresh_interval": "5s"}
+        run({}, mode)
+        assert es["mytaxon_test"] == {"number_of_replicas": 1, "refresh_interval": "5s"}
+
+
+class TestIndexProfile:
+
+    @pytest.mark.parametrize("parallel_bulk", [True, False])
+    def test_1604_dropped_fields(self, monkeypatch, parallel_bulk):
+        monkeypatch.setattr(hub.dataindex.indexer.config, "INDEX_PROFILE", "compact")
+        monkeypatch.setattr(hub.dataindex.indexer.config, "INDEX_PARALLEL_BULK", parallel_bulk)
+        indexer = TaxonomyIndexer({"_id": "mytaxon_test"}, {"args": {}}, "mytaxon_test")
+        # not stored whatever the indexing path
+        assert indexer.es_index_mappings["_source"] == {"excludes": ["ancestors"]}
+        assert "ancestors" not in indexer.es_index_mappings["properties"]
+        monkeypatch.setattr(hub.dataindex.indexer.config, "INDEX_PROFILE", "full")
+        indexer = TaxonomyIndexer({"_id": "mytaxon_test"}, {"args": {}}, "mytaxon_test")
+        assert "_source" not in indexer.es_index_mappings
@@ -0,0 +1,147 @@
+import os
+import tempfile
+
+from biothings.tests.web import BiothingsWebAppTest
+from biothings.web.settings import configs
+
+from taxonomy.names import NamesIndex
+from taxonomy.tree import TaxonomyTree
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config_web.py")
+# taxid, parent taxid, rank
+NODES = [
+    (1, 1, "no rank"),
+    (2, 1, "superkingdom"),
+    (562, 2, "species"),
+    (9606, 2, "species"),
+    (10090, 2, "species"),
+]
+HAS_GENE = [562, 10090]
+DOCS = [
+    {"taxid": 9606, "rank": "species", "scientific_name": "Homo sapiens", "genbank_common_name": "human"},
+    {"taxid": 10090, "rank": "species", "scientific_name": "Mus musculus", "common_name": "house mouse"},
+]
+
+
+def write_snapshot(folder):
+    tree = TaxonomyTree.from_nodes(NODES)
+    tree.set_has_gene(HAS_GENE)
+    path = os.path.join(folder, "tree.snapshot")
+    tree.save_snapshot(path)
+    return path
+
+
+def write_names_index(folder):
+    path = os.path.join(folder, "names.index")
+    NamesIndex.from_docs(DOCS).save(path)
+    return path
+
+
+class Client:
+    """ES client answering taxid lookups from NODES"""
+
+    async def search(self, index, query, **kwargs):
+        taxid = int(query["multi_match"]["query"])
+        tree = TaxonomyTree.from_nodes(NODES)
+        tree.set_has_gene(HAS_GENE)
+        hits = [{"_index": index, "_id": str(taxid), "_version": 1, "_source": {
+            "taxid": taxid, "children": tree.children(taxid),
+            "_has_gene_children": tree.has_gene_children(taxid)}}] if taxid in tree else []
+        return {"took": 1, "timed_out": False, "hits": {"total": len(hits), "max_score": None, "hits": hits}}
+
+
+class HandlersTest(BiothingsWebAppTest):
+    """App from config_web.py, with settings overridden by SETTINGS"""
+
+    SETTINGS = {}
+
+    @property
+    def config(self):
+        if not hasattr(self, "_config"):
+            self._config = configs.load(CONFIG_FILE)
+            for name, value in self.SETTINGS.items():
+                setattr(self._config, name, value)
+        return self._config
+
+
+class TestTree(HandlersTest):
+    SETTINGS = {"TAXONOMY_SNAPSHOT": write_snapshot(tempfile.mkdtemp())}
+
+    def test_1701_lca(self):
+        res = self.request("tree/lca", params={"pairs": "562:9606,9606:10090,1:9606,562:3"}).json()
+        assert res == [{"query": "562:9606", "lca": 2}, {"query": "9606:10090", "lca": 2},
+                       {"query": "1:9606", "lca": 1}, {"query": "562:3", "notfound": True}]
+        res = self.request("tree/lca", method="POST", json={"pairs": [[562, 562]]}).json()
+        assert res == [{"query": [562, 562], "lca": 562}]
+        assert self.request("tree/lca", params={"ids": "562,9606,10090"}).json() == {
+            "query": ["562", "9606", "10090"], "lca": 2}
+        self.request("tree/lca", params={"ids": "562,3"}, expect=404)
+        self.request("tree/lca", params={"pairs": "562"}, expect=400)
+        self.request("tree/lca", expect=400)
+
+    def test_1702_descendant(self):
+        res = self.request("tree/descendant", params={"pairs": "562:2,2:562,562:562,9606:10090"}).json()
+        assert [hit["descendant"] for hit in res] == [True, False, True, False]
+
+    def test_1703_path(self):
+        res = self.request("tree/path", params={"pairs": "562:9606,562:1,1:562"}).json()
+        assert [hit["path"] for hit in res] == [[562, 2, 9606], [562, 2, 1], [1, 2, 562]]
+
+    def test_1704_name(self):
+        # not configured in this app
+        self.request("name", params={"q": "human"}, expect=503)
+
+
+class TestName(HandlersTest):
+    SETTINGS = {"TAXONOMY_NAMES_INDEX": write_names_index(tempfile.mkdtemp())}
+
+    def test_1705_name(self):
+        res = self.request("name", method="POST", json={"q": ["HUMAN", "h. sapiens", "nothing"]}).json()
+        assert res == [
+            {"query": "HUMAN", "hits": [{"taxid": 9606, "name": "human", "field": "genbank_common_name"}]},
+            {"query": "h. sapiens", "hits": [{"taxid": 9606, "name": "H. sapiens", "field": "abbreviation"}]},
+            {"query": "nothing", "notfound": True}]
+        res = self.request("name", params={"q": "HUMAN", "case_sensitive": True}).json()
+        assert res == [{"query": "HUMAN", "notfound": True}]
+        res = self.request("name", params={"q": "mus", "prefix": True, "size": 1}).json()
+        assert [hit["name"] for hit in res[0]["hits"]] == ["Mus musculus"]
+        self.request("name", expect=400)
+        # not configured in this app
+        self.request("tree/lca", params={"pairs": "1:2"}, expect=503)
+
+
+class TestChildren(HandlersTest):
+    SETTINGS = {"TAXONOMY_SNAPSHOT": write_snapshot(tempfile.mkdtemp())}
+
+    def test_1706_children(self):
+        res = self.request("children/2").json()
+        assert res == {"taxid": 2, "children": [562, 9606, 10090], "children_count": 3}
+        res = self.request("children/2", params={"has_gene": 1}).json()
+        assert res == {"taxid": 2, "children": [562, 10090], "children_count": 2}
+        res = self.request("children/2", params={"has_gene": 1, "children_from": 1}).json()
+        assert res == {"taxid": 2, "children": [10090], "children_count": 2}
+        res = self.request("children/2", params={"children_from": 1, "children_size": 1}).json()
+        assert res == {"taxid": 2, "children": [9606], "children_count": 3}
+        assert self.request("children/9606").json()["children"] == []
+        self.request("children/3", expect=404)
+        self.request("children/2", params={"children_from": -1}, expect=400)
+
+    def test_1707_empty_page(self):
+        res = self.request("children/1", params={"children_size": 0}).json()
+        assert res == {"taxid": 1, "children": [], "children_count": 1}
+
+
+class TestChildrenES(HandlersTest):
+    SETTINGS = {"TAXONOMY_SNAPSHOT": None}
+
+    def get_app(self):
+        app = super().get_app()
+        app.biothings.pipeline.backend.client = Client()
+        return app
+
+    def test_1708_children(self):
+        res = self.request("children/2", params={"has_gene": 1, "children_from": 1}).json()
+        assert res == {"taxid": 2, "children": [10090], "children_count": 2}
+        res = self.request("children/2").json()
+        assert res == {"taxid": 2, "children": [562, 9606, 10090], "children_count": 3}
+        self.request("children/3", expect=404)
@@ -0,0 +1,236 @@
+import random
+
+import pytest
+
+from taxonomy.intervals import SPACING, read_intervals, update_intervals
+from taxonomy.tree import TaxidBitmap, TaxonomyTree
+
+#         1
+#        / \
+#       2   10
+#      / \    \
+#     3   4    11
+#     |
+#     5
+NODES = [
+    (1, 1, "no rank"),
+    (2, 1, "superkingdom"),
+    (3, 2, "genus"),
+    (4, 2, "genus"),
+    (5, 3, "species"),
+    (10, 1, "superkingdom"),
+    (11, 10, "species"),
+]
+
+
+@pytest.fixture
+def tree():
+    tree = TaxonomyTree.from_nodes(NODES)
+    tree.set_has_gene([4, 5, 11, 12345])
+    return tree
+
+
+class TestTaxonomyTree:
+
+    def test_401_lookup(self, tree):
+        assert len(tree) == 7
+        assert 5 in tree
+        assert 6 not in tree
+        assert 12345 not in tree
+        assert tree.parent_taxid(5) == 3
+        assert tree.parent_taxid(1) == 1
+        assert tree.rank(11) == "species"
+        with pytest.raises(KeyError):
+            tree.index_of(6)
+
+    def test_402_lineage(self, tree):
+        assert tree.lineage(1) == [1]
+        assert tree.lineage(5) == [5, 3, 2, 1]
+        assert tree.lineage(11) == [11, 10, 1]
+
+    def test_403_children(self, tree):
+        assert tree.children(1) == [2, 10]
+        assert tree.children(2) == [3, 4]
+        assert tree.children(5) == []
+        assert sorted(tree.descendants(2)) == [3, 4, 5]
+        assert sorted(tree.descendants(1)) == [2, 3, 4, 5, 10, 11]
+
+    def test_404_has_gene(self, tree):
+        assert tree.has_gene(5)
+        assert not tree.has_gene(3)
+        assert tree.has_gene_children(2) == [4]
+        assert tree.has_gene_children(1) == []
+        assert list(tree.iter_children(2)) == [3, 4]
+        assert list(tree.iter_children(2, has_gene=True)) == [4]
+        assert tree.children_count(1) == 2
+        assert tree.children_count(5) == 0
+
+    def test_405_missing_parent(self):
+        with pytest.raises(ValueError):
+            TaxonomyTree.from_nodes([(1, 1, "no rank"), (2, 7, "genus")])
+
+    def test_406_bitmap(self):
+        bitmap = TaxidBitmap([9606, 1, 9606, 2697049])
+        assert len(bitmap) == 3
+        assert 9606 in bitmap
+        assert 2697049 in bitmap
+        assert 10090 not in bitmap
+        assert 99999999 not in bitmap
+        assert list(bitmap) == [1, 9606, 2697049]
+
+    def test_407_compute_lineages(self, tree):
+        walked = {taxid: tree.lineage(taxid) for taxid, _, _ in NODES}
+        tree.compute_lineages()
+        for taxid, _, _ in NODES:
+            assert tree.lineage(taxid) == walked[taxid]
+            assert tree.depth(taxid) == len(walked[taxid]) - 1
+        assert list(tree.bfs_order()) == [0, 1, 5, 2, 3, 6, 4]
+
+    def test_408_dfs_intervals(self, tree):
+        tree.compute_dfs_intervals()
+        assert tree.dfs_interval(1) == (0, 6)
+        assert tree.dfs_interval(2) == (1, 4)
+        assert tree.dfs_interval(3) == (2, 3)
+        assert tree.dfs_interval(5) == (3, 3)
+        assert tree.dfs_interval(11) == (6, 6)
+        assert tree.subtree(2) == [2, 3, 5, 4]
+        assert tree.subtree(1) == [1, 2, 3, 5, 4, 10, 11]
+        assert tree.is_ancestor(2, 5)
+        assert tree.is_ancestor(5, 5)
+        assert not tree.is_ancestor(5, 2)
+        assert not tree.is_ancestor(10, 4)
+
+    def test_409_snapshot(self, tree, tmp_path):
+        tree.compute_dfs_intervals()
+        path = str(tmp_path / "tree.snapshot")
+        tree.save_snapshot(path, {"nodes": 7})
+        snapshot = TaxonomyTree.open_snapshot(path)
+        assert snapshot.metadata == {"nodes": 7}
+        assert len(snapshot) == 7
+        assert 12345 not in snapshot
+        assert snapshot.rank(11) == "species"
+        assert snapshot.lineage(5) == [5, 3, 2, 1]
+        assert snapshot.children(1) == [2, 10]
+        assert snapshot.has_gene_children(2) == [4]
+        assert snapshot.subtree(2) == [2, 3, 5, 4]
+        assert list(snapshot.has_gene_taxids()) == [4, 5, 11]
+        # arrays can still be computed on a snapshot
+        snapshot.compute_lineages()
+        assert snapshot.lineage(11) == [11, 10, 1]
+        snapshot.set_has_gene([3])
+        assert snapshot.has_gene(3)
+        with open(path, "r+b") as fileh:
+            fileh.write(b"NOTATREE")
+        with pytest.raises(ValueError):
+            TaxonomyTree.open_snapshot(path)
+
+    def test_410_lca_and_path(self, tree):
+        assert tree.lca([5, 4]) == 2
+        assert tree.lca([5, 3]) == 3
+        assert tree.lca([5]) == 5
+        assert tree.lca([5, 4, 11]) == 1
+        assert tree.path(5, 4) == [5, 3, 2, 4]
+        assert tree.path(5, 11) == [5, 3, 2, 1, 10, 11]
+        assert tree.path(2, 5) == [2, 3, 5]
+        assert tree.path(4, 4) == [4]
+        forest = TaxonomyTree.from_nodes([(1, 1, "no rank"), (2, 2, "no rank"), (3, 1, "genus")])
+        assert forest.lca([3, 2]) is None
+        assert forest.path(3, 2) is None
+        with pytest.raises(KeyError):
+            tree.lca([5, 6])
+
+    def test_411_nodes_order(self, tree):
+        # full builds read nodes from an unordered Mongo scan, incremental
+        # builds from nodes.dmp: both must number the tree the same way
+        shuffled = TaxonomyTree.from_nodes(NODES[::-1])
+        tree.compute_dfs_intervals()
+        shuffled.compute_dfs_intervals()
+        for taxid, _, _ in NODES:
+            assert shuffled.children(taxid) == tree.children(taxid)
+            assert shuffled.dfs_interval(taxid) == tree.dfs_interval(taxid)
+        forest = TaxonomyTree.from_nodes([(3, 3, "no rank"), (2, 2, "no rank"), (1, 3, "genus")])
+        forest.compute_dfs_intervals()
+        assert forest.dfs_interval(2) == (0, 0)
+        assert forest.dfs_interval(3) == (1, 2)
+
+
+def check_intervals(tree):
+    """Intervals stored in docs nest exactly like subtrees"""
+    index_in, index_out = tree.index_intervals()
+    tree.compute_dfs_intervals()
+    for node in range(len(tree.taxids)):
+        assert 0 <= index_in[node] <= index_out[node]
+        for other in range(len(tree.taxids)):
+            nested = index_in[node] <= index_in[other] <= index_out[node]
+            assert nested == tree.is_ancestor(tree.taxids[node], tree.taxids[other])
+
+
+def release(old_tree, nodes, moved=()):
+    """New release tree, with intervals carried over from old_tree, and changed taxids"""
+    tree = TaxonomyTree.from_nodes(nodes)
+    tree.compute_dfs_intervals()
+    docs = [dict(zip(("taxid", "dfs_in", "dfs_out"), (taxid,) + old_tree.index_interval(taxid)))
+            for taxid in old_tree.taxids]
+    index_in, index_out = read_intervals(tree, docs)
+    changed = update_intervals(tree, index_in, index_out, moved)
+    tree.set_index_intervals(index_in, index_out)
+    return tree, set(tree.taxids[idx] for idx in changed)
+
+
+class TestIntervals:
+
+    def test_412_spaced(self, tree):
+        assert tree.index_interval(1) == (0, 7 * SPACING - 1)
+        assert tree.index_interval(3) == (2 * SPACING, 4 * SPACING - 1)
+        assert tree.index_interval(5) == (3 * SPACING, 4 * SPACING - 1)
+        check_intervals(tree)
+
+    def test_413_add_and_move(self, tree):
+        # leaf added under a leaf, and under a node with children
+        new, changed = release(tree, NODES + [(6, 5, "no rank"), (7, 2, "genus")])
+        assert changed == {6, 7}
+        assert new.index_interval(5) == tree.index_interval(5)
+        check_intervals(new)
+        # 3 (and 5) moved under 10, 4 removed
+        nodes = [node for node in NODES if node[0] not in (3, 4)] + [(3, 10, "genus")]
+        new, changed = release(tree, nodes, moved=[3])
+        assert changed == {3, 5}
+        check_intervals(new)
+
+    def test_414_local_renumber(self):
+        # full chain 1 > 2 > ... > 50, then children keep being added under 50
+        nodes = [(1, 1, "no rank")] + [(taxid, taxid - 1, "no rank") for taxid in range(2, 51)]
+        tree = TaxonomyTree.from_nodes(nodes)
+        renumbered = set()
+        for taxid in range(51, 251):
+            nodes.append((taxid, 50, "species"))
+            tree, changed = release(tree, nodes)
+            # the new node, and nodes of renumbered subtrees
+            renumbered |= changed - {taxid}
+        check_intervals(tree)
+        # only the lower part of the chain ran out of room, the root never moved
+        assert renumbered and 1 not in renumbered
+        assert tree.index_interval(1) == (0, 50 * SPACING - 1)
+
+    def test_415_random_releases(self):
+        rand = random.Random(42)
+        nodes = {1: (1, 1, "no rank")}
+        for taxid in range(2, 80):
+            nodes[taxid] = (taxid, rand.randrange(1, taxid), "no rank")
+        tree = TaxonomyTree.from_nodes(nodes.values())
+        next_taxid = 80
+        for _ in range(20):
+            moved = []
+            for _ in range(rand.randrange(1, 6)):
+                nodes[next_taxid] = (next_taxid, rand.choice(list(nodes)), "no rank")
+                next_taxid += 1
+            # re-parent a subtree under a node outside of it
+            taxid = rand.choice(list(nodes)[1:])
+            current = TaxonomyTree.from_nodes(nodes.values())
+            current.compute_dfs_intervals()
+            subtree = set(current.subtree(taxid))
+            parent = rand.choice([other for other in nodes if other not in subtree])
+            nodes[taxid] = (taxid, parent, "no rank")
+            moved.append(taxid)
+            tree, changed = release(tree, nodes.values(), moved)
+            check_intervals(tree)
@@ -0,0 +1,91 @@
+import gzip
+import io
+
+from hub.dataload.sources.geneinfo import parser as geneinfo_parser
+from hub.dataload.sources.taxonomy import parser
+
+NAMES_DMP = (
+    "1\t|\tall\t|\t\t|\tsynonym\t|\n"
+    "1\t|\troot\t|\t\t|\tscientific name\t|\n"
+    "9606\t|\tHomo sapiens Linnaeus, 1758\t|\t\t|\tauthority\t|\n"
+    "9606\t|\tHomo sapiens\t|\t\t|\tscientific name\t|\n"
+    "9606\t|\thuman\t|\t\t|\tgenbank common name\t|\n"
+    "9606\t|\tman\t|\t\t|\tcommon name\t|\n"
+    "9606\t|\thuman being\t|\t\t|\tcommon name\t|\n"
+    "9606\t|\tHomo sapiens sapiens\t|\t\t|\tequivalent name\t|\n"
+)
+NODES_DMP = (
+    "1\t|\t1\t|\tno rank\t|\t\t|\t8\t|\t0\t|\t1\t|\t0\t|\t0\t|\t0\t|\t0\t|\t0\t|\t\t|\n"
+    "9606\t|\t9605\t|\tspecies\t|\tHS\t|\t5\t|\t1\t|\t1\t|\t1\t|\t2\t|\t1\t|\t1\t|\t0\t|\t\t|\n"
+)
+
+GENE_INFO = (
+    "#tax_id\tGeneID\tSymbol\n"
+    "7\t5692769\tNEWENTRY\n"
+    "9\t1246500\trepA1\n"
+    "9\t1246501\trepA2\n"
+    "9606\t1\tA1BG\n"
+    "9606\t2\tA2M\n"
+)
+
+
+class TestTaxonomyParser:
+
+    def test_501_names_fast(self):
+        expected = list(parser.parse_refseq_names(io.StringIO(NAMES_DMP)))
+        # tiny chunks to split lines across chunk boundaries
+        for chunk_size in (7, 64, parser.CHUNK_SIZE):
+            docs = list(parser.parse_refseq_names_fast(
+                io.BytesIO(NAMES_DMP.encode()), chunk_size))
+            assert docs == expected
+        assert docs[1]["common_name"] == ["man", "human being"]
+        assert docs[1]["genbank_common_name"] == "human"
+        assert docs[1]["other_names"] == ["Homo sapiens sapiens"]
+        assert docs[1]["authority"] == ["Homo sapiens Linnaeus, 1758"]
+
+    def test_502_names_records(self):
+        records = list(parser.iter_names_records(io.BytesIO(NAMES_DMP.encode())))
+        assert records[0] == (1, "other_names", "all")
+        assert records[3] == (9606, "scientific_name", "Homo sapiens")
+
+    def test_503_nodes_fast(self):
+        expected = list(parser.parse_refseq_nodes(io.StringIO(NODES_DMP)))
+        for chunk_size in (5, parser.CHUNK_SIZE):
+            docs = list(parser.parse_refseq_nodes_fast(
+                io.BytesIO(NODES_DMP.encode()), chunk_size))
+            assert docs == expected
+        records = list(parser.iter_nodes_records(io.BytesIO(NODES_DMP.encode())))
+        assert records == [(1, 1, "no rank"), (9606, 9605, "species")]
+
+    def test_504_split_dmp_file(self, tmp_path):
+        names_file = tmp_path / "names.dmp"
+        names_file.write_text(NAMES_DMP)
+        expected = list(parser.parse_refseq_names(io.StringIO(NAMES_DMP)))
+        for chunk_size, min_chunks in ((1, 1), (0, 3), (0, 1)):
+            chunks = parser.split_dmp_file(str(names_file), chunk_size, min_chunks, group_taxids=True)
+            # taxid groups are never split
+            assert len(chunks) <= 2
+            docs = [doc for start, end in chunks
+                    for doc in parser.parse_refseq_names_fast(parser.DmpSlice(str(names_file), start, end))]
+            assert docs == expected
+        nodes_file = tmp_path / "nodes.dmp"
+        nodes_file.write_text(NODES_DMP)
+        assert len(parser.split_dmp_file(str(nodes_file), 1)) == 2
+
+    def test_505_geneinfo_gz(self):
+        expected = {doc["_id"] for doc in geneinfo_parser.parse_geneinfo_taxid(io.StringIO(GENE_INFO))}
+        # two gzip members, as written by some tools
+        gz_data = gzip.compress(GENE_INFO[:50].encode()) + gzip.compress(GENE_INFO[50:].encode())
+        for chunk_size in (3, geneinfo_parser.CHUNK_SIZE):
+            docs = list(geneinfo_parser.parse_geneinfo_taxid_gz(io.BytesIO(gz_data), chunk_size))
+            assert docs == [{"_id": "7"}, {"_id": "9"}, {"_id": "9606"}]
+            assert {doc["_id"] for doc in docs} == expected
+
+    def test_506_blank_lines(self):
+        names = list(parser.parse_refseq_names(io.StringIO(NAMES_DMP)))
+        nodes = list(parser.parse_refseq_nodes(io.StringIO(NODES_DMP)))
+        for chunk_size in (7, parser.CHUNK_SIZE):
+            names_dmp = ("\n" + NAMES_DMP.replace("\n", "\n\r\n", 3) + "\n  \n").encode()
+            assert list(parser.parse_refseq_names_fast(io.BytesIO(names_dmp), chunk_size)) == names
+            nodes_dmp = (NODES_DMP.replace("\n", "\n\n") + " ").encode()
+            assert list(parser.parse_refseq_nodes_fast(io.BytesIO(nodes_dmp), chunk_size)) == nodes
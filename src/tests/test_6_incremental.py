@@ -0,0 +1,199 @@
+import json
+
+from hub.databuild.incremental import TaxdumpDiff
+from taxonomy.tree import TaxonomyTree
+
+OLD_NODES = [
+    (1, 1, "no rank"),
+    (2, 1, "superkingdom"),
+    (3, 2, "genus"),
+    (4, 2, "genus"),
+    (5, 3, "species"),
+    (6, 4, "species"),
+    (10, 1, "superkingdom"),
+    (11, 10, "genus"),
+]
+NEW_NODES = [
+    (1, 1, "no rank"),
+    (2, 1, "superkingdom"),
+    (3, 10, "genus"),       # moved from 2 to 10
+    (4, 2, "subgenus"),     # rank changed
+    (5, 3, "species"),
+    (10, 1, "superkingdom"),
+    (11, 10, "genus"),
+    (12, 11, "species"),    # added
+]                           # 6 removed
+
+
+class TestTaxdumpDiff:
+
+    def test_601_diff(self):
+        diff = TaxdumpDiff(TaxonomyTree.from_nodes(OLD_NODES), TaxonomyTree.from_nodes(NEW_NODES))
+        assert diff.added == {12}
+        assert diff.removed == {6}
+        assert diff.reparented == {3}
+        assert diff.modified == {4}
+
+    def test_602_affected(self):
+        diff = TaxdumpDiff(TaxonomyTree.from_nodes(OLD_NODES), TaxonomyTree.from_nodes(NEW_NODES))
+        # subtree of 3, old/new parents 2 and 10, 4 (rank and lost child 6),
+        # 12 and its parent 11
+        assert diff.affected_taxids() == {2, 3, 4, 5, 10, 11, 12}
+        assert diff.affected_taxids(has_gene_changed=[1, 99]) == {1, 2, 3, 4, 5, 10, 11, 12}
+
+    def test_603_names(self):
+        old_names = [0] * 13
+        new_names = [0] * 13
+        new_names[1] = 42
+        diff = TaxdumpDiff(TaxonomyTree.from_nodes(OLD_NODES), TaxonomyTree.from_nodes(NEW_NODES),
+                           old_names, new_names)
+        assert diff.modified == {1, 4}
+
+    def test_604_update_intervals(self):
+        diff = TaxdumpDiff(TaxonomyTree.from_nodes(OLD_NODES), TaxonomyTree.from_nodes(NEW_NODES))
+        # only moved 3 (and 5) and added 12 get a new interval
+        assert diff.update_intervals() == {3, 5, 12}
+        for taxid in (1, 2, 4, 10, 11):
+            assert diff.new_tree.index_interval(taxid) == diff.old_tree.index_interval(taxid)
+        dfs_in, dfs_out = diff.new_tree.index_interval(10)
+        for taxid in (3, 5, 11, 12):
+            assert dfs_in < diff.new_tree.index_interval(taxid)[0] <= dfs_out
+
+    def test_605_sync(self):
+        from hub.databuild.syncer import TaxonomySyncer, taxid_ranges
+
+        class Client:
+            def __init__(self):
+                self.actions = []
+
+            def bulk(self, body):
+                lines = [json.loads(line) for line in body.decode().splitlines()]
+                while lines:
+                    action = lines.pop(0)
+                    name = next(iter(action))
+                    self.actions.append((name, action[name]["_id"],
+                                         None if name == "delete" else lines.pop(0)))
+                return {"errors": False, "items": []}
+
+        assert taxid_ranges([1, 2, 3, 5, 8], 2) == [(1, 5), (5, 9)]
+        old_tree = TaxonomyTree.from_nodes(OLD_NODES)
+        new_tree = TaxonomyTree.from_nodes(NEW_NODES)
+        old_tree.set_has_gene([5])
+        new_tree.set_has_gene([5, 11])
+        diff = TaxdumpDiff(old_tree, new_tree)
+        # skip docs rebuilt from names.dmp (added and modified ones)
+        diff.added.clear()
+        diff.modified.clear()
+        client = Client()
+        syncer = TaxonomySyncer(client, "mytaxon", diff, None, has_gene_changed=[11],
+                                batch_size=2, workers=3)
+        report = syncer.run()
+        actions = {taxid: (name, body) for name, taxid, body in client.actions}
+        assert actions["6"] == ("delete", None)
+        # only changed fields are sent
+        assert actions["5"][1]["doc"]["lineage"] == [5, 3, 10, 1]
+        assert "has_gene" not in actions["5"][1]["doc"]
+        assert actions["11"][1]["doc"]["has_gene"] is True
+        assert actions["11"][1]["doc"]["children"] == [12]
+        assert "lineage" not in actions["11"][1]["doc"]
+        assert actions["4"][1]["doc"]["children"] == []
+        assert actions["4"][1]["doc"]["rank"] == "subgenus"
+        assert "1" not in actions
+        assert report["delete"] == 1
+        # no subtree had to be renumbered, added 12 isn't rebuilt here (see
+        # above) so only gets its new interval, reported apart
+        assert actions["12"][1]["doc"].keys() == {"dfs_in", "dfs_out"}
+        assert report["intervals"] == 1 and report["intervals_bytes"] > 0
+        assert report["update"] == len(client.actions) - 2
+        assert report["docs"] == len(client.actions) - 1
+        assert report["bytes"] > 0
+
+    def test_606_sync_full_build(self, monkeypatch):
+        import hub.databuild.syncer as syncer
+        from hub.databuild.mapper import LineageMapper
+
+        def full_build(nodes, has_gene):
+            # as post_merge: nodes in (Mongo scan) arbitrary order
+            tree = TaxonomyTree.from_nodes(sorted(nodes, key=lambda node: -node[0]))
+            tree.set_has_gene(has_gene)
+            tree.compute_dfs_intervals()
+            docs = [{"_id": str(taxid), "taxid": taxid, "parent_taxid": parent, "rank": rank,
+                     "has_gene": tree.has_gene(taxid)} for taxid, parent, rank in nodes]
+            return {doc.pop("_id"): doc for doc in LineageMapper(name="lineage", tree=tree).process(docs)}
+
+        class Client:
+            def __init__(self, docs):
+                self.docs = docs
+
+            def bulk(self, body):
+                lines = [json.loads(line) for line in body.decode().splitlines()]
+                while lines:
+                    action = lines.pop(0)
+                    name = next(iter(action))
+                    _id = action[name]["_id"]
+                    if name == "delete":
+                        self.docs.pop(_id)
+                    elif name == "index":
+                        self.docs[_id] = lines.pop(0)
+                    else:
+                        self.docs[_id].update(lines.pop(0)["doc"])
+                return {"errors": False, "items": []}
+
+        def build_docs(taxids, tree, names_folder):
+            # names aren't part of this index, docs of added nodes are tree fields only
+            for taxid in taxids:
+                yield dict(syncer.tree_fields(tree, taxid), _id=str(taxid), taxid=taxid)
+
+        monkeypatch.setattr(syncer, "build_docs", build_docs)
+        client = Client(full_build(OLD_NODES, [5]))
+        # old and new releases read in nodes.dmp order
+        diff = TaxdumpDiff(TaxonomyTree.from_nodes(OLD_NODES), TaxonomyTree.from_nodes(NEW_NODES))
+        diff.old_tree.set_has_gene([5])
+        diff.new_tree.set_has_gene([5, 11])
+        syncer.TaxonomySyncer(client, "mytaxon", diff, None, has_gene_changed=[11],
+                              workers=2, dropped_fields=()).run()
+        expected = full_build(NEW_NODES, [5, 11])
+        # intervals depend on past syncs, they only have to match subtrees
+        intervals = {_id: (doc.pop("dfs_in"), doc.pop("dfs_out")) for _id, doc in client.docs.items()}
+        for doc in expected.values():
+            del doc["dfs_in"], doc["dfs_out"]
+        assert client.docs == expected
+        for _id, (dfs_in, dfs_out) in intervals.items():
+            subtree = [other for other, (other_in, _) in intervals.items() if dfs_in <= other_in <= dfs_out]
+            assert sorted(map(int, subtree)) == sorted(diff.new_tree.subtree(int(_id)))
+
+    def test_607_incremental_update(self, monkeypatch):
+        import hub.databuild.incremental as incremental
+        from pymongo import ReplaceOne, UpdateOne
+
+        # 2 > 3..1002, each with a child, 3 gets a new one (before all others in pre-order)
+        old_nodes = [(1, 1, "no rank"), (2, 1, "genus")] + \
+            [(taxid, 2, "species") for taxid in range(3, 1003)] + \
+            [(taxid + 1000, taxid, "no rank") for taxid in range(3, 1003)]
+        new_nodes = old_nodes + [(5000, 3, "no rank")]
+        old_tree = TaxonomyTree.from_nodes(old_nodes)
+
+        class Collection:
+            def __init__(self):
+                self.ops = []
+
+            def find(self, query, projection):
+                if "has_gene" in query:
+                    return []
+                return [dict(zip(("taxid", "dfs_in", "dfs_out"), (taxid,) + old_tree.index_interval(taxid)))
+                        for taxid in old_tree.taxids]
+
+            def bulk_write(self, ops, ordered):
+                self.ops.extend(ops)
+
+        target_col = Collection()
+        monkeypatch.setattr(incremental.mongo, "get_target_db", lambda: {"mytaxon": target_col})
+        monkeypatch.setattr(incremental, "load_has_gene_taxids", lambda: set())
+        monkeypatch.setattr(TaxdumpDiff, "from_folders", classmethod(
+            lambda cls, old, new: cls(TaxonomyTree.from_nodes(old_nodes), TaxonomyTree.from_nodes(new_nodes))))
+        monkeypatch.setattr(incremental, "build_docs", lambda taxids, tree, folder, batch_size: (
+            {"_id": str(taxid), "taxid": taxid, "dfs_in": tree.index_interval(taxid)[0]} for taxid in taxids))
+        incremental.incremental_update("mytaxon", "old", "new")
+        # the new node and its parent, no interval shift for the other 2000 docs
+        assert sorted(op._filter["_id"] for op in target_col.ops if isinstance(op, ReplaceOne)) == ["3", "5000"]
+        assert not [op for op in target_col.ops if isinstance(op, UpdateOne)]
@@ -0,0 +1,40 @@
+import time
+
+from web.cache import LRUCache
+
+
+class TestLRUCache:
+
+    def test_701_lru(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('9606', {'taxid': 9606})
+        cache.set('10090', {'taxid': 10090})
+        assert cache.get('9606') == {'taxid': 9606}
+        cache.set('7227', {'taxid': 7227})
+        # 10090 is the least recently used
+        assert cache.get('10090') is None
+        assert cache.get('9606') == {'taxid': 9606}
+        assert cache.stats()['hits'] == 2
+        assert cache.stats()['misses'] == 1
+        assert cache.stats()['evictions'] == 1
+
+    def test_702_copies(self):
+        cache = LRUCache()
+        doc = {'lineage': [9606, 1]}
+        cache.set('9606', doc)
+        doc['lineage'].append(2)
+        cache.get('9606')['lineage'].append(3)
+        assert cache.get('9606') == {'lineage': [9606, 1]}
+
+    def test_703_ttl_and_version(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('9606', 1)
+        time.sleep(0.02)
+        assert cache.get('9606') is None
+        cache.ttl = 60
+        cache.set_version('mytaxon_20211017')
+        cache.set('9606', 1)
+        cache.set_version('mytaxon_20211017')
+        assert len(cache) == 1
+        cache.set_version('mytaxon_20211117')
+        assert len(cache) == 0
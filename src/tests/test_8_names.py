@@ -0,0 +1,53 @@
+import pytest
+
+from taxonomy.names import NamesIndex, abbreviate_scientific_name
+
+DOCS = [
+    {"taxid": 9606, "rank": "species", "scientific_name": "Homo sapiens", "genbank_common_name": "human",
+     "common_name": ["man", "human being"], "other_names": ["Homo sapiens sapiens"]},
+    {"taxid": 9605, "rank": "genus", "scientific_name": "Homo"},
+    {"taxid": 10090, "rank": "species", "scientific_name": "Mus musculus", "common_name": "house mouse"},
+    {"taxid": 2759, "rank": "superkingdom", "scientific_name": "Eukaryota"},
+    {"taxid": 33208, "rank": "kingdom", "scientific_name": "Metazoa group"},
+]
+
+
+@pytest.fixture
+def index():
+    return NamesIndex.from_docs(DOCS)
+
+
+class TestNamesIndex:
+
+    def test_801_lookup(self, index):
+        assert index.lookup("homo SAPIENS") == [
+            {"taxid": 9606, "name": "Homo sapiens", "field": "scientific_name"}]
+        assert index.lookup("Homo sapiens", case_sensitive=True)[0]["taxid"] == 9606
+        assert index.lookup("homo sapiens", case_sensitive=True) == []
+        assert index.lookup("Homo sapien") == []
+        assert index.lookup("") == []
+
+    def test_802_prefix(self, index):
+        hits = index.lookup("hom", prefix=True)
+        assert [hit["name"] for hit in hits] == ["Homo", "Homo sapiens", "Homo sapiens sapiens"]
+        assert [hit["name"] for hit in index.lookup("hu", prefix=True, limit=1)] == ["human"]
+        assert index.lookup("zz", prefix=True) == []
+
+    def test_803_abbreviations(self, index):
+        assert abbreviate_scientific_name("Homo sapiens", "species") == ("H. sapiens",)
+        assert abbreviate_scientific_name("Homo", "genus") == ()
+        assert index.lookup("h. sapiens") == [
+            {"taxid": 9606, "name": "H. sapiens", "field": "abbreviation"}]
+        assert index.lookup("M. musculus")[0]["taxid"] == 10090
+        # only binomials at species rank and below
+        assert index.lookup("m. group") == []
+        entries = [index.entry(idx) for idx in range(len(index))]
+        assert [entry["taxid"] for entry in entries if entry["field"] == "abbreviation"] == [9606, 10090]
+
+    def test_804_save_open(self, index, tmp_path):
+        path = str(tmp_path / "names.index")
+        index.save(path, {"names": 3})
+        opened = NamesIndex.open(path)
+        assert len(opened) == len(index)
+        assert opened.metadata == {"names": 3}
+        assert opened.lookup("house mouse") == index.lookup("house mouse")
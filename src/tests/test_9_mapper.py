@@ -0,0 +1,58 @@
+import datetime
+
+from hub.databuild import mapper
+from hub.databuild.mapper import ScientificNameAbbreviationMapper, abbreviate_scientific_name
+from taxonomy.tree import TaxonomyTree
+
+
+def set_upload_started_at(main_source, name, started_at):
+    # hub DB set up by hub modules imports
+    mapper.get_src_dump().replace_one({"_id": main_source},
+                                      {"_id": main_source, "upload": {"jobs": {name: {"started_at": started_at}}}},
+                                      upsert=True)
+
+
+class TestScientificNameAbbreviationMapper:
+
+    def test_901_abbreviate(self):
+        assert abbreviate_scientific_name("Homo sapiens", "species") == ("H. sapiens",)
+        assert abbreviate_scientific_name("Homo sp. 1", "species") == ()
+        assert abbreviate_scientific_name("Mus musculus domesticus", "subspecies") == (
+            "M. musculus ssp. domesticus", "M. musculus subsp. domesticus")
+        assert abbreviate_scientific_name("Escherichia coli K-12", "strain") == (
+            "E. coli str. K-12",)
+        assert abbreviate_scientific_name("Homo", "species") == ()
+
+    def test_902_process_batch(self):
+        mapper = ScientificNameAbbreviationMapper(name="scientific_name_abbreviation")
+        docs = [
+            {"taxid": 9606, "rank": "species", "scientific_name": "Homo sapiens"},
+            {"taxid": 10090, "rank": "species", "scientific_name": "Mus musculus",
+             "other_names": ["M. musculus", "house mouse"]},
+            {"taxid": 9605, "rank": "genus", "scientific_name": "Homo"},
+            {"taxid": 562, "rank": "species", "scientific_name": "Escherichia coli",
+             "other_names": ["bacillus coli"]},
+        ]
+        docs = list(mapper.process(iter(docs)))
+        assert docs[0]["other_names"] == ["H. sapiens"]
+        assert docs[1]["other_names"] == ["M. musculus", "house mouse"]
+        assert "other_names" not in docs[2]
+        assert docs[3]["other_names"] == ["bacillus coli", "E. coli"]
+        stats = mapper.get_stats()
+        assert stats["processed"] == 4
+        assert stats["abbreviated"] == 2
+        assert stats["names_added"] == 2
+
+
+class TestTreeSnapshot:
+
+    def test_903_outdated(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(mapper.config, "TAXONOMY_SNAPSHOT", str(tmp_path / "tree.snapshot"), raising=False)
+        set_upload_started_at("taxonomy", "nodes", datetime.datetime(2024, 1, 1))
+        set_upload_started_at("geneinfo", "geneinfo", datetime.datetime(2024, 1, 2))
+        tree = TaxonomyTree.from_nodes([(1, 1, "no rank"), (2, 1, "species")])
+        tree.save_snapshot(mapper.tree_snapshot_path(), mapper.tree_snapshot_metadata())
+        assert mapper.open_tree_snapshot().children(1) == [2]
+        # same number of docs, different data
+        set_upload_started_at("geneinfo", "geneinfo", datetime.datetime(2024, 2, 1))
+        assert mapper.open_tree_snapshot() is None
@@ -62,3 +62,20 @@ class MyTaxonTests(BiothingsWebAppTest):
         r1s = set(r1l)
         r2s = set(str(i) for i in r2)
         assert r1s == r2s
+
+    def test_expand_all_has_gene(self):
+        res = self.request(
+            'taxon', method='POST',
+            data={
+                'ids': ['1280'],
+                'expand_species': True,
+                'expand_all': True,
+                'has_gene': True,
+            }
+        ).json()
+        assert set(str(i) for i in res) == {'1280', '282459'}
+
+    def test_ancestors_query(self):
+        # ancestors aren't indexed, query is rewritten on lineage
+        res = self.request('query?q=ancestors:1280').json()
+        assert set(hit['_id'] for hit in res['hits']) == {'282459', '1346071'}
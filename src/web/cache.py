@@ -0,0 +1,67 @@
+"""
+In-process response cache for the web tier.
+
+Entries are evicted least recently used first once maxsize is reached, and
+expire after ttl seconds. The cache also records the build (concrete index)
+it was filled from, and is cleared when that changes.
+"""
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+
+class LRUCache(object):
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Cached value for key (a copy, callers may modify it), or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return deepcopy(value)
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, deepcopy(value))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def set_version(self, version):
+        """Clear the cache if version (eg. index name) changed"""
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,286 @@
+import itertools
+import os
+import time
+
+from biothings.web.handlers import BaseAPIHandler, BaseHandler
+from biothings.web.query.pipeline import QueryPipelineException
+from tornado.web import HTTPError, RequestHandler
+
+from taxonomy.names import NamesIndex
+from taxonomy.tree import TaxonomyTree
+
+from .metrics import METRICS
+
+
+class CacheStatsHandler(BaseAPIHandler):
+    """Hit/miss counters of the taxon lookups cache"""
+
+    name = 'cache'
+
+    def get(self):
+        self.finish(self.biothings.pipeline.cache.stats())
+
+
+class MetricsHandler(BaseHandler):
+    """Request metrics, in Prometheus text format (not an API endpoint)"""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.finish(METRICS.render())
+
+
+class Snapshot(object):
+    """
+    Object memory-mapped with open_func from a file written by the hub (see
+    TAXONOMY_SNAPSHOT and TAXONOMY_NAMES_INDEX in config), reopened when the
+    file is replaced.
+    """
+
+    # how often (seconds) the file is checked for changes
+    CHECK_INTERVAL = 30
+
+    def __init__(self, path, open_func):
+        self.path = path
+        self.open_func = open_func
+        self.value = None
+        self.mtime = None
+        self.checked = 0
+
+    def get(self):
+        now = time.monotonic()
+        if self.value is None or now - self.checked >= self.CHECK_INTERVAL:
+            self.checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != self.mtime:
+                self.value, self.mtime = self.open_func(self.path), mtime
+        return self.value
+
+    @classmethod
+    def from_config(cls, handler, setting, open_func):
+        """Value of the file set in config, shared by all handlers"""
+        path = getattr(handler.biothings.config, setting, None)
+        if not path:
+            raise HTTPError(503, reason="%s not configured." % setting)
+        if path not in SNAPSHOTS:
+            SNAPSHOTS[path] = cls(path, open_func)
+        value = SNAPSHOTS[path].get()
+        if value is None:
+            raise HTTPError(503, reason="%s not available." % setting)
+        return value
+
+
+# path -> Snapshot
+SNAPSHOTS = {}
+
+
+def open_tree(path):
+    tree = TaxonomyTree.open_snapshot(path)
+    if tree.dfs_in is None:
+        tree.compute_dfs_intervals()
+    return tree
+
+
+class TreeHandler(BaseAPIHandler):
+    """
+    Answer tree questions from the in-process taxonomy tree instead of ES.
+    Taxid pairs are given as "a:b" strings (or [a, b] in JSON bodies), each
+    answered in a few microseconds, so thousands can be sent per request.
+    """
+
+    kwargs = dict(BaseAPIHandler.kwargs)
+    kwargs['*'] = dict(BaseAPIHandler.kwargs.get('*', {}),
+                       pairs={'type': list, 'default': None, 'max': 10000})
+
+    @property
+    def tree(self):
+        return Snapshot.from_config(self, 'TAXONOMY_SNAPSHOT', open_tree)
+
+    @staticmethod
+    def parse_pair(pair):
+        try:
+            if isinstance(pair, str):
+                pair = pair.split(':')
+            first, second = pair
+            return int(first), int(second)
+        except (TypeError, ValueError):
+            raise HTTPError(400, reason="Invalid pair %r, expecting 'taxid:taxid'." % (pair,))
+
+    def answer(self, tree, first, second):
+        raise NotImplementedError()
+
+    def get(self):
+        if not self.args.pairs:
+            raise HTTPError(400, reason="Missing required parameter 'pairs'.")
+        tree = self.tree
+        res = []
+        for pair in self.args.pairs:
+            first, second = self.parse_pair(pair)
+            hit = {'query': pair}
+            try:
+                hit.update(self.answer(tree, first, second))
+            except KeyError:
+                hit['notfound'] = True
+            res.append(hit)
+        self.finish(res)
+
+    post = get
+
+
+class LCAHandler(TreeHandler):
+    """
+    Lowest common ancestor of each pair, or of all taxids given in ids.
+    """
+
+    name = 'lca'
+    kwargs = dict(TreeHandler.kwargs)
+    kwargs['*'] = dict(TreeHandler.kwargs['*'], ids={'type': list, 'default': None, 'max': 10000})
+
+    def answer(self, tree, first, second):
+        return {'lca': tree.lca((first, second))}
+
+    def get(self):
+        if self.args.ids:
+            try:
+                taxids = [int(taxid) for taxid in self.args.ids]
+            except ValueError:
+                raise HTTPError(400, reason="Invalid taxids.")
+            try:
+                self.finish({'query': self.args.ids, 'lca': self.tree.lca(taxids)})
+            except KeyError as e:
+                raise HTTPError(404, reason="Taxid %s not found." % e.args[0])
+        else:
+            super().get()
+
+    post = get
+
+
+class DescendantHandler(TreeHandler):
+    """
+    For each "taxid:ancestor" pair, whether taxid is (or is below) ancestor
+    """
+
+    name = 'descendant'
+
+    def answer(self, tree, taxid, ancestor):
+        return {'descendant': tree.is_ancestor(ancestor, taxid)}
+
+
+class PathHandler(TreeHandler):
+    """
+    For each "source:target" pair, taxids from source up to their lowest
+    common ancestor and down to target
+    """
+
+    name = 'path'
+
+    def answer(self, tree, source, target):
+        return {'path': tree.path(source, target)}
+
+
+class NameHandler(BaseAPIHandler):
+    """
+    Resolve names to taxids from the names index (not ES), for each of the
+    names given in q: case-insensitive matches by default, exact matches with
+    case_sensitive, names starting with q with prefix (typeahead).
+    Abbreviated genus names ("H. sapiens") are matched too.
+    """
+
+    name = 'name'
+    kwargs = dict(BaseAPIHandler.kwargs)
+    kwargs['*'] = dict(BaseAPIHandler.kwargs.get('*', {}),
+                       q={'type': list, 'default': None, 'max': 10000},
+                       prefix={'type': bool, 'default': False},
+                       case_sensitive={'type': bool, 'default': False},
+                       size={'type': int, 'default': 10, 'max': 1000})
+
+    def get(self):
+        if not self.args.q:
+            raise HTTPError(400, reason="Missing required parameter 'q'.")
+        index = Snapshot.from_config(self, 'TAXONOMY_NAMES_INDEX', NamesIndex.open)
+        res = []
+        for name in self.args.q:
+            hits = index.lookup(name, prefix=self.args.prefix,
+                                case_sensitive=self.args.case_sensitive,
+                                limit=self.args.size)
+            res.append({'query': name, 'hits': hits} if hits else {'query': name, 'notfound': True})
+        self.finish(res)
+
+    post = get
+
+
+class ChildrenHandler(BaseAPIHandler):
+    """
+    Stream the children list of a taxon from the in-process taxonomy tree,
+    as a chunked JSON response: {"taxid": ..., "children": [...],
+    "children_count": ...}. Lists of high fan-out nodes (Bacteria, Viruses)
+    are sent CHUNK_SIZE taxids at a time, without loading them from ES
+    _source nor building the whole body. Only children flagged as having
+    genes with has_gene, paged with children_from/children_size.
+
+    Without TAXONOMY_SNAPSHOT in config, lists are read from ES docs, the
+    response being the same.
+    """
+
+    name = 'children'
+    kwargs = dict(BaseAPIHandler.kwargs)
+    kwargs['*'] = dict(BaseAPIHandler.kwargs.get('*', {}),
+                       has_gene={'type': bool, 'default': False, 'alias': ['children_has_gene']},
+                       children_from={'type': int, 'default': 0},
+                       children_size={'type': int, 'default': None})
+
+    # number of taxids written per chunk
+    CHUNK_SIZE = 10000
+
+    async def es_children(self, taxid):
+        """Children list of taxid from its ES doc, the whole list is loaded"""
+        try:
+            doc = await self.biothings.pipeline.fetch(
+                str(taxid), include_children=True, has_gene=self.args.has_gene)
+        except QueryPipelineException as exc:
+            raise HTTPError(exc.code, reason=exc.summary)
+        return doc.get('children') or []
+
+    async def get(self, taxid):
+        if self.format != 'json':
+            raise HTTPError(400, reason="Children lists are only streamed as JSON.")
+        taxid = int(taxid)
+        start, size = self.args.children_from, self.args.children_size
+        if start < 0 or (size is not None and size < 0):
+            raise HTTPError(400, reason="children_from and children_size can't be negative.")
+        stop = None if size is None else start + size
+        count = None
+        if getattr(self.biothings.config, 'TAXONOMY_SNAPSHOT', None):
+            tree = Snapshot.from_config(self, 'TAXONOMY_SNAPSHOT', open_tree)
+            if taxid not in tree:
+                raise HTTPError(404, reason="Taxid %s not found." % taxid)
+            children = tree.iter_children(taxid, has_gene=self.args.has_gene)
+            if not self.args.has_gene:
+                count = tree.children_count(taxid)
+        else:
+            children = await self.es_children(taxid)
+            count = len(children)
+        if count is None:
+            # has_gene children are counted while streamed, in a single pass
+            consumed = itertools.count()
+            children = (child for child, _ in zip(children, consumed))
+        children = iter(children)
+        page = itertools.islice(children, start, stop)
+
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        # written as is, not serialized by BaseAPIHandler.write
+        RequestHandler.write(self, '{"taxid":%d,"children":[' % taxid)
+        separator = ''
+        while True:
+            chunk = list(itertools.islice(page, self.CHUNK_SIZE))
+            if not chunk:
+                break
+            RequestHandler.write(self, separator + ','.join(map(str, chunk)))
+            separator = ','
+            await self.flush()
+        if count is None:
+            count = next(consumed) + sum(1 for _ in children)
+        RequestHandler.write(self, '],"children_count":%d}' % count)
+        self.finish()
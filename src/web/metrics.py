@@ -0,0 +1,141 @@
+"""
+Request metrics of the web pipeline, in Prometheus text format (/metrics).
+
+Histograms are labelled with the endpoint (annotation, query) and option
+flags of the request being served (include_children, has_gene,
+expand_species, raw), set once per request in a context variable by the
+pipeline and read by the backend and the formatter:
+
+- mytaxon_request_seconds: whole pipeline time of a request
+- mytaxon_es_seconds: ES requests round-trip time, as seen by the client
+- mytaxon_es_took_seconds: ES reported processing time ("took")
+- mytaxon_transform_seconds: result transformation time
+- mytaxon_response_docs: number of docs in a response
+- mytaxon_response_children: size of children lists in returned docs
+
+Observing a value is a bisect and a few increments on plain Python objects,
+no locks: the web app runs in a single thread (tornado IOLoop).
+"""
+import bisect
+import contextvars
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+# request option flags metrics are split by
+FLAGS = ('include_children', 'has_gene', 'expand_species', 'raw')
+LABEL_NAMES = ('endpoint',) + FLAGS
+# outside of a pipeline request (eg. status checks)
+DEFAULT_LABELS = ('other',) + ('false',) * len(FLAGS)
+
+# labels of the request being served
+REQUEST_LABELS = contextvars.ContextVar('mytaxon_request_labels', default=None)
+
+
+class Histogram(object):
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one count per bucket, last one for values above all bounds (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """Histograms by metric name and labels values"""
+
+    # name -> (help, buckets)
+    DEFINITIONS = {
+        'mytaxon_request_seconds': ("Pipeline time of requests.", LATENCY_BUCKETS),
+        'mytaxon_es_seconds': ("Round-trip time of ES requests.", LATENCY_BUCKETS),
+        'mytaxon_es_took_seconds': ("ES reported processing time of ES requests.", LATENCY_BUCKETS),
+        'mytaxon_transform_seconds': ("Result transformation time.", LATENCY_BUCKETS),
+        'mytaxon_response_docs': ("Number of docs in responses.", SIZE_BUCKETS),
+        'mytaxon_response_children': ("Size of children lists in returned docs.", SIZE_BUCKETS),
+    }
+
+    def __init__(self):
+        # name -> {labels values: Histogram}
+        self.histograms = {name: {} for name in self.DEFINITIONS}
+
+    def observe(self, name, value, labels=None):
+        """Add value to histogram name, for labels (the current request's by default)"""
+        if labels is None:
+            labels = REQUEST_LABELS.get() or DEFAULT_LABELS
+        series = self.histograms[name]
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(self.DEFINITIONS[name][1])
+        histogram.observe(value)
+
+    def clear(self):
+        for series in self.histograms.values():
+            series.clear()
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for name, series in self.histograms.items():
+            lines.append('# HELP %s %s' % (name, self.DEFINITIONS[name][0]))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, histogram in sorted(series.items()):
+                labels_str = ','.join('%s="%s"' % item for item in zip(LABEL_NAMES, labels))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels_str, bound, cumulative))
+                lines.append('%s_sum{%s} %s' % (name, labels_str, histogram.sum))
+                lines.append('%s_count{%s} %d' % (name, labels_str, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+class RequestTimer(object):
+    """
+    Context manager timing a pipeline request (mytaxon_request_seconds), and
+    labelling metrics observed meanwhile. Nested requests (fetch calling
+    search) are accounted in the outermost one.
+    """
+
+    __slots__ = ('endpoint', 'options', 'token', 'start')
+
+    def __init__(self, endpoint, options):
+        self.endpoint = endpoint
+        self.options = options
+        self.token = None
+
+    def __enter__(self):
+        if REQUEST_LABELS.get() is None:
+            options = self.options
+            labels = (self.endpoint,) + tuple(
+                'true' if options.get(flag) else 'false' for flag in FLAGS)
+            self.token = REQUEST_LABELS.set(labels)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.token is not None:
+            METRICS.observe('mytaxon_request_seconds', time.perf_counter() - self.start)
+            REQUEST_LABELS.reset(self.token)
+            self.token = None
+
+
+def observe_es(start, response=None):
+    """Record an ES request started at start (perf_counter), and its took time"""
+    METRICS.observe('mytaxon_es_seconds', time.perf_counter() - start)
+    try:
+        took = response['took']
+    except (KeyError, TypeError):
+        # eg. mget responses
+        return
+    METRICS.observe('mytaxon_es_took_seconds', took / 1000)
@@ -1,3 +1,8 @@
+import asyncio
+import re
+import time
+from collections import Counter
+
 from biothings.web.query import (
     AsyncESQueryBackend,
     AsyncESQueryPipeline,
@@ -5,29 +10,78 @@ from biothings.web.query import (
     ESResultFormatter,
 )
 from biothings.web.query.engine import RawResultInterrupt
+from biothings.web.query.pipeline import QueryPipelineException, capturesESExceptions
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch_dsl import Q, Search
+
+from .cache import LRUCache
+from .metrics import METRICS, RequestTimer, observe_es
+
+
+def params_key(params):
+    return tuple(sorted(params.items()))
 
 
 class MytaxonQueryBuilder(ESQueryBuilder):
 
+    # ancestors (lineage without the taxon itself) aren't stored in compact
+    # indices, queries on them are rewritten on lineage
+    ANCESTORS_QUERY = re.compile(r'\bancestors:(\d+)\b')
+
+    @staticmethod
+    def source_filter(options):
+        """_source (includes, excludes) of docs, depending on options"""
+        if options.get('expand_species') or options.get('include_children'):
+            # only the children list returned is loaded (both can be huge)
+            if options.get('has_gene'):
+                children, skipped = "_has_gene_children", "children"
+            else:
+                children, skipped = "children", "_has_gene_children"
+            include = ["*", children]
+            if options.get('expand_species'):
+                # subtree bounds are needed to expand beyond direct children
+                include += ["depth", "dfs_in", "dfs_out"]
+            return (include, [skipped, "ancestors"])
+        else:
+            return ([], ["children", "_has_gene_children", "ancestors"])
+
+    def default_string_query(self, q, options):
+        q = self.ANCESTORS_QUERY.sub(r'(lineage:\1 AND NOT taxid:\1)', q)
+        return super().default_string_query(q, options)
+
+    def default_match_query(self, q, scopes, options):
+        scopes = [scopes] if isinstance(scopes, str) else list(scopes)
+        if 'ancestors' not in scopes:
+            return super().default_match_query(q, scopes, options)
+        # lenient like multi_match, non numeric queries just don't match
+        query = Q('bool', filter=[Q('match', lineage={'query': q, 'lenient': True})],
+                  must_not=[Q('match', taxid={'query': q, 'lenient': True})])
+        scopes = [scope for scope in scopes if scope != 'ancestors']
+        if scopes:
+            others = super().default_match_query(q, scopes, options).to_dict()['query']
+            query = Q('bool', should=[query, Q(others)], minimum_should_match=1)
+        return Search().query(query)
+
     def apply_extras(self, search, options):
-        if options.get('include_children') or options.get('expand_species'):
-            search = search.source(
-                include=["*", "children", "_has_gene_children"],
-                exclude=["ancestors"]
-            )
+        include, exclude = self.source_filter(options)
+        if include:
+            search = search.source(include=include, exclude=exclude)
         else:
-            search = search.source(
-                exclude=["children", "_has_gene_children", "ancestors"]
-            )
+            search = search.source(exclude=exclude)
 
         return super().apply_extras(search, options)
 
 
 class MytaxonQueryBackend(AsyncESQueryBackend):
 
+    def get_index(self, options):
+        return self.indices.get(options.get('biothing_type')) or self.indices[None]
+
     async def execute(self, query, **options):
         raw = options.pop('raw', False)
+        start = time.perf_counter()
         res = await super().execute(query, **options)
+        observe_es(start, res)
         if raw:
             raise RawResultInterrupt(res)
         return res
@@ -35,6 +89,26 @@ class MytaxonQueryBackend(AsyncESQueryBackend):
 
 class MytaxonTransform(ESResultFormatter):
 
+    # transform() calls itself for each response of a multi-search,
+    # only the outermost call is timed
+    transforming = False
+
+    def transform(self, response, **options):
+        if self.transforming:
+            return super().transform(response, **options)
+        self.transforming = True
+        start = time.perf_counter()
+        try:
+            return super().transform(response, **options)
+        finally:
+            self.transforming = False
+            METRICS.observe('mytaxon_transform_seconds', time.perf_counter() - start)
+            for res in response if isinstance(response, list) else (response,):
+                try:
+                    METRICS.observe('mytaxon_response_docs', len(res['hits']['hits']))
+                except (KeyError, TypeError):
+                    pass
+
     def transform_hit(self, path, obj, doc, options):
         super().transform_hit(path, obj, doc, options)
 
@@ -43,16 +117,268 @@ class MytaxonTransform(ESResultFormatter):
                 if options.get('has_gene'):
                     doc['children'] = doc.get('_has_gene_children', [])
                 doc.pop('_has_gene_children', None)
+                children = doc.get('children') or []
+                doc['children_count'] = len(children)
+                # expansions need complete lists
+                if not options.get('expand_species'):
+                    start = options.get('children_from') or 0
+                    size = options.get('children_size')
+                    if start or size is not None:
+                        doc['children'] = children = children[
+                            start:None if size is None else start + size]
+                METRICS.observe('mytaxon_response_children', len(children))
 
 
 class MytaxonQueryPipeline(AsyncESQueryPipeline):
 
+    # max number of taxids a subtree expansion returns, larger subtrees
+    # are a 400 error rather than a partial list
+    EXPAND_MAX_SIZE = 100000
+    # page size when fetching a subtree
+    EXPAND_PAGE_SIZE = 10000
+    # single id lookups cache, 0 to disable
+    CACHE_SIZE = 4096
+    CACHE_TTL = 600
+    # how often (seconds) the index behind the alias is checked,
+    # the cache is cleared when it changes (new build released)
+    CACHE_VERSION_CHECK = 30
+    # options changing the output of a lookup
+    CACHE_KEY_OPTIONS = (
+        'biothing_type', '_source', 'include_children', 'has_gene',
+        'children_from', 'children_size',
+        'expand_species', 'expand_all', 'expand_depth', 'expand_rank',
+        'dotfield', '_sorted', 'always_list', 'allow_null',
+    )
+    # list of ids lookups are sent as mget of at most MGET_CHUNK_SIZE ids,
+    # with at most MGET_CONCURRENCY of them running at once
+    MGET_CHUNK_SIZE = 500
+    MGET_CONCURRENCY = 8
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = LRUCache(self.CACHE_SIZE, self.CACHE_TTL)
+        self.cache_checked = 0
+        # (index, _source filter, id) -> future of the doc being fetched,
+        # shared by concurrent requests looking up the same ids
+        self.inflight = {}
+        self.mget_semaphore = None
+        # running mget_chunk tasks
+        self.mget_tasks = set()
+
+    def cache_key(self, id, options):
+        key = [str(id).strip()]
+        for name in self.CACHE_KEY_OPTIONS:
+            value = options.get(name)
+            key.append(tuple(value) if isinstance(value, list) else value)
+        return tuple(key)
+
+    async def check_cache_version(self, options):
+        now = time.monotonic()
+        if now - self.cache_checked < self.CACHE_VERSION_CHECK:
+            return
+        self.cache_checked = now
+        alias = self.backend.get_index(options)
+        try:
+            indices = await self.backend.client.indices.get_alias(name=alias)
+            version = ",".join(sorted(indices))
+        except NotFoundError:
+            # not an alias, a concrete index name is a version
+            version = alias
+        except Exception:
+            # unreachable, cached docs are kept until the next check
+            return
+        self.cache.set_version(version)
+
+    @staticmethod
+    def check_children_options(options):
+        if (options.get('children_from') or 0) < 0 or (options.get('children_size') or 0) < 0:
+            raise QueryPipelineException(400, "children_from and children_size can't be negative.")
+
+    async def search(self, q, **options):
+        self.check_children_options(options)
+        with RequestTimer('query', options):
+            return await super().search(q, **options)
+
     async def fetch(self, id, **options):
-        res = await super().fetch(id, **options)
+        self.check_children_options(options)
+        with RequestTimer('annotation', options):
+            if not self.CACHE_SIZE or not isinstance(id, str) or options.get('raw') \
+                    or options.get('rawquery'):
+                return await self._fetch(id, **options)
+            await self.check_cache_version(options)
+            key = self.cache_key(id, options)
+            res = self.cache.get(key)
+            if res is None:
+                res = await self._fetch(id, **options)
+                self.cache.set(key, res)
+            return res
+
+    def mget_source(self, options):
+        """mget _source parameters, as the builder would set them"""
+        if options.get('_source') and 'all' not in options['_source']:
+            # explicit fields replace the default filter, see apply_extras
+            return {"_source_includes": ",".join(options['_source'])}
+        include, exclude = self.builder.source_filter(options)
+        params = {"_source_excludes": ",".join(exclude)}
+        if include:
+            params["_source_includes"] = ",".join(include)
+        return params
+
+    async def mget_chunk(self, index, ids, params, futures):
+        if self.mget_semaphore is None:
+            self.mget_semaphore = asyncio.Semaphore(self.MGET_CONCURRENCY)
+        try:
+            async with self.mget_semaphore:
+                start = time.perf_counter()
+                res = await self.backend.client.mget(body={"ids": ids}, index=index, **params)
+                observe_es(start)
+            for doc in res["docs"]:
+                future = futures[doc["_id"]]
+                if not future.done():
+                    future.set_result(doc if doc.get("found") else None)
+            for future in futures.values():
+                if not future.done():
+                    future.set_result(None)
+        except Exception as exc:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(exc)
+        finally:
+            # eg. cancelled, requests waiting for these ids must not hang
+            for future in futures.values():
+                future.cancel()
+            for _id in ids:
+                self.inflight.pop((index, params_key(params), _id), None)
+
+    @capturesESExceptions
+    async def mget(self, ids, **options):
+        """
+        Fetch a list of ids, with the same output as a fetch of the list
+        (msearch by _id, ANNOTATION_DEFAULT_SCOPES being _id), using
+        concurrent chunked mget requests. Ids are fetched once per request,
+        and only once across concurrent requests: each chunk is fetched by
+        its own task, so a cancelled request doesn't cancel the others
+        waiting for its ids.
+        """
+        if options.get("scopes"):
+            raise ValueError("Scopes Not Allowed.")
+        # same formatter options as fetch
+        options["version"] = True
+        options["score"] = False
+        options["one"] = True
+        max_match = self.settings.get("fetch_max_match", 1000)
+
+        index = self.backend.get_index(options)
+        params = self.mget_source(options)
+        normalized = [str(_id).strip() for _id in ids]
+        futures = {}
+        missing = []
+        loop = asyncio.get_running_loop()
+        for _id in dict.fromkeys(normalized):
+            key = (index, params_key(params), _id)
+            if key not in self.inflight:
+                self.inflight[key] = loop.create_future()
+                missing.append(_id)
+            futures[_id] = self.inflight[key]
+        for start in range(0, len(missing), self.MGET_CHUNK_SIZE):
+            chunk = missing[start:start + self.MGET_CHUNK_SIZE]
+            task = loop.create_task(self.mget_chunk(
+                index, chunk, params, {_id: futures[_id] for _id in chunk}))
+            # keep a reference until done, nothing else does
+            self.mget_tasks.add(task)
+            task.add_done_callback(self.mget_tasks.discard)
+        # shielded: cancelling this request must not cancel shared futures
+        results = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+        docs = dict(zip(futures, results))
+
+        # same shape as msearch responses, one per query
+        responses = []
+        for _id in normalized:
+            doc = docs[_id]
+            hits = [] if doc is None else [{
+                "_index": doc["_index"], "_id": doc["_id"], "_version": doc.get("_version"),
+                "_score": 1.0, "_source": dict(doc.get("_source", {})),
+            }]
+            responses.append({"hits": {"total": {"value": len(hits), "relation": "eq"},
+                                       "max_score": 1.0 if hits else None, "hits": hits}})
+        result = self.formatter.transform(
+            responses, templates=(dict(query=_id) for _id in ids),
+            template_miss=dict(notfound=True), template_hit=dict(), **options)
+        if result and Counter(hit["query"] for hit in result).most_common(1)[0][1] > max_match:
+            raise QueryPipelineException(500, "Too Many Matches.")
+        return result
+
+    async def _fetch(self, id, **options):
+        if isinstance(id, list) and not options.get('raw') and not options.get('rawquery'):
+            res = await self.mget(id, **options)
+        else:
+            res = await super().fetch(id, **options)
         if options.get('expand_species') and isinstance(res, list):
+            if options.get('expand_all') or options.get('expand_depth', 1) > 1 \
+                    or options.get('expand_rank'):
+                return await self.expand_subtrees(res, **options)
             ids = set()
             for _res in res:
                 ids.add(int(_res['_id']))
                 ids.update(_res.get('children', []))
             return list(ids)
         return res
+
+    def subtree_query(self, hit, **options):
+        """
+        Query matching the subtree of hit, as a single dfs_in range,
+        filtered by depth, rank and has_gene according to options
+        """
+        filters = [{"range": {"dfs_in": {"gte": hit["dfs_in"], "lte": hit["dfs_out"]}}}]
+        if not options.get('expand_all'):
+            filters.append({"range": {"depth": {"lte": hit["depth"] + options.get('expand_depth', 1)}}})
+        if options.get('has_gene'):
+            filters.append({"term": {"has_gene": True}})
+        if options.get('expand_rank'):
+            filters.append({"bool": {
+                "should": [{"match_phrase": {"rank": rank}} for rank in options['expand_rank']],
+                "minimum_should_match": 1}})
+        return {"bool": {"filter": filters}}
+
+    @capturesESExceptions
+    async def expand_subtrees(self, res, **options):
+        """
+        Return taxids of queried nodes, and of their descendants down to
+        expand_depth levels (or all with expand_all), filtered by rank with
+        expand_rank and by has_gene. Each subtree is a single range query on
+        dfs_in, paged in dfs_in order, of at most EXPAND_MAX_SIZE taxids.
+        """
+        index = self.backend.get_index(options)
+        ids = set()
+        for hit in res:
+            if hit.get('notfound'):
+                continue
+            ids.add(int(hit['_id']))
+            if 'dfs_in' not in hit:
+                # doc built without subtree bounds
+                ids.update(hit.get('children', []))
+                continue
+            body = {
+                "query": self.subtree_query(hit, **options),
+                "_source": False,
+                "sort": [{"dfs_in": "asc"}],
+            }
+            fetched = 0
+            while True:
+                # one more than the max size, to tell if the subtree is larger
+                body["size"] = min(self.EXPAND_PAGE_SIZE, self.EXPAND_MAX_SIZE + 1 - fetched)
+                start = time.perf_counter()
+                res = await self.backend.client.search(index=index, body=body)
+                observe_es(start, res)
+                page = res['hits']['hits']
+                fetched += len(page)
+                if fetched > self.EXPAND_MAX_SIZE:
+                    raise QueryPipelineException(
+                        400, "Too Many Matches.",
+                        "Subtree of taxid %s has more than %d matching taxids." % (
+                            hit['_id'], self.EXPAND_MAX_SIZE))
+                ids.update(int(_hit['_id']) for _hit in page)
+                if len(page) < body["size"]:
+                    break
+                body["search_after"] = page[-1]["sort"]
+        return list(ids)